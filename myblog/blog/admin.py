@@ -1,18 +1,171 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db import transaction
 
+from .deletion import restore_post, restore_comment, has_live_parent
 from .models import Post, Comment, UserPostRelation
+from .jobs import enqueue_on_commit
+from .pagination import EstimatedCountPaginator
+from .stats import reconcile_author_stats, reconcile_comments_counts
+from .sync import record_post_deletions, record_comment_deletions
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for tables too big for a COUNT on every page
+    """
+    paginator = EstimatedCountPaginator
+    # Skip the second, unfiltered count shown next to filtered results
+    show_full_result_count = False
+
+
+class AuthorStatsAdmin(LargeTableAdmin):
+    """
+    Admin edits bypass `blog.stats`, the stats of the authors they touch are
+    recomputed by a background job after the commit
+    """
+    # Lookup of the author whose stats count the row
+    stats_author_field = 'author_id'
+
+    def get_stats_author_ids(self, queryset):
+        return set(queryset.values_list(self.stats_author_field, flat=True))
+
+    def reconcile_stats(self, author_ids):
+        if author_ids:
+            enqueue_on_commit(reconcile_author_stats, author_ids=sorted(author_ids))
+
+    def save_model(self, request, obj, form, change):
+        rows = self.get_queryset(request).filter(pk=obj.pk)
+        # The row may have moved to another author
+        author_ids = self.get_stats_author_ids(rows) if change else set()
+        super().save_model(request, obj, form, change)
+        self.reconcile_stats(author_ids | self.get_stats_author_ids(rows))
+
+    def delete_model(self, request, obj):
+        author_ids = self.get_stats_author_ids(self.get_queryset(request).filter(pk=obj.pk))
+        super().delete_model(request, obj)
+        self.reconcile_stats(author_ids)
+
+    def delete_queryset(self, request, queryset):
+        author_ids = self.get_stats_author_ids(queryset)
+        super().delete_queryset(request, queryset)
+        self.reconcile_stats(author_ids)
+
+
+class DeletedListFilter(admin.SimpleListFilter):
+    title = 'deleted'
+    parameter_name = 'deleted'
+
+    def lookups(self, request, model_admin):
+        return [('yes', 'Yes'), ('no', 'No')]
+
+    def queryset(self, request, queryset):
+        if self.value() in ('yes', 'no'):
+            return queryset.filter(deleted_at__isnull=self.value() == 'no')
+        return queryset
+
+
+class SoftDeleteAdmin(AuthorStatsAdmin):
+    """
+    Changelist of live and soft-deleted rows. The unfiltered changelist reads
+    `all_objects`, so its queryset has no WHERE and its count is estimated.
+    Deletions from the admin are for good, their sync tombstones are recorded
+    by `record_deletions`.
+    """
+    actions = ['restore_selected']
+
+    def record_deletions(self, queryset):
+        raise NotImplementedError('.record_deletions() must be overridden')
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            self.record_deletions(self.get_queryset(request).filter(pk=obj.pk))
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            self.record_deletions(queryset)
+            super().delete_queryset(request, queryset)
+
+    def get_queryset(self, request):
+        queryset = self.model.all_objects.get_queryset()
+        ordering = self.get_ordering(request)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return queryset
+
+    def restore_row(self, obj):
+        """
+        Restore a soft-deleted row, returns False if it can't be restored
+        """
+        raise NotImplementedError('.restore_row() must be overridden')
+
+    @admin.action(description='Restore selected deleted rows')
+    def restore_selected(self, request, queryset):
+        # Restores update the stats through `blog.stats`
+        restored = sum(self.restore_row(obj) for obj in queryset.filter(deleted_at__isnull=False))
+        self.message_user(request, f'{restored} rows restored.', messages.SUCCESS)
 
 
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
-    list_display = ['author', 'title', 'status']
+class PostAdmin(SoftDeleteAdmin):
+    list_display = ['author', 'title', 'status', 'deleted_at']
+    list_select_related = ['author']
+    list_filter = ['status', DeletedListFilter, 'created']
+    date_hierarchy = 'created'
+    raw_id_fields = ['author']
+
+    def record_deletions(self, queryset):
+        record_post_deletions(queryset)
+
+    def restore_row(self, obj):
+        restore_post(obj)
+        return True
 
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
-    list_display = ['author', 'post', 'created']
+class CommentAdmin(SoftDeleteAdmin):
+    stats_author_field = 'post__author_id'
+    list_display = ['author', 'post', 'created', 'deleted_at']
+    list_select_related = ['author', 'post']
+    list_filter = [DeletedListFilter, 'created']
+    date_hierarchy = 'created'
+    raw_id_fields = ['author', 'post', 'parent']
+
+    def record_deletions(self, queryset):
+        record_comment_deletions(queryset)
+
+    def reconcile_counts(self, post_ids):
+        # Admin edits bypass `change_comments_count` too
+        enqueue_on_commit(reconcile_comments_counts, post_ids=sorted(post_ids))
+
+    def save_model(self, request, obj, form, change):
+        # The comment may have moved to another post
+        rows = self.get_queryset(request).filter(pk=obj.pk)
+        post_ids = set(rows.values_list('post_id', flat=True)) if change else set()
+        super().save_model(request, obj, form, change)
+        self.reconcile_counts(post_ids | {obj.post_id})
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self.reconcile_counts({obj.post_id})
+
+    def delete_queryset(self, request, queryset):
+        post_ids = set(queryset.values_list('post_id', flat=True))
+        super().delete_queryset(request, queryset)
+        self.reconcile_counts(post_ids)
+
+    def restore_row(self, obj):
+        # Replies of deleted comments and comments of deleted posts stay deleted
+        if obj.post.deleted_at or not has_live_parent(obj):
+            return False
+        restore_comment(obj)
+        return True
 
 
 @admin.register(UserPostRelation)
-class UserPostRelationAdmin(admin.ModelAdmin):
+class UserPostRelationAdmin(AuthorStatsAdmin):
+    stats_author_field = 'post__author_id'
     list_display = ['user', 'post', 'like', 'in_bookmarks']
+    list_select_related = ['user', 'post']
+    list_filter = ['like', 'in_bookmarks']
+    raw_id_fields = ['user', 'post']
@@ -1,6 +1,27 @@
 from django.apps import AppConfig
+from django.contrib.auth import get_user_model
+from django.core.signals import request_finished
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, pre_delete, post_delete
 
 
 class BlogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'blog'
+
+    def ready(self):
+        from blog.autocomplete import clear_suggestions, register_c_collation
+        from blog.counters import flush_views_if_due
+        from blog.models import Post
+        from blog.pagination import invalidate_post_counts
+        from blog.signals import post_published
+        from blog.sync import record_author_deletion
+
+        request_finished.connect(flush_views_if_due, dispatch_uid='blog_flush_views')
+        connection_created.connect(register_c_collation, dispatch_uid='blog_c_collation')
+        for signal in (post_save, post_delete, post_published):
+            signal.connect(invalidate_post_counts, sender=Post, dispatch_uid='blog_invalidate_post_counts')
+            signal.connect(clear_suggestions, sender=Post, dispatch_uid='blog_clear_suggestions')
+        # Posts and comments record their tombstones where they are deleted (`blog.deletion`,
+        # the admin), receivers on them would make every cascaded comment load and signal
+        pre_delete.connect(record_author_deletion, sender=get_user_model(), dispatch_uid='blog_author_tombstones')
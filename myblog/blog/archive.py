@@ -0,0 +1,41 @@
+from django.db import connection, transaction
+
+from blog.models import Comment, ArchivedComment
+
+
+def comments_with_archive(ordering=('created', 'id'), **filters):
+    """
+    Return hot and archived comments matching `filters` as one queryset.
+    Archived rows keep their original ids, so every row is returned as a `Comment`.
+    """
+    hot = Comment.objects.filter(**filters)
+    cold = ArchivedComment.objects.filter(**filters)
+    return hot.union(cold, all=True).order_by(*ordering)
+
+
+def archive_comments(before, batch_size=1000):
+    """
+    Move comments created before `before` into the archive table, oldest first.
+    Every batch is copied and deleted in its own transaction; yields the number
+    of rows moved by each batch.
+    """
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in Comment._meta.concrete_fields)
+    hot_table = quote(Comment._meta.db_table)
+    cold_table = quote(ArchivedComment._meta.db_table)
+
+    while True:
+        with transaction.atomic():
+            # Soft-deleted rows move too, their purge looks in both tables
+            ids = list(Comment.all_objects.filter(created__lt=before)
+                       .order_by('created', 'id')
+                       .values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return
+            placeholders = ', '.join(['%s'] * len(ids))
+            with connection.cursor() as cursor:
+                # Raw statements copy rows without loading them and don't fire delete signals
+                cursor.execute(f'INSERT INTO {cold_table} ({columns}) '
+                               f'SELECT {columns} FROM {hot_table} WHERE id IN ({placeholders})', ids)
+                cursor.execute(f'DELETE FROM {hot_table} WHERE id IN ({placeholders})', ids)
+        yield len(ids)
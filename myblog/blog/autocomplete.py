@@ -0,0 +1,145 @@
+"""
+Title autocomplete for published posts.
+
+Prefixes are matched case-insensitively with `UPPER(title) LIKE 'PREFIX%'`.
+On PostgreSQL the expression is compared in the "C" collation, so both the
+LIKE and the ORDER BY are answered by the `post_title_upper_idx` index and
+only the first matches are read, however many posts there are.
+
+Results are kept in a per-process LRU cache for a few seconds. A longer
+prefix is answered from the cached results of a shorter one when those were
+complete, so typing a word usually queries the database once. The query runs
+under a statement timeout, a slow query returns no suggestions instead of
+holding up the editor.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models.functions import Collate, Upper
+
+from blog.models import Post
+
+logger = logging.getLogger(__name__)
+
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_LENGTH = 100
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache whose entries expire `timeout` seconds after they are set
+    """
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self.entries[key] = (time.monotonic() + self.timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+
+suggestions_cache = LRUCache(settings.BLOG_AUTOCOMPLETE_CACHE_SIZE, settings.BLOG_AUTOCOMPLETE_CACHE_TIMEOUT)
+
+
+def normalize_prefix(prefix):
+    return prefix.lstrip().upper()[:MAX_PREFIX_LENGTH]
+
+
+def title_key():
+    """
+    Expression of the titles matched and ordered, as indexed by `post_title_upper_idx`
+    """
+    if connection.vendor == 'postgresql':
+        return Collate(Upper('title'), 'C')
+    return Upper('title')
+
+
+def query_suggestions(prefix, limit):
+    """
+    (id, title) of published posts whose title starts with `prefix`, None if
+    the query ran out of time
+    """
+    queryset = (Post.objects.published().annotate(title_key=title_key())
+                .filter(title_key__startswith=prefix)
+                .order_by('title_key', 'id').values_list('id', 'title')[:limit])
+    if connection.vendor != 'postgresql':
+        return list(queryset)
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SELECT current_setting('statement_timeout'), "
+                           "set_config('statement_timeout', %s, true)", [str(settings.BLOG_AUTOCOMPLETE_TIMEOUT_MS)])
+            timeout = cursor.fetchone()[0]
+            suggestions = list(queryset)
+            # The local setting lasts until the end of an outer transaction
+            cursor.execute("SELECT set_config('statement_timeout', %s, true)", [timeout])
+        return suggestions
+    except OperationalError:
+        logger.warning('Autocomplete of %r timed out', prefix)
+        return None
+
+
+def get_suggestions(prefix):
+    """
+    (id, title) of the first published posts whose title starts with `prefix`, ignoring case
+    """
+    prefix = normalize_prefix(prefix)
+    if len(prefix) < MIN_PREFIX_LENGTH:
+        return []
+    suggestions = suggestions_cache.get(prefix)
+    if suggestions is not None:
+        return suggestions
+
+    for length in range(len(prefix) - 1, MIN_PREFIX_LENGTH - 1, -1):
+        shorter = suggestions_cache.get(prefix[:length])
+        # Cached lists shorter than the limit hold every match of their prefix
+        if shorter is not None and len(shorter) < settings.BLOG_AUTOCOMPLETE_LIMIT:
+            suggestions = [(pk, title) for pk, title in shorter if title.upper().startswith(prefix)]
+            break
+    else:
+        suggestions = query_suggestions(prefix, settings.BLOG_AUTOCOMPLETE_LIMIT)
+        if suggestions is None:
+            return []
+    suggestions_cache.set(prefix, suggestions)
+    return suggestions
+
+
+def register_c_collation(sender, connection, **kwargs):
+    """
+    `connection_created` receiver giving SQLite the "C" collation of
+    `post_title_upper_idx`, so tables holding it can be rebuilt by migrations
+    """
+    if connection.vendor == 'sqlite':
+        # Code point order, as the byte order of UTF-8 in PostgreSQL
+        connection.connection.create_collation('C', lambda a, b: (a > b) - (a < b))
+
+
+def clear_suggestions(**kwargs):
+    """
+    Receiver for changes of posts, other processes see them when their entries expire
+    """
+    suggestions_cache.clear()
@@ -0,0 +1,117 @@
+"""
+Post view counting without a write per view.
+
+Views are added to a process-local counter and written to `Post.views_count`
+in bulk by `flush_views`, at most every `BLOG_VIEWS_FLUSH_INTERVAL` seconds
+after a request finishes. Views counted since the last flush are lost when
+the process stops.
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, F, Value, When
+
+from blog.models import Post
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedCounter:
+    """
+    Thread-safe counter split into shards, each with its own lock, so
+    concurrent requests rarely wait for each other.
+    """
+    def __init__(self, shards=16):
+        self.shards = [(threading.Lock(), Counter()) for _ in range(shards)]
+        self._next_shard = itertools.count()
+        self._local = threading.local()
+
+    def add(self, key, count=1):
+        # Threads are given shards in turn on their first add
+        if not hasattr(self._local, 'shard'):
+            self._local.shard = self.shards[next(self._next_shard) % len(self.shards)]
+        lock, counts = self._local.shard
+        with lock:
+            counts[key] += count
+
+    def drain(self):
+        """
+        Return the counts and reset the counter
+        """
+        total = Counter()
+        for lock, counts in self.shards:
+            with lock:
+                total.update(counts)
+                counts.clear()
+        return total
+
+
+post_views = ShardedCounter()
+_flush_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def record_view(post_id):
+    post_views.add(post_id)
+
+
+def update_views(counts):
+    """
+    Add `counts` ({post_id: views}) to `Post.views_count` with one UPDATE
+    """
+    if not counts:
+        return
+    if connection.vendor == 'postgresql':
+        table = connection.ops.quote_name(Post._meta.db_table)
+        values = ', '.join(['(%s::bigint, %s::integer)'] * len(counts))
+        params = [value for item in counts.items() for value in item]
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {table} SET views_count = {table}.views_count + v.views '
+                           f'FROM (VALUES {values}) AS v(id, views) WHERE {table}.id = v.id', params)
+    else:
+        Post.objects.filter(id__in=counts).update(views_count=F('views_count') + Case(
+            *[When(id=post_id, then=Value(views)) for post_id, views in counts.items()]
+        ))
+
+
+def flush_views():
+    """
+    Write the views counted by this process, returns the number of posts updated
+    """
+    global _last_flush
+    with _flush_lock:
+        _last_flush = time.monotonic()
+        counts = post_views.drain()
+        try:
+            update_views(counts)
+        except Exception:
+            # Keep the views for the next flush
+            for post_id, views in counts.items():
+                post_views.add(post_id, views)
+            raise
+    return len(counts)
+
+
+def flush_views_if_due(**kwargs):
+    """
+    `request_finished` receiver, the response is already sent.
+    Views are only flushed explicitly if the interval is None.
+    """
+    interval = settings.BLOG_VIEWS_FLUSH_INTERVAL
+    if interval is None or time.monotonic() - _last_flush < interval:
+        return
+    # Django closes the connections of the request before this receiver runs
+    opened = connection.connection is None
+    try:
+        flush_views()
+    except Exception:
+        # Not an error of the request, the views are kept for the next flush
+        logger.exception('Flushing post views failed')
+    finally:
+        if opened:
+            connection.close()
@@ -0,0 +1,180 @@
+"""
+Soft deletion of posts and comments.
+
+Deleting a post only sets its `deleted_at`, so the request does not wait
+for the rows of its comments and relations. The default managers leave
+deleted rows out, and the rows can be restored until they are purged.
+`BLOG_DELETED_RETENTION_DAYS` after the deletion, the `purge_deleted_post`
+job deletes the relations and comments in batches, then the post.
+`manage.py purge_deleted` purges anything left, a batch per transaction.
+
+Stats and sync tombstones are updated when a row is deleted or restored, not
+when it is purged. Deleting or restoring a post changes the counts stored on
+the post in the request. The likes and bookmarks of the post take a scan of its
+relations, so the author's stats are recomputed by the `reconcile_author_stats`
+job. Comments of a deleted post get their tombstones when the post is purged,
+syncing clients drop them with the post.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from blog.jobs import job, enqueue_on_commit
+from blog.models import Post, Comment, ArchivedComment, UserPostRelation, RelatedPost, Tombstone
+from blog.stats import change_stats, change_post_author_stats, change_comments_count, reconcile_author_stats
+
+
+def delete_post(post):
+    """
+    Hide the post in constant time, its relations are taken out of the stats
+    by a job and its purge is queued
+    """
+    with transaction.atomic(savepoint=False):
+        post.deleted_at = timezone.now()
+        post.save(update_fields=['deleted_at', 'updated'])
+        change_stats(post.author_id, posts_count=-1, comments_count=-post.comments_count)
+        Tombstone.objects.create(kind=Tombstone.Kind.POST, object_id=post.id, owner_id=post.author_id)
+        enqueue_on_commit(reconcile_author_stats, author_ids=[post.author_id])
+    retention = timedelta(days=settings.BLOG_DELETED_RETENTION_DAYS)
+    enqueue_on_commit(purge_deleted_post, run_at=post.deleted_at + retention, post_id=post.id)
+
+
+def restore_post(post):
+    with transaction.atomic(savepoint=False):
+        post.deleted_at = None
+        post.save(update_fields=['deleted_at', 'updated'])
+        change_stats(post.author_id, posts_count=1, comments_count=post.comments_count)
+        enqueue_on_commit(reconcile_author_stats, author_ids=[post.author_id])
+
+
+def get_subtree(model, comment):
+    """
+    Rows of the thread under `comment`, `comment` included, in the table of `model`
+    """
+    return model.all_objects.filter(post_id=comment.post_id, path__startswith=comment.path)
+
+
+def delete_comment(comment):
+    """
+    Hide the comment with its replies, they may be in either table
+    """
+    now = timezone.now()
+    deleted = []
+    with transaction.atomic(savepoint=False):
+        for model in (Comment, ArchivedComment):
+            rows = list(get_subtree(model, comment).filter(deleted_at__isnull=True).values_list('id', 'author_id'))
+            if rows:
+                model.all_objects.filter(id__in=[pk for pk, _ in rows]).update(deleted_at=now, updated=now)
+                deleted.extend(rows)
+        Tombstone.objects.bulk_create([Tombstone(kind=Tombstone.Kind.COMMENT, object_id=pk, owner_id=author_id)
+                                       for pk, author_id in deleted])
+        change_post_author_stats(comment.post_id, comments_count=-len(deleted))
+        change_comments_count(comment.post_id, -len(deleted))
+
+
+def has_live_parent(comment):
+    """
+    False if the parent of a reply is deleted, in either table
+    """
+    if not comment.depth:
+        return True
+    # The path of the parent is the path of the reply without its last segment
+    parent_path = comment.path[:comment.path.rstrip('/').rfind('/') + 1]
+    return any(model.objects.filter(post_id=comment.post_id, path=parent_path).exists()
+               for model in (Comment, ArchivedComment))
+
+
+def restore_comment(comment):
+    """
+    Restore the comment with the replies deleted along with it
+    """
+    now = timezone.now()
+    with transaction.atomic(savepoint=False):
+        restored = sum(get_subtree(model, comment).filter(deleted_at=comment.deleted_at)
+                       .update(deleted_at=None, updated=now)
+                       for model in (Comment, ArchivedComment))
+        change_post_author_stats(comment.post_id, comments_count=restored)
+        change_comments_count(comment.post_id, restored)
+
+
+def raw_delete(model, ids):
+    # Raw statements don't load the rows or fire delete signals
+    if not ids:
+        return 0
+    table = connection.ops.quote_name(model._meta.db_table)
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE id IN ({placeholders})', ids)
+    return len(ids)
+
+
+def purge_post(post_id, batch_size=1000):
+    """
+    Delete a deleted post for good, its relations and comments first in
+    batches of `batch_size` rows. Yields the number of rows of every batch.
+    """
+    while True:
+        with transaction.atomic():
+            ids = list(UserPostRelation.objects.filter(post_id=post_id).values_list('id', flat=True)[:batch_size])
+            deleted = raw_delete(UserPostRelation, ids)
+        if not deleted:
+            break
+        yield deleted
+
+    for model in (Comment, ArchivedComment):
+        while True:
+            with transaction.atomic():
+                rows = list(model.all_objects.filter(post_id=post_id)
+                            .values_list('id', 'author_id', 'deleted_at')[:batch_size])
+                # Comments deleted on their own have their tombstones
+                Tombstone.objects.bulk_create([
+                    Tombstone(kind=Tombstone.Kind.COMMENT, object_id=pk, owner_id=author_id)
+                    for pk, author_id, deleted_at in rows if deleted_at is None
+                ])
+                deleted = raw_delete(model, [pk for pk, _, _ in rows])
+            if not deleted:
+                break
+            yield deleted
+
+    with transaction.atomic():
+        RelatedPost.objects.filter(post_id=post_id).delete()
+        yield raw_delete(Post, [post_id])
+
+
+def purge_comments(model, before, batch_size=1000):
+    """
+    Delete comments of `model` deleted before `before` for good, in batches
+    """
+    while True:
+        with transaction.atomic():
+            ids = list(model.all_objects.filter(deleted_at__lt=before)
+                       .order_by('deleted_at').values_list('id', flat=True)[:batch_size])
+            deleted = raw_delete(model, ids)
+        if not deleted:
+            return
+        yield deleted
+
+
+def purge_deleted(before, batch_size=1000):
+    """
+    Purge posts and comments deleted before `before`.
+    Yields the number of rows deleted by every batch.
+    """
+    post_ids = Post.all_objects.filter(deleted_at__lt=before).order_by('deleted_at').values_list('id', flat=True)
+    for post_id in post_ids.iterator():
+        yield from purge_post(post_id, batch_size)
+    for model in (Comment, ArchivedComment):
+        yield from purge_comments(model, before, batch_size)
+
+
+@job
+def purge_deleted_post(post_id):
+    """
+    Purge a post once its retention is over, nothing if it was restored
+    """
+    before = timezone.now() - timedelta(days=settings.BLOG_DELETED_RETENTION_DAYS)
+    if Post.all_objects.filter(id=post_id, deleted_at__lte=before).exists():
+        for _ in purge_post(post_id):
+            pass
@@ -0,0 +1,238 @@
+"""
+Live comment streams.
+
+`add_comment` publishes every new comment once, already encoded as a
+server-sent event, to the channel of its post. The broker fans it out to the
+streams watching the post. The default broker lives in the process, so
+comments added by one worker reach only the streams served by that worker.
+Set `BLOG_EVENTS_BROKER` to a broker shared by the workers when running more
+than one.
+
+Open streams are counted per client in the cache, a client holds at most
+BLOG_EVENTS_MAX_STREAMS of them.
+"""
+import asyncio
+import json
+import threading
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from blog.archive import comments_with_archive
+from blog.models import Post
+from blog.serializers import CommentSerializer
+
+
+class Broker:
+    """
+    Interface of pub/sub backends. Messages are bytes, `publish` can be
+    called from any thread, `subscribe` from the event loop of the stream.
+    """
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def subscribe(self, channel):
+        """
+        Return a `Subscription` receiving the messages published to `channel`
+        """
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+
+class Subscription:
+    """
+    Queue of messages for one stream. A stream that falls more than
+    `size` messages behind is ended, its client reconnects and replays the
+    missed comments.
+    """
+    def __init__(self, channel, size):
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(size)
+
+    def put(self, message):
+        # Runs in the loop of the stream
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.queue = asyncio.Queue()
+            self.queue.put_nowait(None)
+
+    async def get(self, timeout):
+        """
+        Next message, None if the stream fell behind, TimeoutError if nothing came in `timeout` seconds
+        """
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class InMemoryBroker(Broker):
+    """
+    Broker for the streams of this process
+    """
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.channels = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscriptions = list(self.channels.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, message)
+            except RuntimeError:
+                # The loop is closed, the stream is gone
+                self.unsubscribe(subscription)
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel, self.queue_size)
+        with self._lock:
+            self.channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self.channels.get(subscription.channel, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.channels.pop(subscription.channel, None)
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    return import_string(settings.BLOG_EVENTS_BROKER)()
+
+
+def comments_channel(post_id):
+    return f'post.{post_id}.comments'
+
+
+def encode_event(event, event_id, data):
+    """
+    Server-sent event with JSON `data`
+    """
+    return f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+def event_id(message):
+    """
+    Id of an event encoded by `encode_event`
+    """
+    return int(message[4:message.index(b'\n')])
+
+
+def publish_comment(post, comment):
+    """
+    Push a new comment to the streams of its post once the transaction commits.
+    Comments on posts that are not public are not streamed.
+    """
+    if post.status != Post.Status.PUBLISHED or post.publish > timezone.now():
+        return
+    # Encoded once for every watcher
+    message = encode_event('comment', comment.id, CommentSerializer(comment).data)
+    transaction.on_commit(lambda: get_broker().publish(comments_channel(post.id), message))
+
+
+def streams_key(client):
+    return f'blog.streams.{client}'
+
+
+async def open_stream(client):
+    """
+    Count a new stream of `client`, False if it already holds BLOG_EVENTS_MAX_STREAMS streams
+    """
+    key = streams_key(client)
+    # Streams end in BLOG_EVENTS_STREAM_SECONDS, counts of workers that died expire soon after
+    timeout = settings.BLOG_EVENTS_STREAM_SECONDS * 2
+    if await cache.aadd(key, 1, timeout):
+        return True
+    try:
+        count = await cache.aincr(key)
+    except ValueError:
+        # Expired in between, the stream is the only one counted
+        await cache.aadd(key, 1, timeout)
+        return True
+    await cache.atouch(key, timeout)
+    if count > settings.BLOG_EVENTS_MAX_STREAMS:
+        await close_stream(client)
+        return False
+    return True
+
+
+async def close_stream(client):
+    try:
+        await cache.adecr(streams_key(client))
+    except ValueError:
+        # Expired, nothing to release
+        pass
+
+
+def missed_comments(post_id, last_id, limit):
+    """
+    Up to `limit` + 1 comments of the post after `last_id` in both tables,
+    archived parents may still get replies. More than `limit` means the
+    client is too far behind to replay.
+    """
+    comments = list(comments_with_archive(ordering=('id', ), post_id=post_id, id__gt=last_id)[:limit + 1])
+    # UNION querysets can't prefetch, so authors are loaded for the fetched rows only
+    prefetch_related_objects(
+        comments, Prefetch('author', queryset=User.objects.all().only('first_name', 'last_name'))
+    )
+    return comments
+
+
+async def comment_events(post_id, last_id=None, client=None):
+    """
+    Events of the comments added to a post, after the comments since
+    `last_id` if the client is reconnecting. A client that missed more than
+    BLOG_EVENTS_REPLAY_LIMIT comments gets a `refetch` event instead, and
+    reloads the comments through the API. Ends after
+    BLOG_EVENTS_STREAM_SECONDS, clients reconnect with the last id they got,
+    so streams of clients that went away are not kept forever. The stream
+    counted by `open_stream` for `client` is released when it ends.
+    """
+    broker = get_broker()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.BLOG_EVENTS_STREAM_SECONDS
+    # Subscribed before the replay so no comment falls between the two
+    subscription = broker.subscribe(comments_channel(post_id))
+    try:
+        yield b'retry: 1000\n\n'
+        if last_id is not None:
+            limit = settings.BLOG_EVENTS_REPLAY_LIMIT
+            comments = await sync_to_async(missed_comments)(post_id, last_id, limit)
+            if len(comments) > limit:
+                # No id, the client keeps its last one until a live comment comes
+                yield b'event: refetch\ndata: {}\n\n'
+                last_id = None
+                comments = []
+            for comment in comments:
+                last_id = comment.id
+                yield encode_event('comment', comment.id, CommentSerializer(comment).data)
+
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                message = await subscription.get(min(settings.BLOG_EVENTS_HEARTBEAT, remaining))
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle connection
+                yield b': ping\n\n'
+                continue
+            if message is None:
+                # Fell behind, the client replays from its last id
+                return
+            if last_id is None or event_id(message) > last_id:
+                yield message
+    finally:
+        broker.unsubscribe(subscription)
+        if client is not None:
+            await close_stream(client)
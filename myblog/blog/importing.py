@@ -0,0 +1,234 @@
+"""
+Import of posts and comments from JSONL or CSV files, see `manage.py import_blog`.
+
+Rows are streamed from the file and handled a chunk at a time: validated
+with the API serializers, then inserted with one `bulk_create` per model in
+a transaction. If the insert fails, the rows of the chunk are inserted one
+by one in savepoints to find the rejected ones. Rows that fail are written to
+a rejects file and the import goes on.
+
+    {"type": "post", "ref": "p1", "author": "alice", "title": "...", "body": "...", "status": "PB"}
+    {"type": "comment", "ref": "c1", "post": "p1", "author": "bob", "body": "..."}
+    {"type": "comment", "post": "p1", "parent": "c1", "author": "alice", "body": "..."}
+
+`ref` is the id on the old platform. Comments refer to posts and parent
+comments of the same file, which must come before them.
+"""
+import csv
+import json
+from collections import Counter, namedtuple
+
+from django.contrib.auth.models import User
+from django.db import DatabaseError, transaction
+from rest_framework.exceptions import ValidationError
+
+from blog.models import Post, Comment
+from blog.publishing import announce_published
+from blog.serializers import PostSerializer, CommentSerializer
+from blog.stats import change_comments_count
+
+Row = namedtuple('Row', 'line data')
+
+
+def read_jsonl(file):
+    for line, text in enumerate(file, 1):
+        if not text.strip():
+            continue
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = text.rstrip('\n')
+        yield Row(line, data)
+
+
+def read_csv(file):
+    reader = csv.DictReader(file)
+    for data in reader:
+        # Empty cells are missing values, extra cells are dropped
+        yield Row(reader.line_num, {key: value for key, value in data.items() if key and value not in ('', None)})
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class BlogImporter:
+    """
+    Imports chunks of rows, keeping the ids given to the refs of the file
+    """
+    def __init__(self, rejects_path, chunk_size=500):
+        self.rejects_path = rejects_path
+        self.rejects = None
+        self.chunk_size = chunk_size
+        # ref: (id, author_id) of imported posts, ref: id of imported comments
+        self.posts = {}
+        self.comments = {}
+        # Authors whose stats changed
+        self.author_ids = set()
+        self.counts = Counter(posts=0, comments=0, rejected=0)
+
+    def reject(self, row, errors):
+        if self.rejects is None:
+            self.rejects = open(self.rejects_path, 'w')
+        self.rejects.write(json.dumps({'line': row.line, 'row': row.data, 'errors': errors}) + '\n')
+        self.counts['rejected'] += 1
+
+    def close(self):
+        if self.rejects is not None:
+            self.rejects.close()
+
+    def import_rows(self, rows):
+        """
+        Import `rows`, yields the number of rows of every chunk
+        """
+        for chunk in chunked(rows, self.chunk_size):
+            posts, comments = [], []
+            for row in chunk:
+                kind = row.data.get('type') if isinstance(row.data, dict) else None
+                if not isinstance(row.data, dict):
+                    self.reject(row, {'non_field_errors': ['Expected a JSON object.']})
+                elif kind not in ('post', 'comment'):
+                    self.reject(row, {'type': ['Expected "post" or "comment".']})
+                elif not isinstance(row.data.get('author', ''), str):
+                    # Looked up by value below, a list or an object can't be
+                    self.reject(row, {'author': ['Expected a username.']})
+                elif kind == 'post':
+                    posts.append(row)
+                else:
+                    comments.append(row)
+
+            usernames = {row.data.get('author') for row in posts + comments}
+            users = dict(User.objects.filter(username__in=usernames - {None}).values_list('username', 'id'))
+            self.import_posts(posts, users)
+            self.import_comments(comments, users)
+            yield len(chunk)
+
+    def insert(self, rows, objects, after_insert=None):
+        """
+        Insert the objects of `rows` in one query, row by row if it fails.
+        Returns the rows and objects inserted.
+        """
+        if not objects:
+            return []
+        model = type(objects[0])
+        inserted = list(zip(rows, objects))
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create(objects)
+                if after_insert:
+                    after_insert(objects)
+            return inserted
+        except DatabaseError:
+            pass
+
+        created = []
+        for row, obj in inserted:
+            obj.pk = None
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create([obj])
+                    if after_insert:
+                        after_insert([obj])
+            except DatabaseError as error:
+                self.reject(row, {'non_field_errors': [str(error)]})
+            else:
+                created.append((row, obj))
+        return created
+
+    def import_posts(self, rows, users):
+        serializer = PostSerializer(fields=('title', 'body', 'status', 'publish'))
+        valid, posts = [], []
+        for row in rows:
+            author_id = users.get(row.data.get('author'))
+            errors = {} if author_id else {'author': ['Unknown user.']}
+            try:
+                data = serializer.run_validation(row.data)
+            except ValidationError as error:
+                errors.update(error.detail)
+            if errors:
+                self.reject(row, errors)
+                continue
+            valid.append(row)
+            # Inserted without `Post.save`
+            posts.append(Post(author_id=author_id, was_published=data.get('status') == Post.Status.PUBLISHED, **data))
+
+        inserted = self.insert(valid, posts)
+        for row, post in inserted:
+            if 'ref' in row.data:
+                self.posts[str(row.data['ref'])] = (post.id, post.author_id)
+            self.author_ids.add(post.author_id)
+        self.counts['posts'] += len(inserted)
+        # bulk_create sends no post_save
+        announce_published(post.id for _, post in inserted if post.status == Post.Status.PUBLISHED)
+
+    def import_comments(self, rows, users):
+        # Replies to comments of the same chunk wait until their parent is in
+        while rows:
+            ready, waiting = [], []
+            for row in rows:
+                parent = row.data.get('parent')
+                (ready if parent is None or str(parent) in self.comments else waiting).append(row)
+            if not ready:
+                for row in waiting:
+                    self.reject(row, {'parent': ['Unknown comment.']})
+                return
+            self.import_comment_batch(ready, users)
+            rows = waiting
+
+    def import_comment_batch(self, rows, users):
+        serializer = CommentSerializer(fields=('body', ))
+        parent_ids = {self.comments[str(row.data['parent'])] for row in rows if row.data.get('parent') is not None}
+        parents = Comment.objects.only('id', 'post_id', 'depth', 'path').in_bulk(parent_ids)
+        valid, comments = [], []
+        for row in rows:
+            author_id = users.get(row.data.get('author'))
+            post_id, post_author_id = self.posts.get(str(row.data.get('post')), (None, None))
+            errors = {} if author_id else {'author': ['Unknown user.']}
+            if post_id is None:
+                errors['post'] = ['Unknown post.']
+            try:
+                data = serializer.run_validation(row.data)
+            except ValidationError as error:
+                errors.update(error.detail)
+            parent = parents.get(self.comments.get(str(row.data.get('parent'))))
+            if parent is None and row.data.get('parent') is not None:
+                # Deleted since it was imported
+                errors['parent'] = ['Unknown comment.']
+            elif parent is not None and post_id is not None:
+                try:
+                    # The rules of replies made through the API
+                    CommentSerializer(context={'post': Post(id=post_id)}).validate_parent(parent)
+                except ValidationError as error:
+                    errors['parent'] = error.detail
+            if errors:
+                self.reject(row, errors)
+                continue
+            depth = parent.depth + 1 if parent else 0
+            valid.append(row)
+            comments.append(Comment(author_id=author_id, post_id=post_id, parent=parent, depth=depth, **data))
+            self.author_ids.add(post_author_id)
+
+        inserted = self.insert(valid, comments, after_insert=self.after_comments_insert)
+        for row, comment in inserted:
+            if 'ref' in row.data:
+                self.comments[str(row.data['ref'])] = comment.id
+        self.counts['comments'] += len(inserted)
+
+    def after_comments_insert(self, comments):
+        self.fill_paths(comments)
+        for post_id, count in Counter(comment.post_id for comment in comments).items():
+            change_comments_count(post_id, count)
+
+    @staticmethod
+    def fill_paths(comments):
+        # `save` is skipped by bulk_create, the paths need the new ids
+        for comment in comments:
+            comment.path = comment.build_path()
+        Comment.objects.bulk_update(comments, ['path'])
@@ -0,0 +1,132 @@
+"""
+Database-backed queue for work that does not have to finish inside a request.
+
+Functions decorated with `@job` are queued with `enqueue_on_commit` and run
+by `manage.py run_jobs`. Workers claim due jobs with
+`SELECT ... FOR UPDATE SKIP LOCKED`, so any number of them can share the
+table. A failed job is retried with exponential backoff up to its
+`max_attempts`, then left with the FAILED status. A job is deleted once it
+has run.
+
+Jobs still running `BLOG_JOBS_TIMEOUT` seconds after they started are taken
+as left by a worker that died: they are claimed again, or failed once they
+used their attempts. A worker refreshes the lock of every job of its batch
+as the job starts, and skips jobs taken over by another worker meanwhile.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from blog.models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def job(func=None, *, max_attempts=5):
+    """
+    Mark `func` as a job, queued under its dotted path.
+    Keyword arguments of the job are stored as JSON.
+    """
+    def register(func):
+        func.job_name = f'{func.__module__}.{func.__qualname__}'
+        func.max_attempts = max_attempts
+        return func
+    return register(func) if func is not None else register
+
+
+def get_job_function(name):
+    func = import_string(name)
+    # Only functions marked with @job can be run from the table
+    if getattr(func, 'job_name', None) != name:
+        raise ImportError(f'{name} is not a job.')
+    return func
+
+
+def enqueue(func, run_at=None, **kwargs):
+    return Job.objects.create(name=func.job_name, kwargs=kwargs, max_attempts=func.max_attempts,
+                              run_at=run_at or timezone.now())
+
+
+def enqueue_on_commit(func, **kwargs):
+    """
+    Queue a job once the transaction commits, nothing is queued on rollback
+    """
+    transaction.on_commit(lambda: enqueue(func, **kwargs))
+
+
+def fail_stale_jobs(stale):
+    """
+    Fail jobs that timed out on their last attempt instead of running them again
+    """
+    return (Job.objects.filter(status=Job.Status.RUNNING, locked_at__lt=stale, attempts__gte=F('max_attempts'))
+            .update(status=Job.Status.FAILED, locked_at=None,
+                    last_error=f'Not finished after {settings.BLOG_JOBS_TIMEOUT} seconds.'))
+
+
+def claim_jobs(batch_size=10):
+    """
+    Lock due jobs for this worker, and jobs of workers that died while running them
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.BLOG_JOBS_TIMEOUT)
+    failed = fail_stale_jobs(stale)
+    if failed:
+        logger.error('%s jobs timed out on their last attempt', failed)
+    with transaction.atomic():
+        ids = list(Job.objects.select_for_update(skip_locked=True)
+                   .filter(Q(status=Job.Status.QUEUED, run_at__lte=now) |
+                           Q(status=Job.Status.RUNNING, locked_at__lt=stale, attempts__lt=F('max_attempts')))
+                   .order_by('run_at')
+                   .values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return []
+        Job.objects.filter(id__in=ids).update(status=Job.Status.RUNNING, locked_at=now,
+                                              attempts=F('attempts') + 1)
+    return list(Job.objects.filter(id__in=ids).order_by('run_at'))
+
+
+def start_job(job):
+    """
+    Refresh the lock of a claimed job as it starts, so the time it waited in
+    the batch does not count against its timeout. Returns False if another
+    worker took the job over in the meantime.
+    """
+    now = timezone.now()
+    started = Job.objects.filter(id=job.id, status=Job.Status.RUNNING, locked_at=job.locked_at).update(locked_at=now)
+    job.locked_at = now
+    return bool(started)
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=settings.BLOG_JOBS_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def run_job(job):
+    """
+    Run a claimed job, returns True if it succeeded, None if it was taken over
+    """
+    if not start_job(job):
+        return None
+    try:
+        # A failed job leaves nothing half done for its retry
+        with transaction.atomic():
+            get_job_function(job.name)(**job.kwargs)
+    except Exception:
+        logger.exception('Job %s %s failed, attempt %s of %s', job.id, job.name, job.attempts, job.max_attempts)
+        if job.attempts < job.max_attempts:
+            job.status = Job.Status.QUEUED
+            job.run_at = timezone.now() + retry_delay(job.attempts)
+        else:
+            job.status = Job.Status.FAILED
+        job.locked_at = None
+        job.last_error = traceback.format_exc()
+        job.save(update_fields=['status', 'run_at', 'locked_at', 'last_error'])
+        return False
+    job.delete()
+    return True
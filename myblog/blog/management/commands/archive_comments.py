@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from blog.archive import archive_comments
+
+
+class Command(BaseCommand):
+    help = 'Move comments older than the hot retention period into the archive table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.BLOG_COMMENTS_HOT_DAYS,
+                            help='Comments created more than this many days ago are archived')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        total = 0
+        for moved in archive_comments(before, batch_size=options['batch_size']):
+            total += moved
+            self.stdout.write(f'Archived {total} comments')
+        self.stdout.write(self.style.SUCCESS(f'Done, {total} comments archived'))
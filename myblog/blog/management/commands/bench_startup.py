@@ -0,0 +1,77 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Runs in a fresh interpreter, so imports are not warmed up by this process
+BENCH_SCRIPT = '''
+import asyncio
+import importlib
+import json
+import sys
+import time
+from wsgiref.util import setup_testing_defaults
+
+entrypoint, path = sys.argv[1], sys.argv[2]
+started = time.perf_counter()
+application = importlib.import_module(entrypoint).application
+imported = time.perf_counter()
+
+if entrypoint.endswith('wsgi'):
+    environ = {'PATH_INFO': path, 'HTTP_ACCEPT': 'application/json'}
+    setup_testing_defaults(environ)
+    statuses = []
+    body = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b''.join(body)
+    status = int(statuses[0].split()[0])
+else:
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+             'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+             'root_path': '', 'headers': [(b'host', b'localhost'), (b'accept', b'application/json')],
+             'client': ('127.0.0.1', 0), 'server': ('localhost', 80)}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    status = messages[0]['status']
+
+responded = time.perf_counter()
+print(json.dumps({'import': imported - started, 'first_response': responded - imported, 'status': status}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Measure import time and time to first response of the WSGI and ASGI entrypoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', action='append', dest='profiles',
+                            help='Settings module to measure, can be repeated '
+                                 '(default: myblog.settings and myblog.settings_api)')
+        parser.add_argument('--path', default='/api/posts/', help='Path of the first request')
+        parser.add_argument('--runs', type=int, default=3, help='Runs per measurement, the median is reported')
+
+    def measure(self, profile, entrypoint, path):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': profile}
+        result = subprocess.run([sys.executable, '-c', BENCH_SCRIPT, entrypoint, path],
+                                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True)
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        profiles = options['profiles'] or ['myblog.settings', 'myblog.settings_api']
+        self.stdout.write(f'{"settings":<24}{"entrypoint":<14}{"import, ms":>12}{"first response, ms":>20}  status')
+        for profile in profiles:
+            for entrypoint in ('myblog.wsgi', 'myblog.asgi'):
+                runs = [self.measure(profile, entrypoint, options['path']) for _ in range(options['runs'])]
+                import_time = statistics.median(run['import'] for run in runs) * 1000
+                response_time = statistics.median(run['first_response'] for run in runs) * 1000
+                self.stdout.write(f'{profile:<24}{entrypoint:<14}{import_time:>12.1f}'
+                                  f'{response_time:>20.1f}  {runs[-1]["status"]}')
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from blog.related import build_related_posts
+
+
+class Command(BaseCommand):
+    help = 'Recompute the related posts of every post from likes and bookmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='Related posts kept per post')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Posts scored per query')
+        parser.add_argument('--min-common', type=int, default=2,
+                            help='Fewest common readers of related posts')
+        parser.add_argument('--max-user-posts', type=int, default=1000,
+                            help='Users engaged with more posts than this are left out')
+
+    def handle(self, *args, **options):
+        total = 0
+        for scored in build_related_posts(top=options['top'], chunk_size=options['chunk_size'],
+                                          min_common=options['min_common'],
+                                          max_user_posts=options['max_user_posts']):
+            total += scored
+            self.stdout.write(f'Scored {total} posts')
+        self.stdout.write(self.style.SUCCESS(f'Done, related posts of {total} posts built'))
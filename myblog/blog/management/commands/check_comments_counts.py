@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from blog.stats import check_comments_counts
+
+
+class Command(BaseCommand):
+    help = 'Compare the comment counts of posts with their comments, and correct them with --fix'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Correct the wrong counts')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = 0
+        wrong_total = 0
+        for checked, wrong in check_comments_counts(batch_size=options['batch_size'], fix=options['fix']):
+            total += checked
+            wrong_total += len(wrong)
+            for post_id, stored, actual in wrong:
+                self.stdout.write(self.style.WARNING(f'Post {post_id} counts {stored} comments, has {actual}'))
+            self.stdout.write(f'Checked {total} posts')
+        fixed = ', fixed' if options['fix'] else ''
+        self.stdout.write(self.style.SUCCESS(f'Done, {total} posts checked, {wrong_total} wrong{fixed}'))
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.importing import BlogImporter, read_csv, read_jsonl
+from blog.stats import rebuild_author_stats
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv}
+
+
+class Command(BaseCommand):
+    help = 'Import posts and comments from a JSONL or CSV file, see blog.importing for the format'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=READERS, help='Format of the file (default: from its extension)')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Rows validated and inserted at once')
+        parser.add_argument('--rejects', help='File of the rejected rows (default: <path>.rejects.jsonl)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if file_format not in READERS:
+            raise CommandError(f'Unknown format of {path}, pass --format.')
+        rejects_path = options['rejects'] or f'{path}.rejects.jsonl'
+
+        importer = BlogImporter(rejects_path, chunk_size=options['chunk_size'])
+        started = time.monotonic()
+        total = 0
+        try:
+            with open(path, newline='', encoding='utf-8') as file:
+                for imported in importer.import_rows(READERS[file_format](file)):
+                    total += imported
+                    rate = total / max(time.monotonic() - started, 1e-6)
+                    self.stdout.write(f'Read {total} rows: {importer.counts["posts"]} posts, '
+                                      f'{importer.counts["comments"]} comments, '
+                                      f'{importer.counts["rejected"]} rejected, {rate:.0f} rows/s')
+        finally:
+            importer.close()
+
+        # Counters are skipped by bulk inserts
+        author_ids = sorted(importer.author_ids)
+        for start in range(0, len(author_ids), 1000):
+            rebuild_author_stats(author_ids[start:start + 1000])
+        self.stdout.write(f'Rebuilt stats of {len(author_ids)} users')
+
+        message = (f'Done, {importer.counts["posts"]} posts and {importer.counts["comments"]} comments '
+                   f'imported in {time.monotonic() - started:.1f}s')
+        if importer.counts['rejected']:
+            self.stdout.write(self.style.WARNING(f'{message}, {importer.counts["rejected"]} rows rejected, '
+                                                 f'see {rejects_path}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
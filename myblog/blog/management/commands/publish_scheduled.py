@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from blog.publishing import publish_due_posts
+
+
+class Command(BaseCommand):
+    help = 'Publish scheduled posts whose publish time has come, run it every minute from cron'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        total = 0
+        for published in publish_due_posts(batch_size=options['batch_size']):
+            total += published
+            self.stdout.write(f'Published {total} posts')
+        self.stdout.write(self.style.SUCCESS(f'Done, {total} posts published'))
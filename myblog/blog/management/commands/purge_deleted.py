@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from blog.deletion import purge_deleted
+
+
+class Command(BaseCommand):
+    help = 'Delete for good the posts and comments soft-deleted before the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.BLOG_DELETED_RETENTION_DAYS,
+                            help='Rows deleted more than this many days ago are purged')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        total = 0
+        for deleted in purge_deleted(before, batch_size=options['batch_size']):
+            total += deleted
+            self.stdout.write(f'Purged {total} rows')
+        self.stdout.write(self.style.SUCCESS(f'Done, {total} rows purged'))
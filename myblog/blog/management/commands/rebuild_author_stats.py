@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from blog.stats import rebuild_all_author_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-author stats from posts, relations and comments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = 0
+        for rebuilt in rebuild_all_author_stats(batch_size=options['batch_size']):
+            total += rebuilt
+            self.stdout.write(f'Rebuilt stats of {total} users')
+        self.stdout.write(self.style.SUCCESS(f'Done, stats of {total} users rebuilt'))
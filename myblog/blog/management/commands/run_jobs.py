@@ -0,0 +1,61 @@
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from blog.jobs import claim_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help='Number of worker threads')
+        parser.add_argument('--batch-size', type=int, default=10, help='Jobs claimed by a worker at once')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when no job is due')
+        parser.add_argument('--once', action='store_true', help='Exit when no job is due')
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.ran = self.failed = 0
+        if options['concurrency'] == 1:
+            self.work(options)
+        else:
+            threads = [threading.Thread(target=self.work, args=(options, ), daemon=True)
+                       for _ in range(options['concurrency'])]
+            for thread in threads:
+                thread.start()
+            try:
+                for thread in threads:
+                    thread.join()
+            except KeyboardInterrupt:
+                # Let the workers finish the jobs they claimed
+                self.stopping.set()
+                for thread in threads:
+                    thread.join()
+        self.stdout.write(self.style.SUCCESS(f'Done, {self.ran} jobs run, {self.failed} failed'))
+
+    def work(self, options):
+        try:
+            while not self.stopping.is_set():
+                # A worker runs for days, drop connections the database closed
+                if not connection.in_atomic_block:
+                    close_old_connections()
+                jobs = claim_jobs(options['batch_size'])
+                if not jobs:
+                    if options['once']:
+                        return
+                    self.stopping.wait(options['poll_interval'])
+                    continue
+                results = [run_job(job) for job in jobs]
+                with self.lock:
+                    self.ran += results.count(True)
+                    self.failed += results.count(False)
+                    self.stdout.write(f'Ran {self.ran} jobs, {self.failed} failed')
+        except KeyboardInterrupt:
+            self.stopping.set()
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:04
+
+from django.db import migrations, models
+from django.db.models.functions import Cast, Concat, LPad
+import django.db.models.deletion
+
+
+def fill_paths(apps, schema_editor):
+    # Existing comments are all top-level, their path is their own id
+    path = Concat(LPad(Cast('id', models.CharField()), 12, models.Value('0')), models.Value('/'))
+    for model_name in ('Comment', 'ArchivedComment'):
+        apps.get_model('blog', model_name).objects.filter(path='').update(path=path)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_archivedcomment_comment_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='archivedcomment',
+            name='archcomment_post_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_post_created_idx',
+        ),
+        migrations.AddField(
+            model_name='archivedcomment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='archivedcomment',
+            name='parent',
+            field=models.BigIntegerField(blank=True, db_column='parent_id', null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedcomment',
+            name='path',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='replies', to='blog.comment'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='archivedcomment',
+            index=models.Index(fields=['post', 'path'], name='archcomment_post_path_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+        ),
+    ]
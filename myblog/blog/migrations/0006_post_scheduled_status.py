@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_comment_threads'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='status',
+            field=models.CharField(choices=[('DF', 'DRAFT'), ('SC', 'SCHEDULED'), ('PB', 'PUBLISHED')], default='DF', max_length=2),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['status', 'publish'], name='post_status_publish_idx'),
+        ),
+    ]
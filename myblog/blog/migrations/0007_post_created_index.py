@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_post_scheduled_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['created'], name='post_created_idx'),
+        ),
+    ]
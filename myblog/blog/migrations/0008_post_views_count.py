@@ -0,0 +1,20 @@
+# Generated by Django 4.2.7 on 2026-10-19 11:02
+
+from django.db import migrations, models
+
+import blog.operations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_post_created_index'),
+    ]
+
+    operations = [
+        blog.operations.AddFieldWithoutRewrite(
+            model_name='post',
+            name='views_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:21
+
+import datetime
+
+from django.db import migrations, models
+
+import blog.operations
+
+
+class Migration(migrations.Migration):
+    # Indexes on hot tables are built concurrently
+    atomic = False
+
+    dependencies = [
+        ('blog', '0009_authorstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('post', 'POST'), ('comment', 'COMMENT')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('owner_id', models.BigIntegerField()),
+                ('deleted', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['deleted', 'id'], name='tombstone_deleted_idx')],
+            },
+        ),
+        # Existing relations are dated before any sync token
+        blog.operations.AddFieldWithoutRewrite(
+            model_name='userpostrelation',
+            name='updated',
+            field=models.DateTimeField(auto_now=True,
+                                       default=datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)),
+            preserve_default=False,
+        ),
+        blog.operations.AddIndexConcurrently(
+            model_name='archivedcomment',
+            index=models.Index(fields=['author', 'updated'], name='archcomment_author_updated_idx'),
+        ),
+        blog.operations.AddIndexConcurrently(
+            model_name='comment',
+            index=models.Index(fields=['author', 'updated'], name='comment_author_updated_idx'),
+        ),
+        blog.operations.AddIndexConcurrently(
+            model_name='post',
+            index=models.Index(fields=['updated', 'id'], name='post_updated_idx'),
+        ),
+        blog.operations.AddIndexConcurrently(
+            model_name='userpostrelation',
+            index=models.Index(fields=['user', 'updated'], name='relation_user_updated_idx'),
+        ),
+    ]
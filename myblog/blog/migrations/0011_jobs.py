@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_sync_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('kwargs', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('QU', 'QUEUED'), ('RU', 'RUNNING'), ('FL', 'FAILED')], default='QU', max_length=2)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('max_attempts', models.PositiveSmallIntegerField(default=5)),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'QU')), fields=['run_at'], name='job_queued_run_at_idx'), models.Index(condition=models.Q(('status', 'RU')), fields=['locked_at'], name='job_running_locked_at_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:40
+
+from django.db import migrations, models
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+
+import blog.operations
+
+
+class Migration(migrations.Migration):
+    # Indexes on hot tables are built concurrently
+    atomic = False
+
+    dependencies = [
+        ('blog', '0012_relatedpost'),
+    ]
+
+    operations = [
+        blog.operations.AddPostgresIndexConcurrently(
+            model_name='post',
+            index=models.Index(
+                django.db.models.functions.comparison.Collate(django.db.models.functions.text.Upper('title'), 'C'),
+                name='post_title_upper_idx',
+            ),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:36
+
+from django.db import migrations, models
+
+import blog.operations
+
+
+class Migration(migrations.Migration):
+    # Indexes on hot tables are built concurrently
+    atomic = False
+
+    dependencies = [
+        ('blog', '0013_post_title_upper_idx'),
+    ]
+
+    operations = [
+        blog.operations.AddFieldWithoutRewrite(
+            model_name='archivedcomment',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        blog.operations.AddFieldWithoutRewrite(
+            model_name='comment',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        blog.operations.AddFieldWithoutRewrite(
+            model_name='post',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        blog.operations.AddIndexConcurrently(
+            model_name='archivedcomment',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'],
+                               name='archcomment_deleted_at_idx'),
+        ),
+        blog.operations.AddIndexConcurrently(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'],
+                               name='comment_deleted_at_idx'),
+        ),
+        blog.operations.AddIndexConcurrently(
+            model_name='post',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'],
+                               name='post_deleted_at_idx'),
+        ),
+        # The listing index is replaced by one without deleted posts, built before the old one is dropped
+        blog.operations.AddIndexConcurrently(
+            model_name='post',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['status', 'publish'],
+                               name='post_live_status_publish_idx'),
+        ),
+        blog.operations.RemoveIndexConcurrently(
+            model_name='post',
+            name='post_status_publish_idx',
+        ),
+    ]
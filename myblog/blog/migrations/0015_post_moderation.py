@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:40
+
+from django.db import migrations, models
+
+import blog.operations
+
+
+class Migration(migrations.Migration):
+    # Indexes on hot tables are built concurrently
+    atomic = False
+
+    dependencies = [
+        ('blog', '0014_soft_delete'),
+    ]
+
+    operations = [
+        blog.operations.AddFieldWithoutRewrite(
+            model_name='post',
+            name='needs_review',
+            field=models.BooleanField(default=False),
+        ),
+        blog.operations.AddIndexConcurrently(
+            model_name='post',
+            index=models.Index(condition=models.Q(models.Q(('status', 'DF'), ('needs_review', True), _connector='OR'),
+                                                  ('deleted_at__isnull', True)),
+                               fields=['updated', 'id'], name='post_moderation_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:47
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+import blog.operations
+
+
+def count_comments(posts):
+    apps = posts.model._meta.apps
+
+    def live_comments(model_name):
+        model = apps.get_model('blog', model_name)
+        return Coalesce(Subquery(
+            model._base_manager.filter(post_id=OuterRef('pk'), deleted_at__isnull=True)
+            .order_by().values('post_id').annotate(count=Count('id')).values('count')
+        ), 0)
+
+    posts.update(comments_count=live_comments('Comment') + live_comments('ArchivedComment'))
+
+
+class Migration(migrations.Migration):
+    # The backfill runs in batches, each in its own transaction
+    atomic = False
+
+    dependencies = [
+        ('blog', '0015_post_moderation'),
+    ]
+
+    operations = [
+        blog.operations.AddFieldWithoutRewrite(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        blog.operations.RunBackfill('blog.Post', count_comments),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:12
+
+from django.db import migrations, models
+
+import blog.operations
+
+
+def mark_published(posts):
+    # Posts unpublished before the column existed can't be told apart from drafts
+    posts.update(was_published=True)
+
+
+class Migration(migrations.Migration):
+    # The backfill runs in batches, each in its own transaction
+    atomic = False
+
+    dependencies = [
+        ('blog', '0016_post_comments_count'),
+    ]
+
+    operations = [
+        blog.operations.AddFieldWithoutRewrite(
+            model_name='post',
+            name='was_published',
+            field=models.BooleanField(default=False),
+        ),
+        blog.operations.RunBackfill('blog.Post', mark_published, pending={'status': 'PB', 'was_published': False}),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:05
+
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+import blog.operations
+
+
+def count_rows(queryset, author_field):
+    return Coalesce(Subquery(
+        queryset.filter(**{author_field: OuterRef('pk')}).order_by()
+        .values(author_field).annotate(count=Count('id')).values('count')
+    ), 0)
+
+
+def rebuild_author_stats(users):
+    # Same totals as `blog.stats.rebuild_author_stats`, on the historical models
+    apps = users.model._meta.apps
+
+    def live(model_name):
+        return apps.get_model('blog', model_name)._base_manager.filter(deleted_at__isnull=True)
+
+    relations = apps.get_model('blog', 'UserPostRelation')._base_manager.filter(post__deleted_at__isnull=True)
+    rows = users.annotate(
+        posts=count_rows(live('Post'), 'author_id'),
+        likes=count_rows(relations.filter(like=True), 'post__author_id'),
+        bookmarks=count_rows(relations.filter(in_bookmarks=True), 'post__author_id'),
+        comments=(count_rows(live('Comment').filter(post__deleted_at__isnull=True), 'post__author_id') +
+                  count_rows(live('ArchivedComment').filter(post__deleted_at__isnull=True), 'post__author_id')),
+    ).values_list('id', 'posts', 'likes', 'bookmarks', 'comments')
+
+    AuthorStats = apps.get_model('blog', 'AuthorStats')
+    AuthorStats._base_manager.bulk_create(
+        [AuthorStats(author_id=author_id, posts_count=posts, likes_count=likes, bookmarks_count=bookmarks,
+                     comments_count=comments)
+         for author_id, posts, likes, bookmarks, comments in rows],
+        update_conflicts=True, unique_fields=['author'],
+        update_fields=['posts_count', 'likes_count', 'bookmarks_count', 'comments_count', 'updated'],
+    )
+
+
+class Migration(migrations.Migration):
+    # The backfill runs in batches, each in its own transaction
+    atomic = False
+
+    dependencies = [
+        ('blog', '0017_post_was_published'),
+    ]
+
+    operations = [
+        # Every user, rows created before from a single delta are recomputed too
+        blog.operations.RunBackfill('auth.User', rebuild_author_stats),
+    ]
@@ -1,12 +1,47 @@
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import connections, models, router
+from django.db.models import Q
+from django.db.models.functions import Collate, Upper
 from django.utils import timezone
 
 
+class PostQuerySet(models.QuerySet):
+
+    def published(self):
+        """
+        Posts visible to everyone
+        """
+        return self.filter(status=Post.Status.PUBLISHED, publish__lte=timezone.now())
+
+    def awaiting_moderation(self):
+        """
+        Drafts and posts edited since they were moderated, as covered by `post_moderation_idx`
+        """
+        return self.filter(Q(status=Post.Status.DRAFT) | Q(needs_review=True))
+
+    def visible_to(self, user):
+        """
+        Published posts and own posts, every post for staff
+        """
+        if user.is_staff:
+            return self
+        return self.filter(Q(status=Post.Status.PUBLISHED, publish__lte=timezone.now()) |
+                           Q(author_id=user.id))
+
+
+class LiveManager(models.Manager):
+    """
+    Manager leaving out soft-deleted rows, `all_objects` includes them
+    """
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Post(models.Model):
 
     class Status(models.TextChoices):
         DRAFT = 'DF', 'DRAFT'
+        SCHEDULED = 'SC', 'SCHEDULED'
         PUBLISHED = 'PB', 'PUBLISHED'
 
     title = models.CharField(max_length=250)
@@ -16,18 +51,137 @@ class Post(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     status = models.CharField(choices=Status.choices, default=Status.DRAFT, max_length=2)
+    # Incremented in batches by `blog.counters`, may lag behind by a flush interval
+    views_count = models.PositiveIntegerField(default=0)
+    # Live comments in both tables, kept up to date by `blog.stats.change_comments_count`
+    # and checked by `manage.py check_comments_counts`
+    comments_count = models.PositiveIntegerField(default=0)
     readers = models.ManyToManyField(User, through='UserPostRelation', related_name='my_actions')
+    # Set by soft deletion, the post is purged with its comments and relations later (see `blog.deletion`)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # Edited by its author since staff last moderated it
+    needs_review = models.BooleanField(default=False)
+    # Has been published, syncing clients that may have it are told when it is unpublished
+    was_published = models.BooleanField(default=False)
+
+    objects = LiveManager.from_queryset(PostQuerySet)()
+    all_objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'publish'], name='post_live_status_publish_idx',
+                         condition=Q(deleted_at__isnull=True)),
+            models.Index(fields=['deleted_at'], name='post_deleted_at_idx', condition=Q(deleted_at__isnull=False)),
+            models.Index(fields=['created'], name='post_created_idx'),
+            models.Index(fields=['updated', 'id'], name='post_updated_idx'),
+            # Moderation queue, drafts and posts awaiting review
+            models.Index(fields=['updated', 'id'], name='post_moderation_idx',
+                         condition=(Q(status='DF') | Q(needs_review=True)) & Q(deleted_at__isnull=True)),
+            # Title autocomplete, PostgreSQL only (see `blog.autocomplete`)
+            models.Index(Collate(Upper('title'), 'C'), name='post_title_upper_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if (update_fields is None or 'status' in update_fields) and self.status == Post.Status.PUBLISHED:
+            # Set without reading it, posts loaded without the field are not fetched again
+            self.was_published = True
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'was_published'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
 
 
+def next_id(model, using):
+    """
+    Id the next row of `model` will get, taken from its PostgreSQL sequence,
+    None on other databases
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id'))", [model._meta.db_table])
+        return cursor.fetchone()[0]
+
+
 class Comment(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='my_comments')
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     body = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    # Parent may live in the archive table, so there is no database constraint
+    parent = models.ForeignKey('self', on_delete=models.DO_NOTHING, db_constraint=False,
+                               null=True, blank=True, related_name='replies')
+    # Materialized path: zero-padded ids of the ancestors and of the comment itself,
+    # so a thread ordered by path is depth-first and a subtree shares the prefix
+    path = models.CharField(max_length=255, default='')
+    depth = models.PositiveSmallIntegerField(default=0)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+            models.Index(fields=['author', 'updated'], name='comment_author_updated_idx'),
+            models.Index(fields=['created'], name='comment_created_idx'),
+            models.Index(fields=['deleted_at'], name='comment_deleted_at_idx',
+                         condition=Q(deleted_at__isnull=False)),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and not self.path:
+            # The parent may be archived since, it is only read on insert
+            if self.parent_id:
+                self.depth = self.parent.depth + 1
+            if self.pk is None:
+                self.pk = next_id(Comment, kwargs.get('using') or router.db_for_write(Comment, instance=self))
+                if self.pk is not None:
+                    # The path is inserted with the row
+                    self.path = self.build_path()
+                    kwargs['force_insert'] = True
+        super().save(*args, **kwargs)
+        if not self.path:
+            # Without a sequence the path needs the id of the insert, it is written after it
+            self.path = self.build_path()
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+
+    def build_path(self):
+        segment = f'{self.pk:012d}/'
+        return self.parent.path + segment if self.parent_id else segment
+
+
+class ArchivedComment(models.Model):
+    """
+    Cold storage for comments moved out of the hot `Comment` table.
+    Columns are declared in the same order as `Comment`, so both tables
+    can be read together with one UNION (see `blog.archive`).
+    """
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='my_archived_comments')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='archived_comments')
+    body = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    parent = models.BigIntegerField(null=True, blank=True, db_column='parent_id')
+    path = models.CharField(max_length=255, default='')
+    depth = models.PositiveSmallIntegerField(default=0)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'path'], name='archcomment_post_path_idx'),
+            models.Index(fields=['author', 'updated'], name='archcomment_author_updated_idx'),
+            models.Index(fields=['deleted_at'], name='archcomment_deleted_at_idx',
+                         condition=Q(deleted_at__isnull=False)),
+        ]
 
 
 class UserPostRelation(models.Model):
@@ -35,8 +189,95 @@ class UserPostRelation(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
     like = models.BooleanField(default=False)
     in_bookmarks = models.BooleanField(default=False)
+    updated = models.DateTimeField(auto_now=True)
 
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['user', 'post'], name='unique_relation')
         ]
+        indexes = [
+            models.Index(fields=['user', 'updated'], name='relation_user_updated_idx'),
+        ]
+
+
+class RelatedPost(models.Model):
+    """
+    Posts engaged with by the readers of a post, best first. Rebuilt by
+    `manage.py build_related_posts`, rows of posts deleted since are left
+    until the next build and dropped by the join with posts.
+    """
+    post = models.ForeignKey(Post, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                             related_name='+')
+    related = models.ForeignKey(Post, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                                related_name='related_to')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            # Also the index of the lookup by post
+            models.UniqueConstraint(fields=['post', 'rank'], name='unique_related_post_rank')
+        ]
+
+
+class Tombstone(models.Model):
+    """
+    Deleted posts and comments, recorded on delete for clients syncing changes
+    """
+    class Kind(models.TextChoices):
+        POST = 'post', 'POST'
+        COMMENT = 'comment', 'COMMENT'
+
+    kind = models.CharField(choices=Kind.choices, max_length=10)
+    object_id = models.BigIntegerField()
+    # Author of the deleted object, not a foreign key as the user may be deleted with it
+    owner_id = models.BigIntegerField()
+    deleted = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted', 'id'], name='tombstone_deleted_idx'),
+        ]
+
+
+class AuthorStats(models.Model):
+    """
+    Totals over the posts of an author, drafts included. Kept up to date by
+    the API views through `blog.stats`, `manage.py rebuild_author_stats`
+    recomputes them.
+    """
+    author = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True,
+                                  related_name='blog_stats')
+    posts_count = models.PositiveIntegerField(default=0)
+    likes_count = models.PositiveIntegerField(default=0)
+    bookmarks_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+
+class Job(models.Model):
+    """
+    Deferred work run by `manage.py run_jobs`, see `blog.jobs`
+    """
+    class Status(models.TextChoices):
+        QUEUED = 'QU', 'QUEUED'
+        RUNNING = 'RU', 'RUNNING'
+        FAILED = 'FL', 'FAILED'
+
+    name = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict)
+    status = models.CharField(choices=Status.choices, max_length=2, default=Status.QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    # When a worker claimed the job, jobs of workers that died are claimed again
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Workers only look for due jobs
+            models.Index(fields=['run_at'], name='job_queued_run_at_idx', condition=Q(status='QU')),
+            models.Index(fields=['locked_at'], name='job_running_locked_at_idx', condition=Q(status='RU')),
+        ]
@@ -0,0 +1,135 @@
+"""
+Migration operations for changing hot tables without long locks.
+
+Migrations using `AddIndexConcurrently`, `AddPostgresIndexConcurrently` or `RunBackfill`
+must set `atomic = False`.
+"""
+import logging
+import time
+
+from django.contrib.postgres import operations as postgres_operations
+from django.db import migrations, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class AddIndexConcurrently(postgres_operations.AddIndexConcurrently):
+    """
+    Create an index with CREATE INDEX CONCURRENTLY on PostgreSQL, so writes
+    are not blocked while it builds. Other databases get a plain CREATE INDEX.
+    """
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+
+class AddPostgresIndexConcurrently(postgres_operations.AddIndexConcurrently):
+    """
+    Create an index using PostgreSQL features (collations, operator classes)
+    with CREATE INDEX CONCURRENTLY. It is not created on other databases.
+    """
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class RemoveIndexConcurrently(postgres_operations.RemoveIndexConcurrently):
+    """
+    Drop an index with DROP INDEX CONCURRENTLY on PostgreSQL
+    """
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.RemoveIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.RemoveIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+
+class AddFieldWithoutRewrite(migrations.AddField):
+    """
+    AddField that only accepts columns PostgreSQL 11+ adds as a catalog change:
+    nullable, or with a constant default. Indexes must be added separately
+    with `AddIndexConcurrently`.
+    """
+    def __init__(self, model_name, name, field, preserve_default=True):
+        if not field.null and (not field.has_default() or callable(field.default)):
+            raise ValueError(f'{model_name}.{name} must be nullable or have a constant default.')
+        if field.db_index or field.unique:
+            raise ValueError(f'{model_name}.{name} must not be indexed, '
+                             f'add the index with AddIndexConcurrently.')
+        super().__init__(model_name, name, field, preserve_default)
+
+
+def backfill(queryset, update, batch_size=1000, pause=0.0, start_after=None, progress=None):
+    """
+    Call `update(batch)` for the rows of `queryset` in primary key order, where
+    `batch` is a queryset of at most `batch_size` rows. Every batch runs in its
+    own transaction and is followed by a `pause` in seconds.
+
+    `progress(done, last_pk)` is called after every batch. An interrupted run is
+    resumed by passing the last reported pk as `start_after`.
+    Returns the number of rows processed.
+    """
+    done = 0
+    last_pk = start_after
+    manager = queryset.model._base_manager
+    while True:
+        batch = queryset.order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        pks = list(batch.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return done
+
+        with transaction.atomic(using=queryset.db):
+            update(manager.using(queryset.db).filter(pk__in=pks))
+        done += len(pks)
+        last_pk = pks[-1]
+        if progress is not None:
+            progress(done, last_pk)
+        if pause:
+            time.sleep(pause)
+
+
+class RunBackfill(migrations.RunPython):
+    """
+    Backfill `model` ('app_label.ModelName') in throttled batches, see `backfill`.
+    `pending` filters the rows still to update, so a rerun skips finished rows.
+    """
+    def __init__(self, model, update, pending=None, batch_size=1000, pause=0.1, **kwargs):
+        self.model = model
+        self.update = update
+        self.pending = pending or {}
+        self.batch_size = batch_size
+        self.pause = pause
+        super().__init__(self.run, migrations.RunPython.noop, atomic=False, **kwargs)
+
+    def run(self, apps, schema_editor):
+        model = apps.get_model(self.model)
+        queryset = model._base_manager.using(schema_editor.connection.alias).filter(**self.pending)
+
+        def progress(done, last_pk):
+            logger.info('Backfilled %s rows of %s, last pk %s', done, self.model, last_pk)
+
+        backfill(queryset, self.update, batch_size=self.batch_size, pause=self.pause,
+                 progress=progress)
+
+    def describe(self):
+        return f'Backfill {self.model} in batches of {self.batch_size}'
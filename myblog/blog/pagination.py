@@ -1,10 +1,237 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+import json
+import logging
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+logger = logging.getLogger(__name__)
 
 
 class ListPagination(PageNumberPagination):
     """
-    Modifying the pagination style
+    `page` selects the page and `page_size` its size, up to `max_page_size`.
+
+    Before `page` existed `page_size` held the page number. With
+    `BLOG_LEGACY_PAGE_SIZE_AS_PAGE`, requests with `page_size` but without
+    `page` are still read that way, with the default page size, and get links
+    in the current format. A warning is logged for each of them, so the
+    clients left can be found before the setting is turned off. Otherwise they
+    get the first page of that size.
     """
     page_size = 2
-    page_query_param = 'page_size'
+    page_query_param = 'page'
+    page_size_query_param = 'page_size'
     max_page_size = 20
+    legacy_page_query_param = 'page_size'
+
+    def is_legacy_request(self, request):
+        if not settings.BLOG_LEGACY_PAGE_SIZE_AS_PAGE:
+            return False
+        params = request.query_params
+        return self.page_query_param not in params and self.legacy_page_query_param in params
+
+    def get_page_size(self, request):
+        if self.is_legacy_request(request):
+            return self.page_size
+        return super().get_page_size(request)
+
+    def get_page_number(self, request, paginator):
+        if self.is_legacy_request(request):
+            logger.warning('Read %s=%s without %s as a page number: %s', self.legacy_page_query_param,
+                           request.query_params[self.legacy_page_query_param], self.page_query_param,
+                           request.get_full_path())
+            return request.query_params[self.legacy_page_query_param]
+        return super().get_page_number(request, paginator)
+
+    def get_page_link(self, page_number):
+        url = replace_query_param(self.request.build_absolute_uri(), self.page_query_param, page_number)
+        return replace_query_param(url, self.page_size_query_param, self.page.paginator.per_page)
+
+    def get_next_link(self):
+        if self.page.has_next() and self.is_legacy_request(self.request):
+            return self.get_page_link(self.page.next_page_number())
+        return super().get_next_link()
+
+    def get_previous_link(self):
+        if self.page.has_previous() and self.is_legacy_request(self.request):
+            return self.get_page_link(self.page.previous_page_number())
+        return super().get_previous_link()
+
+
+class ModerationPagination(CursorPagination):
+    """
+    Keyset pagination of the moderation queue, oldest changes first. Pages are
+    read from `post_moderation_idx` without counting or skipping rows.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('updated', 'id')
+
+
+def estimate_count(model, using='default'):
+    """
+    Row count of the model table from PostgreSQL planner statistics,
+    None on other databases or if the table has not been analyzed yet
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                       [model._meta.db_table])
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that takes the count of unfiltered querysets over large tables
+    from planner statistics instead of a full COUNT
+    """
+    # Exact counts below this size are cheap enough
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            estimate = estimate_count(queryset.model, using=queryset.db)
+            if estimate is not None and estimate > self.estimate_threshold:
+                return estimate
+        return super().count
+
+
+def estimate_query_count(queryset):
+    """
+    Number of rows the PostgreSQL planner expects `queryset` to return,
+    None on other databases
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def get_count_version(model):
+    version_key = f'count_version:{model._meta.label_lower}'
+    version = cache.get(version_key)
+    if version is None:
+        # A timestamp, so a version lost from the cache is never reused
+        version = time.time_ns()
+        cache.add(version_key, version, None)
+    return version
+
+
+def invalidate_counts(model):
+    """
+    Drop the cached counts of listings over `model`
+    """
+    cache.set(f'count_version:{model._meta.label_lower}', time.time_ns(), None)
+
+
+def invalidate_post_counts(**kwargs):
+    """
+    Receiver for post changes that may add or remove posts from listings
+    """
+    from blog.models import Post
+
+    invalidate_counts(Post)
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator that counts `count_queryset` instead of the listed queryset,
+    and caches the count under `cache_key` for `timeout` seconds. With
+    `estimate`, counts over `estimate_threshold` are taken from the query plan.
+    """
+    estimate_threshold = EstimatedCountPaginator.estimate_threshold
+
+    def __init__(self, object_list, per_page, count_queryset=None, cache_key=None,
+                 timeout=60, estimate=False, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_queryset = object_list if count_queryset is None else count_queryset
+        self.cache_key = cache_key
+        self.timeout = timeout
+        self.estimate = estimate
+
+    @cached_property
+    def count(self):
+        if self.cache_key is not None:
+            count = cache.get(self.cache_key)
+            if count is not None:
+                return count
+
+        count = None
+        if self.estimate:
+            count = estimate_query_count(self.count_queryset)
+            if count is not None and count <= self.estimate_threshold:
+                count = None
+        if count is None:
+            count = self.count_queryset.count()
+
+        if self.cache_key is not None:
+            cache.set(self.cache_key, count, self.timeout)
+        return count
+
+
+class CachedCountPagination(ListPagination):
+    """
+    ListPagination with cached total counts, see `CachedCountPaginator`.
+
+    Counts are cached per path and search, filter and ordering parameters of
+    the view, until `invalidate_counts` is called for the model. Actions
+    listing the rows of the user are marked with `count_per_user=True`, their
+    counts are cached per user too. Views may define `get_count_queryset()`,
+    the filtered queryset without the annotations that only the page needs.
+    Listings without filters are estimated.
+    """
+    def get_count_params(self, view):
+        """
+        Query parameters of the filter backends of the view
+        """
+        return {getattr(backend, name) for backend in getattr(view, 'filter_backends', ())
+                for name in ('search_param', 'ordering_param') if hasattr(backend, name)}
+
+    def get_count_cache_key(self, request, view, queryset):
+        params = sorted(
+            (key, request.query_params.getlist(key)) for key in self.get_count_params(view)
+            if key in request.query_params
+        )
+        user_id = request.user.id if getattr(view, 'count_per_user', False) else None
+        key = json.dumps([request.path, user_id, params])
+        version = get_count_version(queryset.model)
+        return f'count:{version}:{hashlib.sha1(key.encode()).hexdigest()}'
+
+    def is_filtered(self, request, view):
+        params = self.get_count_params(view) - {api_settings.ORDERING_PARAM}
+        return any(key in request.query_params for key in params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        get_count_queryset = getattr(view, 'get_count_queryset', None)
+        self.django_paginator_class = partial(
+            CachedCountPaginator,
+            count_queryset=get_count_queryset() if get_count_queryset else queryset,
+            cache_key=self.get_count_cache_key(request, view, queryset),
+            timeout=settings.BLOG_COUNT_CACHE_TIMEOUT,
+            estimate=not self.is_filtered(request, view),
+        )
+        return super().paginate_queryset(queryset, request, view)
@@ -6,11 +6,11 @@ class IsOwnerOrStaffOrReadOnly(BasePermission):
     The request is authenticated as an owner or staff, or is a read-only request.
     """
     def has_object_permission(self, request, view, obj):
-        if obj.status == 'DF':
-            # Only the author or staff can get it if the status is draft
+        if obj.status != 'PB':
+            # Only the author or staff can get it if the status is draft or scheduled
             return bool(
                 request.user and request.user.is_authenticated and
-                (obj.author == request.user or request.user.is_staff)
+                (obj.author_id == request.user.id or request.user.is_staff)
             )
         else:
             # All users can get it to read
@@ -19,21 +19,23 @@ class IsOwnerOrStaffOrReadOnly(BasePermission):
                 request.method in SAFE_METHODS or
                 request.user and
                 request.user.is_authenticated and
-                (obj.author == request.user or request.user.is_staff)
+                (obj.author_id == request.user.id or request.user.is_staff)
             )
 
 
 class PermissionForUpdate(BasePermission):
     """
-    Can update is the status is draft
+    Can update if the status is draft or scheduled, published posts go back to draft first
     """
     message = 'You can update after change status to draft'
+    # Statuses of posts that are not live yet
+    editable_statuses = ('DF', 'SC')
 
     def has_object_permission(self, request, view, obj):
         return bool(
             request.method in ['PUT', 'PATCH'] and
             (request.data.get('status', None) == 'DF' or
-             obj.status == 'DF')
+             obj.status in self.editable_statuses)
         )
 
 
@@ -44,5 +46,5 @@ class ItsOwnerOrStaff(BasePermission):
     def has_object_permission(self, request, view, obj):
         return bool(
             request.user and request.user.is_authenticated and
-            (obj.author == request.user or request.user.is_staff)
+            (obj.author_id == request.user.id or request.user.is_staff)
         )
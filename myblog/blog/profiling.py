@@ -0,0 +1,138 @@
+"""
+Opt-in profiling of API requests.
+
+A request is profiled when it sends a staff profiling token in the
+`X-Profile` header, or when it is picked by `BLOG_PROFILE_SAMPLE_RATE`. Staff
+get a token from `/api/profiles/token/`. It is signed, so it is checked
+before the profiler starts without a query, and the header of anyone else
+is ignored. The whole dispatch is run under cProfile: authentication,
+throttles, permissions, queries, serialization and rendering. Other requests
+only pay for a header lookup.
+
+Profiles are kept in the default cache as a ring of `BLOG_PROFILE_KEEP`
+slots, and staff download them from `/api/profiles/<id>/`:
+
+    python -m pstats profile-12.prof
+
+With a per-process cache such as locmem, every process keeps its own ring
+and the profiles listed are those of the process serving the list. Use a
+cache shared by the workers to collect them all.
+"""
+import cProfile
+import marshal
+import pstats
+import random
+import time
+import zlib
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_TOKEN_SALT = 'blog.profiling'
+
+
+def make_profile_token(user):
+    """
+    Token for the `X-Profile` header, to be issued to staff only
+    """
+    return signing.dumps(user.id, salt=PROFILE_TOKEN_SALT)
+
+
+def get_token_user_id(request):
+    """
+    Id of the staff user the `X-Profile` token of the request was issued to,
+    None if the header is absent, forged or expired
+    """
+    token = request.headers.get(PROFILE_HEADER)
+    if not token:
+        return None
+    try:
+        return signing.loads(token, salt=PROFILE_TOKEN_SALT, max_age=settings.BLOG_PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+
+
+def get_slot_key(profile_id):
+    return f'profile:{profile_id % settings.BLOG_PROFILE_KEEP}'
+
+
+def save_profile(profiler, request, user_id, response, duration):
+    """
+    Store a profile in the next slot of the ring, overwriting the oldest
+    """
+    stats = pstats.Stats(profiler)
+    try:
+        profile_id = cache.incr('profile:last_id')
+    except ValueError:
+        cache.add('profile:last_id', 0, None)
+        profile_id = cache.incr('profile:last_id')
+    cache.set(get_slot_key(profile_id), {
+        'id': profile_id,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'user_id': user_id,
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 1),
+        'created': timezone.now(),
+        # The format of `pstats.Stats.dump_stats`
+        'stats': zlib.compress(marshal.dumps(stats.stats)),
+    }, settings.BLOG_PROFILE_TIMEOUT)
+    return profile_id
+
+
+def get_profiles():
+    """
+    Stored profiles, newest first
+    """
+    slots = cache.get_many([f'profile:{slot}' for slot in range(settings.BLOG_PROFILE_KEEP)])
+    return sorted(slots.values(), key=lambda profile: profile['id'], reverse=True)
+
+
+def get_profile(profile_id):
+    profile = cache.get(get_slot_key(profile_id))
+    # The slot may hold a newer profile
+    if profile is None or profile['id'] != profile_id:
+        return None
+    return profile
+
+
+def get_profile_data(profile):
+    return zlib.decompress(profile['stats'])
+
+
+class ProfilingMixin:
+    """
+    Profile the dispatch of requests with a staff profiling token and of
+    sampled requests, see `blog.profiling`
+    """
+    def dispatch(self, request, *args, **kwargs):
+        sample_rate = settings.BLOG_PROFILE_SAMPLE_RATE
+        sampled = bool(sample_rate) and random.random() < sample_rate
+        # Checked before profiling starts, so other clients can't slow requests down
+        user_id = get_token_user_id(request)
+        if not sampled and user_id is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                # Rendering is otherwise left to the handler, outside the profile
+                response.render()
+        finally:
+            profiler.disable()
+        duration = time.perf_counter() - started
+        if user_id is None:
+            try:
+                # Throttled requests are authenticated here
+                user_id = self.request.user.id
+            except APIException:
+                user_id = None
+        save_profile(profiler, self.request, user_id, response, duration)
+        return response
@@ -0,0 +1,57 @@
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from blog.models import Post
+from blog.signals import post_published
+
+
+def announce_published(post_ids):
+    """
+    Send `post_published` for the given posts once the transaction commits
+    """
+    post_ids = list(post_ids)
+    if post_ids:
+        transaction.on_commit(lambda: post_published.send(sender=Post, post_ids=post_ids))
+
+
+def publish_due_posts(batch_size=500):
+    """
+    Promote scheduled posts whose publish time has come, in batches.
+    Yields the number of posts promoted by each batch.
+    """
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            ids = list(Post.objects.select_for_update(skip_locked=True)
+                       .filter(status=Post.Status.SCHEDULED, publish__lte=now)
+                       .order_by('publish')
+                       .values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return
+            # `update` skips auto_now, `updated` is set for clients syncing changes
+            Post.objects.filter(id__in=ids).update(status=Post.Status.PUBLISHED, was_published=True, updated=now)
+            announce_published(ids)
+        yield len(ids)
+
+
+def moderate_posts(posts, status):
+    """
+    Move `posts` to `status` with one UPDATE and mark them reviewed. As on
+    edits, published and scheduled posts are told apart by their publish time.
+    Returns the ids of the posts updated.
+    """
+    now = timezone.now()
+    # `update` skips auto_now, `updated` is set for clients syncing changes
+    changes = {'status': Value(status), 'needs_review': False, 'updated': now}
+    if status != Post.Status.DRAFT:
+        changes['status'] = Case(When(publish__gt=now, then=Value(Post.Status.SCHEDULED)),
+                                 default=Value(Post.Status.PUBLISHED))
+        changes['was_published'] = Case(When(publish__gt=now, then=F('was_published')), default=Value(True))
+    post_ids = [post.id for post in posts]
+    if post_ids:
+        Post.objects.filter(id__in=post_ids).update(**changes)
+    if status != Post.Status.DRAFT:
+        announce_published(post.id for post in posts
+                           if post.status != Post.Status.PUBLISHED and post.publish <= now)
+    return post_ids
@@ -0,0 +1,94 @@
+"""
+Related posts: readers who liked or bookmarked a post also engaged with these.
+
+`build_related_posts` scores pairs of posts by the cosine similarity of
+their readers, common readers / sqrt(readers of one * readers of the other),
+and keeps the best `top` per post in `RelatedPost`. Pairs are counted by the
+database with a self-join of `UserPostRelation`, a chunk of posts at a time,
+so memory is bounded by the pairs of one chunk.
+"""
+import heapq
+import math
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from blog.models import Post, UserPostRelation, RelatedPost
+
+ENGAGED = Q(like=True) | Q(in_bookmarks=True)
+
+
+def get_heavy_users(max_user_posts):
+    """
+    Users engaged with more than `max_user_posts` posts, their pairs grow with
+    the square of their posts and say little about any of them
+    """
+    return list(UserPostRelation.objects.filter(ENGAGED)
+                .values('user_id').annotate(posts=Count('id')).filter(posts__gt=max_user_posts)
+                .values_list('user_id', flat=True))
+
+
+def get_readers_counts(post_ids):
+    return dict(UserPostRelation.objects.filter(ENGAGED, post_id__in=post_ids)
+                .values('post_id').annotate(readers=Count('id')).values_list('post_id', 'readers'))
+
+
+def get_common_readers(after_id, last_id, min_common=2, exclude_users=()):
+    """
+    (post_id, related_id, common readers) of the posts in (after_id, last_id]
+    and the published posts they share readers with
+    """
+    return (UserPostRelation.objects
+            .filter(ENGAGED, post__gt=after_id, post__lte=last_id)
+            # One filter call, so the conditions apply to the same joined relation
+            .filter(Q(user__userpostrelation__like=True) | Q(user__userpostrelation__in_bookmarks=True),
+                    user__userpostrelation__post__status=Post.Status.PUBLISHED,
+                    user__userpostrelation__post__publish__lte=timezone.now(),
+                    user__userpostrelation__post__deleted_at__isnull=True)
+            .exclude(user_id__in=exclude_users)
+            .values('post_id', related_id=F('user__userpostrelation__post_id'))
+            .annotate(common=Count('id'))
+            .filter(common__gte=min_common)
+            .values_list('post_id', 'related_id', 'common')
+            .order_by())
+
+
+def score_related_posts(pairs, top):
+    """
+    Best `top` (score, related_id) of every post in `pairs`
+    """
+    pairs = [(post_id, related_id, common) for post_id, related_id, common in pairs if post_id != related_id]
+    readers = get_readers_counts({post_id for pair in pairs for post_id in pair[:2]})
+    candidates = defaultdict(list)
+    for post_id, related_id, common in pairs:
+        score = common / math.sqrt(readers[post_id] * readers[related_id])
+        candidates[post_id].append((score, -related_id))
+    return {post_id: [(score, -related_id) for score, related_id in heapq.nlargest(top, scores)]
+            for post_id, scores in candidates.items()}
+
+
+def build_related_posts(top=10, chunk_size=1000, min_common=2, max_user_posts=1000):
+    """
+    Replace the related posts of every post, a chunk of posts per transaction.
+    Yields the number of posts of each chunk.
+    """
+    heavy_users = get_heavy_users(max_user_posts)
+    after_id = 0
+    while True:
+        ids = list(Post.objects.filter(id__gt=after_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            # Posts deleted after the last chunk
+            RelatedPost.objects.filter(post_id__gt=after_id).delete()
+            return
+        related = score_related_posts(get_common_readers(after_id, ids[-1], min_common, heavy_users), top)
+        rows = [RelatedPost(post_id=post_id, related_id=related_id, rank=rank, score=score)
+                for post_id, scores in related.items()
+                for rank, (score, related_id) in enumerate(scores)]
+        with transaction.atomic():
+            # The whole id range, so rows of deleted posts go too
+            RelatedPost.objects.filter(post_id__gt=after_id, post_id__lte=ids[-1]).delete()
+            RelatedPost.objects.bulk_create(rows)
+        after_id = ids[-1]
+        yield len(ids)
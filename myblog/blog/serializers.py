@@ -1,9 +1,14 @@
+from itertools import islice
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import Prefetch
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
 
 from rest_framework import serializers
 
-from blog.models import Post, Comment, UserPostRelation
+from blog.archive import comments_with_archive
+from blog.models import Post, Comment, ArchivedComment, UserPostRelation, AuthorStats
 from blog.pagination import ListPagination
 
 
@@ -39,6 +44,7 @@ class PostBaseSerializer(serializers.ModelSerializer):
     author = AuthorInfoSerializer(read_only=True)
     likes_count = serializers.IntegerField(read_only=True)
     bookmarks_count = serializers.IntegerField(read_only=True)
+    views_count = serializers.IntegerField(read_only=True)
 
 
 class PostSerializer(DynamicFieldsModelSerializer, PostBaseSerializer):
@@ -48,8 +54,39 @@ class PostSerializer(DynamicFieldsModelSerializer, PostBaseSerializer):
     class Meta:
         model = Post
         fields = ('id', 'author', 'title', 'body',
-                  'likes_count', 'bookmarks_count', 'status',
-                  'created', 'updated')
+                  'likes_count', 'bookmarks_count', 'views_count', 'comments_count', 'status',
+                  'publish', 'created', 'updated')
+        read_only_fields = ('comments_count', )
+
+    def validate(self, attrs):
+        """
+        A published post goes live at its publish time, until then it is scheduled
+        """
+        status = attrs.get('status', self.instance.status if self.instance else Post.Status.DRAFT)
+        publish = attrs.get('publish', self.instance.publish if self.instance else timezone.now())
+        if status == Post.Status.PUBLISHED and publish > timezone.now():
+            attrs['status'] = Post.Status.SCHEDULED
+        elif status == Post.Status.SCHEDULED and publish <= timezone.now():
+            attrs['status'] = Post.Status.PUBLISHED
+        return attrs
+
+
+class CommentParentField(serializers.PrimaryKeyRelatedField):
+    """
+    Parent comment looked up in the hot table, then in the archive. Archived
+    parents are returned as unsaved `Comment` instances with the columns a
+    reply needs, as archived rows are read by `comments_with_archive`.
+    """
+    def to_internal_value(self, data):
+        try:
+            return super().to_internal_value(data)
+        except serializers.ValidationError as error:
+            if error.get_codes() != ['does_not_exist']:
+                raise
+        archived = ArchivedComment.objects.only('id', 'post_id', 'depth', 'path').filter(pk=data).first()
+        if archived is None:
+            self.fail('does_not_exist', pk_value=data)
+        return Comment(id=archived.id, post_id=archived.post_id, depth=archived.depth, path=archived.path)
 
 
 class CommentSerializer(DynamicFieldsModelSerializer):
@@ -57,10 +94,55 @@ class CommentSerializer(DynamicFieldsModelSerializer):
     Serializer for comments
     """
     author = AuthorInfoSerializer(read_only=True)
+    parent = CommentParentField(queryset=Comment.objects.all(), required=False, allow_null=True)
+
+    # Columns of the `values()` rows read by `serialize_rows`
+    row_fields = ('id', 'author_id', 'author__first_name', 'author__last_name', 'parent', 'body',
+                  'created', 'updated')
 
     class Meta:
         model = Comment
-        fields = ('id', 'author', 'body', 'created', 'updated')
+        fields = ('id', 'author', 'parent', 'body', 'created', 'updated')
+
+    def update(self, instance, validated_data):
+        # Validated as unchanged, archived comments keep the parent as a plain id
+        validated_data.pop('parent', None)
+        return super().update(instance, validated_data)
+
+    def serialize_rows(self, rows):
+        """
+        Represent `values()` rows of `row_fields` as instances are, without building the instances
+        """
+        created, updated = self.fields['created'], self.fields['updated']
+        for row in rows:
+            yield {
+                'id': row['id'],
+                'author': {'id': row['author_id'], 'first_name': row['author__first_name'],
+                           'last_name': row['author__last_name']},
+                'parent': row['parent'],
+                'body': row['body'],
+                'created': created.to_representation(row['created']),
+                'updated': updated.to_representation(row['updated']),
+            }
+
+    def validate_parent(self, parent):
+        """
+        Reply only to comments of the same post, down to BLOG_COMMENT_MAX_DEPTH levels
+        """
+        if self.instance is not None:
+            if (parent and parent.id) != self.instance.serializable_value('parent'):
+                raise serializers.ValidationError('The parent of a comment can not be changed.')
+            return parent
+        if parent is None:
+            return parent
+        post = self.context.get('post')
+        if post is not None and parent.post_id != post.id:
+            raise serializers.ValidationError('The parent comment belongs to another post.')
+        if parent.depth + 1 >= settings.BLOG_COMMENT_MAX_DEPTH:
+            raise serializers.ValidationError(
+                f'Replies can be nested at most {settings.BLOG_COMMENT_MAX_DEPTH} levels deep.'
+            )
+        return parent
 
 
 class PostDetailSerializer(DynamicFieldsModelSerializer, PostBaseSerializer):
@@ -68,29 +150,91 @@ class PostDetailSerializer(DynamicFieldsModelSerializer, PostBaseSerializer):
     Serializer with detail info for posts
     """
     comments = serializers.SerializerMethodField()
+    # Rows fetched at a time when every thread of the post is serialized
+    comments_chunk_size = 1000
 
     class Meta:
         model = Post
         fields = ('id', 'author', 'title', 'body',
                   'status', 'created', 'updated',
-                  'likes_count', 'bookmarks_count', 'comments')
+                  'likes_count', 'bookmarks_count', 'views_count', 'comments')
 
     def get_comments(self, obj):
         """
-        Pagination for nested comments in post
+        Pagination for nested comments in post: a page of top-level comments
+        with their replies nested in `replies`. Without a request every thread
+        of the post is returned, lazily, see `iter_threads`.
         """
-        comments = Comment.objects.filter(post=obj).prefetch_related(
-            Prefetch('author', queryset=User.objects.all().only('first_name', 'last_name'))
-        )
-        paginator = ListPagination()
+        max_depth = settings.BLOG_COMMENT_MAX_DEPTH
         if self.context.get('request', None):
-            page = paginator.paginate_queryset(comments,
-                                               request=self.context['request'])
-            serializer = CommentSerializer(page, many=True)
-            return serializer.data
+            top_level = comments_with_archive(ordering=('path', ), post=obj, depth=0)
+            paginator = ListPagination()
+            top_level = paginator.paginate_queryset(top_level, request=self.context['request'])
+            replies = []
+            if top_level:
+                # Subtrees of the page share one contiguous range of paths
+                replies = list(comments_with_archive(
+                    ordering=('path', ), post=obj, depth__gt=0, depth__lt=max_depth,
+                    path__gte=top_level[0].path, path__lt=top_level[-1].path + '~'
+                ))
+            # Thread order, replies right after their parent
+            comments = sorted(top_level + replies, key=lambda comment: comment.path)
+        else:
+            return self.iter_threads(obj, self.comments_chunk_size)
 
+        # UNION querysets can't prefetch, so authors are loaded for the fetched rows only
+        prefetch_related_objects(
+            comments, Prefetch('author', queryset=User.objects.all().only('first_name', 'last_name'))
+        )
         serializer = CommentSerializer(comments, many=True)
-        return serializer.data
+        return list(self.build_threads(serializer.data))
+
+    @staticmethod
+    def iter_comments(obj, chunk_size=1000):
+        """
+        Serialized comments of the post in thread order, in lists of up to `chunk_size`.
+        Rows are streamed with `iterator()` as dicts, no model instances are built, so
+        memory does not grow with the thread. Replies follow their parent.
+        """
+        rows = comments_with_archive(ordering=('path', ), post=obj, depth__lt=settings.BLOG_COMMENT_MAX_DEPTH)
+        rows = rows.values(*CommentSerializer.row_fields).iterator(chunk_size=chunk_size)
+        comments = CommentSerializer().serialize_rows(rows)
+        while chunk := list(islice(comments, chunk_size)):
+            yield chunk
+
+    @classmethod
+    def iter_threads(cls, obj, chunk_size=1000):
+        """
+        Threads of the post one at a time, with their replies nested. Only the
+        thread being built and one chunk of rows are held, not the whole post.
+        """
+        return cls.build_threads(comment for chunk in cls.iter_comments(obj, chunk_size) for comment in chunk)
+
+    @staticmethod
+    def build_threads(comments):
+        """
+        Nest serialized comments into trees in one pass, yielding every tree
+        once the next one starts. Parents must come before their replies,
+        which ordering by path guarantees.
+        """
+        thread = None
+        nodes = {}
+        for comment in comments:
+            comment['replies'] = []
+            if comment['parent'] is None:
+                if thread is not None:
+                    yield thread
+                # Replies never point into an earlier thread
+                thread = comment
+                nodes = {}
+            elif comment['parent'] in nodes:
+                nodes[comment['parent']]['replies'].append(comment)
+            else:
+                # Orphaned reply, left out with its own replies
+                continue
+            nodes[comment['id']] = comment
+        if thread is not None:
+            yield thread
 
 
 class UserPostRelationSerializer(serializers.ModelSerializer):
@@ -100,3 +244,40 @@ class UserPostRelationSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserPostRelation
         fields = ('like', 'in_bookmarks')
+
+
+class RelationChangeSerializer(serializers.ModelSerializer):
+    """
+    Serializer for relations in sync changes
+    """
+    class Meta:
+        model = UserPostRelation
+        fields = ('post', 'like', 'in_bookmarks', 'updated')
+
+
+class ModerationPostSerializer(serializers.ModelSerializer):
+    """
+    Serializer for posts in the moderation queue
+    """
+    author = AuthorInfoSerializer(read_only=True)
+
+    class Meta:
+        model = Post
+        fields = ('id', 'author', 'title', 'status', 'publish', 'needs_review', 'updated')
+
+
+class ModerationSerializer(serializers.Serializer):
+    """
+    Serializer for bulk status changes of moderated posts
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=100)
+    status = serializers.ChoiceField(choices=Post.Status.choices)
+
+
+class AuthorStatsSerializer(serializers.ModelSerializer):
+    """
+    Serializer for totals over the posts of an author
+    """
+    class Meta:
+        model = AuthorStats
+        fields = ('posts_count', 'likes_count', 'bookmarks_count', 'comments_count')
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent when posts go live, with `post_ids`. Bulk status changes don't send
+# `post_save`, so caches of public feeds should listen to this signal.
+post_published = Signal()
@@ -0,0 +1,169 @@
+"""
+Per-author rollups in `AuthorStats`, and the comment count of every post.
+
+Write paths call `change_stats` with the difference they make, so reading
+the totals is a primary key lookup. Bulk loads and admin edits bypass it,
+`rebuild_author_stats` recomputes the rows from the source tables, in the
+`reconcile_author_stats` job for admin edits.
+
+`Post.comments_count` is kept the same way by `change_comments_count`, the
+`reconcile_comments_counts` job recounts the posts of admin edits, and
+`check_comments_counts` finds and fixes posts whose count drifted.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from blog.jobs import job
+from blog.models import AuthorStats, Post, Comment, ArchivedComment, UserPostRelation
+
+STATS_FIELDS = ('posts_count', 'likes_count', 'bookmarks_count', 'comments_count')
+
+
+def change_stats(author_id, **deltas):
+    """
+    Add `deltas` ({'likes_count': 1, ...}) to the stats of an author
+    """
+    apply_stats_deltas(AuthorStats.objects.filter(author_id=author_id), lambda: author_id, deltas)
+
+
+def change_post_author_stats(post_id, **deltas):
+    """
+    `change_stats` for the author of a post that is not loaded. The stats are
+    updated through a subquery, the author id is only read to create them.
+    Deleted posts no longer count in the stats of their author.
+    """
+    authors = Post.objects.filter(id=post_id).values('author_id')
+    apply_stats_deltas(AuthorStats.objects.filter(author_id__in=authors),
+                       lambda: authors.values_list('author_id', flat=True).first(), deltas)
+
+
+def apply_stats_deltas(stats, get_author_id, deltas):
+    """
+    Add `deltas` to the `stats` row. Without a row, the stats of the author id
+    returned by `get_author_id()` are computed from the source tables, which
+    already hold the change.
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    # Rows counted before a rebuild may be short, they must not turn negative
+    changes = {field: F(field) + delta if delta > 0 else Greatest(F(field) + delta, 0)
+               for field, delta in deltas.items()}
+    changes['updated'] = timezone.now()
+    if stats.update(**changes):
+        return
+    author_id = get_author_id()
+    if author_id is not None:
+        # Seeding the row with the deltas would leave out what was there before
+        rebuild_author_stats([author_id])
+
+
+def change_comments_count(post_id, delta):
+    """
+    Add `delta` to the comment count of a post in one UPDATE
+    """
+    if delta:
+        Post.all_objects.filter(id=post_id).update(comments_count=Greatest(F('comments_count') + delta, 0))
+
+
+@job
+def reconcile_comments_counts(post_ids):
+    """
+    Background job for comment writes that bypass `change_comments_count`
+    """
+    posts = (Post.all_objects.filter(id__in=post_ids).annotate(actual=count_live_comments())
+             .values_list('id', 'comments_count', 'actual'))
+    for post_id, stored, actual in posts:
+        # Relative, so comments added since the count was read are kept
+        change_comments_count(post_id, actual - stored)
+
+
+def count_live_comments():
+    """
+    Expression of the live comments of the outer post, in both tables
+    """
+    hot, archived = (Coalesce(Subquery(model.objects.filter(post_id=OuterRef('pk')).order_by()
+                                       .values('post_id').annotate(count=Count('id')).values('count')), 0)
+                     for model in (Comment, ArchivedComment))
+    return hot + archived
+
+
+def check_comments_counts(batch_size=1000, fix=False):
+    """
+    Compare the comment counts of posts with their comments, in batches of
+    posts, each in its own transaction. Yields (posts checked, [(post id,
+    stored count, actual count)]) for every batch, wrong counts are corrected
+    with `fix`.
+    """
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            posts = list(Post.all_objects.filter(id__gt=last_id).order_by('id')
+                         .annotate(actual=count_live_comments())
+                         .values_list('id', 'comments_count', 'actual')[:batch_size])
+            if not posts:
+                return
+            wrong = [(post_id, stored, actual) for post_id, stored, actual in posts if stored != actual]
+            if fix:
+                for post_id, stored, actual in wrong:
+                    # Relative, so comments added since the count was read are kept
+                    change_comments_count(post_id, actual - stored)
+        last_id = posts[-1][0]
+        yield len(posts), wrong
+
+
+def rebuild_author_stats(author_ids):
+    """
+    Recompute the stats of the given authors from the source tables
+    """
+    stats = {author_id: AuthorStats(author_id=author_id) for author_id in author_ids}
+    posts = (Post.objects.filter(author_id__in=stats)
+             .values('author_id').annotate(posts=Count('id')).order_by())
+    for row in posts:
+        stats[row['author_id']].posts_count = row['posts']
+
+    relations = (UserPostRelation.objects.filter(post__author_id__in=stats, post__deleted_at__isnull=True)
+                 .values('post__author_id')
+                 .annotate(likes=Count('id', filter=Q(like=True)),
+                           bookmarks=Count('id', filter=Q(in_bookmarks=True)))
+                 .order_by())
+    for row in relations:
+        stats[row['post__author_id']].likes_count = row['likes']
+        stats[row['post__author_id']].bookmarks_count = row['bookmarks']
+
+    for model in (Comment, ArchivedComment):
+        comments = (model.objects.filter(post__author_id__in=stats, post__deleted_at__isnull=True)
+                    .values('post__author_id').annotate(comments=Count('id')).order_by())
+        for row in comments:
+            stats[row['post__author_id']].comments_count += row['comments']
+
+    AuthorStats.objects.bulk_create(stats.values(), update_conflicts=True, unique_fields=['author'],
+                                    update_fields=[*STATS_FIELDS, 'updated'])
+
+
+@job
+def reconcile_author_stats(author_ids):
+    """
+    Background job for writes that bypass `change_stats`
+    """
+    rebuild_author_stats(author_ids)
+
+
+def rebuild_all_author_stats(batch_size=1000):
+    """
+    Recompute the stats of every user in batches, each in its own transaction.
+    Yields the number of users done by each batch.
+    """
+    last_id = 0
+    while True:
+        author_ids = list(User.objects.filter(id__gt=last_id).order_by('id')
+                          .values_list('id', flat=True)[:batch_size])
+        if not author_ids:
+            return
+        with transaction.atomic():
+            rebuild_author_stats(author_ids)
+        last_id = author_ids[-1]
+        yield len(author_ids)
@@ -0,0 +1,182 @@
+"""
+Delta sync for offline clients.
+
+Every stream (posts, own comments, own relations, tombstones) is read in
+`(updated, id)` order past a cursor. The cursors are packed into an opaque
+sync token. Rows changed in the last `BLOG_SYNC_SETTLE_SECONDS` are left for
+the next sync, so rows committed late by a concurrent transaction are not
+skipped.
+"""
+import base64
+import binascii
+import heapq
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Exists, Q
+from django.utils import dateparse, timezone
+
+from blog.models import Post, Comment, ArchivedComment, UserPostRelation, Tombstone
+
+EPOCH = '2000-01-01T00:00:00+00:00'
+STREAMS = ('posts', 'comments', 'relations', 'tombstones')
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def encode_token(cursors):
+    data = json.dumps({name: [updated.isoformat(), pk] for name, (updated, pk) in cursors.items()})
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_token(token):
+    """
+    Cursors {stream: (updated, id)} of a sync token, from the start if `token` is empty
+    """
+    if not token:
+        data = {}
+    else:
+        try:
+            data = json.loads(base64.urlsafe_b64decode(token.encode()))
+        except (ValueError, binascii.Error):
+            raise InvalidToken('Invalid sync token.')
+    cursors = {}
+    for name in STREAMS:
+        try:
+            updated, pk = data.get(name, [EPOCH, 0])
+            updated = dateparse.parse_datetime(updated)
+        except (TypeError, ValueError):
+            raise InvalidToken('Invalid sync token.')
+        if updated is None or not isinstance(pk, int):
+            raise InvalidToken('Invalid sync token.')
+        cursors[name] = (updated, pk)
+    return cursors
+
+
+def record_post_deletions(posts):
+    """
+    Record the posts of the queryset `posts` and their live comments before
+    they are deleted for good. Comments are recorded by one INSERT ... SELECT
+    per table, without loading them. Soft-deleted posts and comments were
+    recorded by `blog.deletion`.
+    """
+    rows = list(posts.values_list('id', 'author_id', 'deleted_at'))
+    if not rows:
+        return
+    Tombstone.objects.bulk_create([Tombstone(kind=Tombstone.Kind.POST, object_id=pk, owner_id=author_id)
+                                   for pk, author_id, deleted_at in rows if deleted_at is None])
+    quote = connection.ops.quote_name
+    table = quote(Tombstone._meta.db_table)
+    placeholders = ', '.join(['%s'] * len(rows))
+    deleted = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        for model in (Comment, ArchivedComment):
+            cursor.execute(f'INSERT INTO {table} (kind, object_id, owner_id, deleted) '
+                           f'SELECT %s, id, author_id, %s FROM {quote(model._meta.db_table)} '
+                           f'WHERE post_id IN ({placeholders}) AND deleted_at IS NULL',
+                           [Tombstone.Kind.COMMENT, deleted, *(pk for pk, _, _ in rows)])
+
+
+def record_comment_deletions(comments):
+    """
+    Record the live comments of the queryset `comments` before they are deleted for good
+    """
+    Tombstone.objects.bulk_create([
+        Tombstone(kind=Tombstone.Kind.COMMENT, object_id=pk, owner_id=author_id)
+        for pk, author_id in comments.filter(deleted_at__isnull=True).values_list('id', 'author_id')
+    ])
+
+
+def record_author_deletion(sender, instance, **kwargs):
+    """
+    `pre_delete` receiver for users, records the posts deleted with them.
+    Comments deleted with their author have nobody left to sync them.
+    """
+    record_post_deletions(Post.all_objects.filter(author_id=instance.id))
+
+
+def after(queryset, cursor, until, field='updated'):
+    """
+    Rows of `queryset` past `cursor` and settled before `until`, in cursor order
+    """
+    updated, pk = cursor
+    return (queryset.filter(Q(**{f'{field}__gt': updated}) | Q(**{field: updated, 'id__gt': pk}),
+                            **{f'{field}__lt': until})
+            .order_by(field, 'id'))
+
+
+def get_change_querysets(user, cursors, until):
+    comments = Q(author_id=user.id)
+    return {
+        # Hidden posts only if they were public once, to be deleted by the clients that have them
+        'posts': after(Post.objects.visible_to(user) | Post.objects.filter(was_published=True),
+                       cursors['posts'], until),
+        'comments': after(Comment.objects.filter(comments), cursors['comments'], until),
+        'archived_comments': after(ArchivedComment.objects.filter(comments), cursors['comments'], until),
+        'relations': after(UserPostRelation.objects.filter(user_id=user.id), cursors['relations'], until),
+        'tombstones': after(Tombstone.objects.filter(Q(kind=Tombstone.Kind.POST) | Q(owner_id=user.id)),
+                            cursors['tombstones'], until, field='deleted'),
+    }
+
+
+def get_changes(user, token, limit=100):
+    """
+    Changes visible to `user` since `token`, at most `limit` rows per stream.
+    Returns {'posts', 'comments', 'relations', 'deleted', 'token', 'more'},
+    where posts and comments are model instances.
+    """
+    cursors = decode_token(token)
+    until = timezone.now() - timedelta(seconds=settings.BLOG_SYNC_SETTLE_SECONDS)
+    querysets = get_change_querysets(user, cursors, until)
+    changes = {'posts': [], 'comments': [], 'relations': [],
+               'deleted': {'posts': [], 'comments': []}, 'more': False}
+
+    # One query to learn which streams changed, usually none
+    changed = User.objects.filter(id=user.id).annotate(
+        **{name: Exists(queryset) for name, queryset in querysets.items()}
+    ).values(*querysets).get()
+    if not any(changed.values()):
+        changes['token'] = encode_token(cursors)
+        return changes
+
+    def read(name, queryset):
+        rows = list(queryset[:limit + 1]) if changed[name] else []
+        if len(rows) > limit:
+            changes['more'] = True
+        return rows[:limit]
+
+    posts = read('posts', querysets['posts'].select_related('author'))
+    for post in posts:
+        if user.is_staff or post.author_id == user.id or (
+                post.status == Post.Status.PUBLISHED and post.publish <= timezone.now()):
+            changes['posts'].append(post)
+        elif token:
+            # May have been unpublished since the last sync
+            changes['deleted']['posts'].append(post.id)
+
+    # Hot and archived comments share ids, merged in cursor order
+    comments = heapq.merge(read('comments', querysets['comments']),
+                           read('archived_comments', querysets['archived_comments']),
+                           key=lambda comment: (comment.updated, comment.id))
+    changes['comments'] = list(comments)
+    if len(changes['comments']) > limit:
+        changes['more'] = True
+        changes['comments'] = changes['comments'][:limit]
+    changes['relations'] = read('relations', querysets['relations'])
+
+    tombstones = read('tombstones', querysets['tombstones'])
+    for tombstone in tombstones:
+        changes['deleted'][f'{tombstone.kind}s'].append(tombstone.object_id)
+
+    for name, rows, field in (('posts', posts, 'updated'), ('comments', changes['comments'], 'updated'),
+                              ('relations', changes['relations'], 'updated'),
+                              ('tombstones', tombstones, 'deleted')):
+        if rows:
+            cursors[name] = (getattr(rows[-1], field), rows[-1].id)
+    changes['token'] = encode_token(cursors)
+    return changes
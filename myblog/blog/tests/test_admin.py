@@ -0,0 +1,153 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from blog.models import Post, Comment, ArchivedComment, UserPostRelation, AuthorStats, Job, Tombstone
+from blog.pagination import EstimatedCountPaginator
+from blog.stats import rebuild_author_stats
+
+
+class AdminChangelistTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create_superuser(username='admin', password='password')
+        cls.post = Post.objects.create(title='Some post', body='Some body',
+                                       author=cls.admin_user, status='PB')
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def add_rows(self, count):
+        for index in range(count):
+            user = User.objects.create(username=f'user_{Comment.objects.count()}')
+            Comment.objects.create(author=user, post=self.post, body='Comment')
+            UserPostRelation.objects.create(user=user, post=self.post, like=True)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        return len(context)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        for name in ('blog_comment_changelist', 'blog_userpostrelation_changelist',
+                     'blog_post_changelist'):
+            url = reverse(f'admin:{name}')
+            self.add_rows(1)
+            queries = self.count_queries(url)
+            self.add_rows(5)
+            self.assertEqual(queries, self.count_queries(url))
+
+    def test_change_form_does_not_list_related_rows(self):
+        comment = Comment.objects.create(author=self.admin_user, post=self.post, body='Comment')
+        url = reverse('admin:blog_comment_change', args=(comment.id, ))
+        self.add_rows(1)
+        response = self.client.get(url)
+        self.add_rows(5)
+        # Raw id widgets instead of selects with every user and post
+        self.assertNotContains(response, 'user_1')
+        self.assertEqual(len(response.content), len(self.client.get(url).content))
+
+    def test_estimated_paginator_falls_back_to_count(self):
+        # Planner statistics are only used on PostgreSQL and for large tables
+        paginator = EstimatedCountPaginator(Comment.objects.all(), 10)
+        self.add_rows(3)
+        self.assertEqual(3, paginator.count)
+
+    def test_changelist_count_is_estimated(self):
+        # Soft-deleted rows are listed too, so the unfiltered changelist has no WHERE
+        for name in ('blog_post_changelist', 'blog_comment_changelist'):
+            with mock.patch('blog.pagination.estimate_count', return_value=500000) as estimate_count:
+                response = self.client.get(reverse(f'admin:{name}'))
+            estimate_count.assert_called_once()
+            self.assertEqual(500000, response.context['cl'].result_count)
+
+    def test_changelist_lists_and_restores_deleted_posts(self):
+        deleted = Post.objects.create(title='Deleted post', body='Some body', author=self.admin_user,
+                                      status='PB', deleted_at=timezone.now())
+        url = reverse('admin:blog_post_changelist')
+        self.assertContains(self.client.get(url), 'Deleted post')
+        response = self.client.get(url, {'deleted': 'no'})
+        self.assertEqual([self.post], list(response.context['cl'].result_list))
+        response = self.client.get(url, {'deleted': 'yes'})
+        self.assertEqual([deleted], list(response.context['cl'].result_list))
+
+        response = self.client.post(url, {'action': 'restore_selected', '_selected_action': [deleted.id]})
+        self.assertEqual(302, response.status_code)
+        self.assertTrue(Post.objects.filter(id=deleted.id).exists())
+
+
+class AdminStatsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create_superuser(username='admin', password='password')
+        cls.author = User.objects.create(username='author')
+        cls.post = Post.objects.create(title='Some post', body='Some body', author=cls.author, status='PB')
+        cls.comment = Comment.objects.create(author=cls.admin_user, post=cls.post, body='Comment')
+        rebuild_author_stats([cls.author.id])
+        Post.objects.filter(id=cls.post.id).update(comments_count=1)
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def test_admin_delete_reconciles_stats(self):
+        url = reverse('admin:blog_comment_delete', args=(self.comment.id, ))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data={'post': 'yes'})
+        self.assertEqual(302, response.status_code)
+        self.assertEqual([{'author_ids': [self.author.id]}, {'post_ids': [self.post.id]}],
+                         [job.kwargs for job in Job.objects.order_by('id')])
+        # Updated by the jobs, not by the request
+        self.assertEqual(1, AuthorStats.objects.get(author=self.author).comments_count)
+        self.assertEqual(1, Post.objects.get(id=self.post.id).comments_count)
+
+        call_command('run_jobs', once=True, stdout=StringIO())
+        self.assertEqual(0, AuthorStats.objects.get(author=self.author).comments_count)
+        self.assertEqual(0, Post.objects.get(id=self.post.id).comments_count)
+        self.assertFalse(Job.objects.exists())
+
+
+class AdminDeletionTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create_superuser(username='admin', password='password')
+        cls.author = User.objects.create(username='author')
+        cls.post = Post.objects.create(title='Some post', body='Some body', author=cls.author, status='PB')
+        cls.comment = Comment.objects.create(author=cls.admin_user, post=cls.post, body='Comment')
+        cls.archived = ArchivedComment.objects.create(author=cls.author, post=cls.post, body='Archived')
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def get_tombstones(self):
+        return set(Tombstone.objects.values_list('kind', 'object_id', 'owner_id'))
+
+    def test_delete_post_records_tombstones(self):
+        url = reverse('admin:blog_post_delete', args=(self.post.id, ))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url, data={'post': 'yes'})
+        self.assertEqual(302, response.status_code)
+        self.assertEqual({('post', self.post.id, self.author.id), ('comment', self.comment.id, self.admin_user.id),
+                          ('comment', self.archived.id, self.author.id)}, self.get_tombstones())
+        # Comments are deleted by their post id, without loading them
+        deletes = [query['sql'] for query in context.captured_queries if query['sql'].startswith('DELETE')]
+        self.assertIn('"blog_comment"."post_id" IN', next(sql for sql in deletes if 'blog_comment' in sql))
+        self.assertFalse(Comment.all_objects.exists())
+
+    def test_delete_comment_records_tombstone(self):
+        url = reverse('admin:blog_comment_delete', args=(self.comment.id, ))
+        self.client.post(url, data={'post': 'yes'})
+        self.assertEqual({('comment', self.comment.id, self.admin_user.id)}, self.get_tombstones())
+
+    def test_delete_author_records_post_tombstones(self):
+        author_id = self.author.id
+        self.author.delete()
+        self.assertEqual({('post', self.post.id, author_id), ('comment', self.comment.id, self.admin_user.id),
+                          ('comment', self.archived.id, author_id)}, self.get_tombstones())
@@ -1,14 +1,39 @@
+import asyncio
 import json
+import marshal
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, DatabaseError
 from django.db.models import Count, Case, When
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.exceptions import ErrorDetail
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APITestCase, APIClient
 
-from blog.models import Post, Comment, UserPostRelation
+from blog.archive import archive_comments
+from blog.autocomplete import suggestions_cache
+from blog.counters import post_views, record_view, flush_views, flush_views_if_due
+from blog.deletion import purge_post
+from blog.events import InMemoryBroker
+from blog.models import Post, Comment, UserPostRelation, AuthorStats
+from blog.pagination import ListPagination
+from blog.profiling import get_profiles
 from blog.serializers import PostSerializer, PostDetailSerializer, CommentSerializer, UserPostRelationSerializer
+from blog.signals import post_published
+from blog.stats import rebuild_all_author_stats, check_comments_counts, change_post_author_stats
+from blog.throttling import SlidingWindowThrottle, IPSlidingWindowThrottle
+from blog.views import PostViewSet
 
 
 class GeneralMethodsForTest:
@@ -28,22 +53,26 @@ class GeneralMethodsForTest:
 
 
 class PostApiTestCase(APITestCase, GeneralMethodsForTest):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.test_user_2, cls.test_user_3 = User.objects.bulk_create([
+            User(username='test_user_1'),
+            User(username='test_user_2'),
+            User(username='test_user_3', is_staff=True),
+        ])
+
+        cls.post_1, cls.post_2, cls.post_3, cls.post_4 = Post.objects.bulk_create([
+            Post(title='Some post new', body='Some body', author=cls.test_user_1, status='PB'),
+            Post(title='Some post 2', body='Some body 2', author=cls.test_user_2, status='PB'),
+            Post(title='Some post 3', body='Some body new 3', author=cls.test_user_1, status='PB'),
+            Post(title='Some post 4', body='Some body new 4', author=cls.test_user_1, status='DF'),
+        ])
+
+        cls.relation = UserPostRelation.objects.create(user=cls.test_user_1, post=cls.post_2, like=True)
+
     def setUp(self):
-        self.test_user_1 = User.objects.create(username='test_user_1')
-        self.test_user_2 = User.objects.create(username='test_user_2')
-        self.test_user_3 = User.objects.create(username='test_user_3',
-                                               is_staff=True)
-
-        self.post_1 = Post.objects.create(title='Some post new', body='Some body',
-                                          author=self.test_user_1, status='PB')
-        self.post_2 = Post.objects.create(title='Some post 2', body='Some body 2',
-                                          author=self.test_user_2, status='PB')
-        self.post_3 = Post.objects.create(title='Some post 3', body='Some body new 3',
-                                          author=self.test_user_1, status='PB')
-        self.post_4 = Post.objects.create(title='Some post 4', body='Some body new 4',
-                                          author=self.test_user_1, status='DF')
-
-        self.relation = UserPostRelation.objects.create(user=self.test_user_1, post=self.post_2, like=True)
+        # Listing counts cached by other tests
+        cache.clear()
 
     def test_get_posts(self):
         url = reverse('post-list')
@@ -59,7 +88,7 @@ class PostApiTestCase(APITestCase, GeneralMethodsForTest):
                                          fields=(
                                              'id', 'author', 'title',
                                              'body', 'likes_count', 'bookmarks_count',
-                                             'created', 'updated'
+                                             'views_count', 'comments_count', 'created', 'updated'
                                          )).data
         self.assertEqual(serialized_data[:2], response.data['results'])
 
@@ -77,7 +106,7 @@ class PostApiTestCase(APITestCase, GeneralMethodsForTest):
         serialized_data = PostSerializer(posts, many=True,
                                          fields=(
                                              'id', 'title', 'body', 'likes_count',
-                                             'bookmarks_count', 'status'
+                                             'bookmarks_count', 'views_count', 'comments_count', 'status'
                                          )).data
         self.assertEqual(serialized_data[:2], response.data['results'])
 
@@ -92,7 +121,9 @@ class PostApiTestCase(APITestCase, GeneralMethodsForTest):
         ).get(id=self.post_2.id)
         serialized_data = PostDetailSerializer(post, fields=('id', 'author', 'title',
                                                              'body', 'likes_count',
-                                                             'bookmarks_count', 'comments')).data
+                                                             'bookmarks_count', 'views_count',
+                                                             'comments')).data
+        serialized_data['comments'] = list(serialized_data['comments'])
         self.assertEqual(serialized_data, response.data)
 
     def test_search_posts(self):
@@ -110,7 +141,7 @@ class PostApiTestCase(APITestCase, GeneralMethodsForTest):
                                          fields=(
                                              'id', 'author', 'title',
                                              'body', 'likes_count', 'bookmarks_count',
-                                             'created', 'updated'
+                                             'views_count', 'comments_count', 'created', 'updated'
                                          )).data
         self.assertEqual(serialized_data, response.data['results'])
 
@@ -129,7 +160,7 @@ class PostApiTestCase(APITestCase, GeneralMethodsForTest):
                                          fields=(
                                              'id', 'author', 'title',
                                              'body', 'likes_count', 'bookmarks_count',
-                                             'created', 'updated'
+                                             'views_count', 'comments_count', 'created', 'updated'
                                          )).data
         self.assertEqual(serialized_data[:2], response.data['results'])
 
@@ -148,7 +179,7 @@ class PostApiTestCase(APITestCase, GeneralMethodsForTest):
                                          fields=(
                                              'id', 'author', 'title',
                                              'body', 'likes_count', 'bookmarks_count',
-                                             'created', 'updated'
+                                             'views_count', 'comments_count', 'created', 'updated'
                                          )).data
         self.assertEqual(serialized_data[:2], response.data['results'])
 
@@ -174,6 +205,46 @@ class PostApiTestCase(APITestCase, GeneralMethodsForTest):
         count_after = Post.objects.all().count()
         self.assertEqual(5, count_after)
 
+    def test_create_scheduled_post(self):
+        url = reverse('post-list')
+        data = {
+            'title': 'Scheduled post',
+            'body': 'New body',
+            'status': 'PB',
+            'publish': (timezone.now() + timedelta(hours=1)).isoformat()
+        }
+        api_client = self.get_client(self.test_user_1)
+        response = api_client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual('SC', response.data['status'])
+
+        # Visible only for the author until it is published
+        post_id = response.data['id']
+        response = self.client.get(url)
+        self.assertNotIn(post_id, [post['id'] for post in response.data['results']])
+        response = self.client.get(reverse('post-detail', args=(post_id, )))
+        self.assertEqual(status.HTTP_401_UNAUTHORIZED, response.status_code)
+        response = api_client.get(reverse('post-detail', args=(post_id, )))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+    def test_create_post_announces_publication(self):
+        url = reverse('post-list')
+        published_ids = []
+
+        def receiver(sender, post_ids, **kwargs):
+            published_ids.extend(post_ids)
+
+        post_published.connect(receiver)
+        self.addCleanup(post_published.disconnect, receiver)
+
+        api_client = self.get_client(self.test_user_1)
+        with self.captureOnCommitCallbacks(execute=True):
+            api_client.post(url, data=json.dumps({'title': 'Draft', 'body': 'Body'}),
+                            content_type='application/json')
+            response = api_client.post(url, data=json.dumps({'title': 'Post', 'body': 'Body', 'status': 'PB'}),
+                                       content_type='application/json')
+        self.assertEqual([response.data['id']], published_ids)
+
     def test_update_post(self):
         # Can update if change status to DF
         url = reverse('post-detail', args=(self.post_1.id, ))
@@ -203,6 +274,15 @@ class PostApiTestCase(APITestCase, GeneralMethodsForTest):
         self.post_1.refresh_from_db()
         self.assertEqual('Some post new', self.post_1.title)
 
+    def test_update_scheduled_post(self):
+        post = Post.objects.create(title='Scheduled', body='Body', author=self.test_user_1, status='SC',
+                                   publish=timezone.now() + timedelta(days=1))
+        url = reverse('post-detail', args=(post.id, ))
+        response = self.get_client(self.test_user_1).patch(url, data={'title': 'Fixed'}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        post.refresh_from_db()
+        self.assertEqual(('Fixed', 'SC'), (post.title, post.status))
+
     def test_update_post_not_owner(self):
         # Should return 403
         url = reverse('post-detail', args=(self.post_1.id, ))
@@ -272,25 +352,31 @@ class PostApiTestCase(APITestCase, GeneralMethodsForTest):
 
 
 class PaginationTestCase(APITestCase, GeneralMethodsForTest):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.test_user_2 = User.objects.bulk_create([
+            User(username='test_user_1'),
+            User(username='test_user_2'),
+        ])
+
+        cls.post_1, cls.post_2, cls.post_3, cls.post_4 = Post.objects.bulk_create([
+            Post(title='Some post new', body='Some body', author=cls.test_user_1, status='PB'),
+            Post(title='Some post 2', body='Some body 2', author=cls.test_user_2, status='PB'),
+            Post(title='Some post 3', body='Some body new 3', author=cls.test_user_1, status='PB'),
+            Post(title='Some post new', body='Some body post', author=cls.test_user_1, status='PB'),
+        ])
+
+        # Comments are saved one by one, `save` builds their thread paths
+        cls.comment_1 = Comment.objects.create(author=cls.test_user_1, post=cls.post_2,
+                                               body='Test comment 1')
+        cls.comment_2 = Comment.objects.create(author=cls.test_user_1, post=cls.post_2,
+                                               body='Test comment 2')
+        cls.comment_2 = Comment.objects.create(author=cls.test_user_1, post=cls.post_2,
+                                               body='Test comment 3')
+
     def setUp(self):
-        self.test_user_1 = User.objects.create(username='test_user_1')
-        self.test_user_2 = User.objects.create(username='test_user_2')
-
-        self.post_1 = Post.objects.create(title='Some post new', body='Some body',
-                                          author=self.test_user_1, status="PB")
-        self.post_2 = Post.objects.create(title='Some post 2', body='Some body 2',
-                                          author=self.test_user_2, status="PB")
-        self.post_3 = Post.objects.create(title='Some post 3', body='Some body new 3',
-                                          author=self.test_user_1, status="PB")
-        self.post_4 = Post.objects.create(title='Some post new', body='Some body post',
-                                          author=self.test_user_1, status="PB")
-
-        self.comment_1 = Comment.objects.create(author=self.test_user_1, post=self.post_2,
-                                                body='Test comment 1')
-        self.comment_2 = Comment.objects.create(author=self.test_user_1, post=self.post_2,
-                                                body='Test comment 2')
-        self.comment_2 = Comment.objects.create(author=self.test_user_1, post=self.post_2,
-                                                body='Test comment 3')
+        # Listing counts cached by other tests
+        cache.clear()
 
     def test_pagination_posts(self):
         url = reverse('post-list')
@@ -306,12 +392,12 @@ class PaginationTestCase(APITestCase, GeneralMethodsForTest):
         serialized_data = PostSerializer(posts, many=True,
                                          fields=(
                                              'id', 'author', 'title',
-                                             'body', 'likes_count',
-                                             'bookmarks_count', 'created', 'updated'
+                                             'body', 'likes_count', 'bookmarks_count',
+                                             'views_count', 'comments_count', 'created', 'updated'
                                          )).data
         expected_data_page_1 = {
             'count': posts.count(),
-            'next': 'http://testserver/api/posts/?page_size=2',
+            'next': 'http://testserver/api/posts/?page=2',
             'previous': None,
             'results': serialized_data[:2]
         }
@@ -328,6 +414,7 @@ class PaginationTestCase(APITestCase, GeneralMethodsForTest):
         }
         self.assertEqual(expected_data_page_2, response_2.data)
 
+    @override_settings(BLOG_LEGACY_PAGE_SIZE_AS_PAGE=True)
     def test_pagination_posts_wrong(self):
         url = reverse('post-list')
         api_client = self.get_client(self.test_user_1)
@@ -342,6 +429,46 @@ class PaginationTestCase(APITestCase, GeneralMethodsForTest):
         response_2 = api_client.get(url, {'page_size': 'asdas'})
         self.assertEqual(expected_data, response_2.data)
 
+    def test_pagination_page_size(self):
+        url = reverse('post-list')
+        response = self.client.get(url, {'page': 1, 'page_size': 3})
+        self.assertEqual(3, len(response.data['results']))
+        self.assertEqual('http://testserver/api/posts/?page=2&page_size=3', response.data['next'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(1, len(response.data['results']))
+        self.assertEqual('http://testserver/api/posts/?page_size=3', response.data['previous'])
+
+        # Capped by max_page_size, invalid sizes fall back to the default
+        with mock.patch.object(ListPagination, 'max_page_size', 3):
+            response = self.client.get(url, {'page': 1, 'page_size': 10000})
+        self.assertEqual(3, len(response.data['results']))
+        response = self.client.get(url, {'page': 1, 'page_size': 'asd'})
+        self.assertEqual(2, len(response.data['results']))
+
+    @override_settings(BLOG_LEGACY_PAGE_SIZE_AS_PAGE=False)
+    def test_pagination_page_size_only(self):
+        # The first page of that size
+        response = self.client.get(reverse('post-list'), {'page_size': 20})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(Post.objects.published().count(), len(response.data['results']))
+        self.assertIsNone(response.data['next'])
+
+    @override_settings(BLOG_LEGACY_PAGE_SIZE_AS_PAGE=True)
+    def test_pagination_legacy_page_number(self):
+        url = reverse('post-list')
+        # Without `page`, `page_size` is the page number
+        with self.assertLogs('blog.pagination', 'WARNING') as logs:
+            response = self.client.get(url, {'page_size': 2})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(2, len(response.data['results']))
+        self.assertIn('/api/posts/?page_size=2', logs.output[0])
+        self.assertIsNone(response.data['next'])
+        self.assertEqual('http://testserver/api/posts/?page=1&page_size=2', response.data['previous'])
+
+        response_2 = self.client.get(response.data['previous'])
+        self.assertEqual('http://testserver/api/posts/?page=2&page_size=2', response_2.data['next'])
+
     def test_my_posts_pagination(self):
         url = reverse('post-my-posts')
         api_client = self.get_client(self.test_user_1)
@@ -356,11 +483,12 @@ class PaginationTestCase(APITestCase, GeneralMethodsForTest):
         serialized_data = PostSerializer(posts, many=True,
                                          fields=(
                                              'id', 'title', 'body',
-                                             'likes_count', 'bookmarks_count', 'status'
+                                             'likes_count', 'bookmarks_count', 'views_count',
+                                             'comments_count', 'status'
                                          )).data
         expected_data_1 = {
             'count': posts.count(),
-            'next': 'http://testserver/api/posts/my_posts/?page_size=2',
+            'next': 'http://testserver/api/posts/my_posts/?page=2',
             'previous': None,
             'results': serialized_data[:2]
         }
@@ -377,6 +505,7 @@ class PaginationTestCase(APITestCase, GeneralMethodsForTest):
         }
         self.assertEqual(expected_data_2, response_2.data)
 
+    @override_settings(BLOG_LEGACY_PAGE_SIZE_AS_PAGE=True)
     def test_my_posts_pagination_wrong(self):
         url = reverse('post-my-posts')
         api_client = self.get_client(self.test_user_1)
@@ -404,7 +533,7 @@ class PaginationTestCase(APITestCase, GeneralMethodsForTest):
                                                                          'created', 'updated')).data
         expected_data_1 = {
             'count': comments.count(),
-            'next': 'http://testserver/api/comments/my_comments/?page_size=2',
+            'next': 'http://testserver/api/comments/my_comments/?page=2',
             'previous': None,
             'results': serialized_data[:2]
         }
@@ -423,21 +552,21 @@ class PaginationTestCase(APITestCase, GeneralMethodsForTest):
 
 
 class CommentsApiTestCase(APITestCase, GeneralMethodsForTest):
-    def setUp(self):
-        self.test_user_1 = User.objects.create(username='test_user_1', first_name='Name',
-                                               last_name='Another')
-        self.test_user_2 = User.objects.create(username='test_user_2', first_name='MyName')
-        self.test_user_3 = User.objects.create(username='test_user_3',
-                                               is_staff=True)
-
-        self.post_1 = Post.objects.create(title='Some post new', body='Some body',
-                                          author=self.test_user_1, status='PB')
-        self.post_2 = Post.objects.create(title='Some post 2', body='Some body 2',
-                                          author=self.test_user_2, status='PB')
-        self.post_3 = Post.objects.create(title='Some post 3', body='Some body new 3',
-                                          author=self.test_user_1, status='PB')
-
-        self.comment = Comment.objects.create(author=self.test_user_1, post=self.post_1, body='Test comment')
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.test_user_2, cls.test_user_3 = User.objects.bulk_create([
+            User(username='test_user_1', first_name='Name', last_name='Another'),
+            User(username='test_user_2', first_name='MyName'),
+            User(username='test_user_3', is_staff=True),
+        ])
+
+        cls.post_1, cls.post_2, cls.post_3 = Post.objects.bulk_create([
+            Post(title='Some post new', body='Some body', author=cls.test_user_1, status='PB'),
+            Post(title='Some post 2', body='Some body 2', author=cls.test_user_2, status='PB'),
+            Post(title='Some post 3', body='Some body new 3', author=cls.test_user_1, status='PB'),
+        ])
+
+        cls.comment = Comment.objects.create(author=cls.test_user_1, post=cls.post_1, body='Test comment')
 
     def test_add_comment(self):
         url = reverse('post-add-comment', args=(self.post_2.id, ))
@@ -453,6 +582,59 @@ class CommentsApiTestCase(APITestCase, GeneralMethodsForTest):
         self.assertEqual(1, comments_count)
         self.assertEqual('Test comment', self.post_2.comments.last().body)
 
+    def test_add_reply(self):
+        url = reverse('post-add-comment', args=(self.post_1.id, ))
+        api_client = self.get_client(self.test_user_2)
+        data = {
+            'body': 'Test reply',
+            'parent': self.comment.id
+        }
+        response = api_client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+        reply = self.post_1.comments.get(body='Test reply')
+        self.assertEqual(self.comment.id, reply.parent_id)
+        self.assertEqual(1, reply.depth)
+        self.assertEqual(self.comment.path + f'{reply.id:012d}/', reply.path)
+
+    def test_add_comment_with_sequence_id(self):
+        # With the id taken from the sequence, the path is inserted with the row
+        with mock.patch('blog.models.next_id', return_value=1000):
+            with self.assertNumQueries(1):
+                comment = Comment.objects.create(author=self.test_user_1, post=self.post_1, body='Comment')
+        self.assertEqual('000000001000/', comment.path)
+        self.assertEqual('000000001000/', Comment.objects.get(id=1000).path)
+
+    def test_add_reply_wrong(self):
+        url = reverse('post-add-comment', args=(self.post_2.id, ))
+        api_client = self.get_client(self.test_user_2)
+
+        # Parent from another post
+        data = {'body': 'Test reply', 'parent': self.comment.id}
+        response = api_client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+        # Too deep
+        parent = Comment.objects.create(author=self.test_user_1, post=self.post_2, body='Comment')
+        for _ in range(4):
+            parent = Comment.objects.create(author=self.test_user_1, post=self.post_2,
+                                            parent=parent, body='Reply')
+        data = {'body': 'Test reply', 'parent': parent.id}
+        response = api_client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_delete_comment_with_replies(self):
+        reply = Comment.objects.create(author=self.test_user_2, post=self.post_1,
+                                       parent=self.comment, body='Reply')
+        Comment.objects.create(author=self.test_user_1, post=self.post_1,
+                               parent=reply, body='Reply to reply')
+        other = Comment.objects.create(author=self.test_user_1, post=self.post_1, body='Other')
+
+        url = reverse('comment-detail', args=(self.comment.id, ))
+        response = self.get_client(self.test_user_1).delete(url)
+        self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+        self.assertEqual([other.id], list(self.post_1.comments.values_list('id', flat=True)))
+
     def test_get_my_comments(self):
         url = reverse('comment-my-comments')
         api_client = self.get_client(self.test_user_1)
@@ -554,12 +736,15 @@ class CommentsApiTestCase(APITestCase, GeneralMethodsForTest):
 
 
 class UserPostRelationTestCase(APITestCase, GeneralMethodsForTest):
-    def setUp(self):
-        self.test_user_1 = User.objects.create(username='user_1')
-        self.test_user_2 = User.objects.create(username='user_2')
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.test_user_2 = User.objects.bulk_create([
+            User(username='user_1'),
+            User(username='user_2'),
+        ])
 
-        self.post = Post.objects.create(title='Some post', body='Some body', author=self.test_user_1,
-                                        status='PB')
+        cls.post = Post.objects.create(title='Some post', body='Some body', author=cls.test_user_1,
+                                       status='PB')
 
     def test_like(self):
         url = reverse('userpostrelation-detail', args=(self.post.id, ))
@@ -616,3 +801,1162 @@ class UserPostRelationTestCase(APITestCase, GeneralMethodsForTest):
         relation.refresh_from_db()
         serialized_data = UserPostRelationSerializer(relation).data
         self.assertEqual(serialized_data, response.data)
+
+
+class ThrottlingTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1 = User.objects.create(username='user_1')
+        cls.token = Token.objects.create(user=cls.test_user_1)
+        cls.post = Post.objects.create(title='Some post', body='Some body', author=cls.test_user_1,
+                                       status='PB')
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_search_throttled_by_ip(self):
+        url = reverse('post-list')
+        with mock.patch.object(SlidingWindowThrottle, 'THROTTLE_RATES', {'search_ip': '2/min'}):
+            for _ in range(2):
+                response = self.client.get(url, data={'search': 'post'})
+                self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+            response = self.client.get(url, data={'search': 'post'})
+            self.assertEqual(status.HTTP_429_TOO_MANY_REQUESTS, response.status_code)
+
+            # Reads without search have their own scope
+            response = self.client.get(url)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+    def test_writes_throttled_by_user_without_queries(self):
+        url = reverse('post-add-comment', args=(self.post.id, ))
+        api_client = APIClient()
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        with mock.patch.object(SlidingWindowThrottle, 'THROTTLE_RATES', {'write_user': '1/min'}):
+            # Tokens are throttled on their own once they authenticated
+            api_client.get(reverse('post-list'))
+            response = api_client.post(url, data={'body': 'Comment'}, format='json')
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+            with self.assertNumQueries(0):
+                response = api_client.post(url, data={'body': 'Comment'}, format='json')
+            self.assertEqual(status.HTTP_429_TOO_MANY_REQUESTS, response.status_code)
+            self.assertEqual(1, Comment.objects.filter(post=self.post).count())
+
+            # Other users are not affected
+            another_token = Token.objects.create(user=User.objects.create(username='user_2'))
+            api_client.credentials(HTTP_AUTHORIZATION='Token ' + another_token.key)
+            api_client.get(reverse('post-list'))
+            response = api_client.post(url, data={'body': 'Comment'}, format='json')
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+    def test_unverified_tokens_throttled_by_ip(self):
+        url = reverse('post-add-comment', args=(self.post.id, ))
+        api_client = APIClient()
+        with mock.patch.object(SlidingWindowThrottle, 'THROTTLE_RATES', {'write_user': '1/min'}):
+            api_client.credentials(HTTP_AUTHORIZATION='Token random-1')
+            response = api_client.post(url, data={'body': 'Comment'}, format='json')
+            self.assertEqual(status.HTTP_401_UNAUTHORIZED, response.status_code)
+
+            # A new random token doesn't get a new limit
+            api_client.credentials(HTTP_AUTHORIZATION='Token random-2')
+            response = api_client.post(url, data={'body': 'Comment'}, format='json')
+            self.assertEqual(status.HTTP_429_TOO_MANY_REQUESTS, response.status_code)
+
+    def test_previous_window_is_weighted(self):
+        throttle = IPSlidingWindowThrottle()
+        request = mock.Mock(method='GET', query_params={}, META={'REMOTE_ADDR': '10.0.0.1'})
+        with mock.patch.object(SlidingWindowThrottle, 'THROTTLE_RATES', {'read_ip': '4/min'}):
+            throttle.timer = lambda: 60 * 100 + 50
+            for _ in range(4):
+                self.assertTrue(throttle.allow_request(request, None))
+            self.assertFalse(throttle.allow_request(request, None))
+
+            # 45 seconds into the next window 25% of the previous window still counts
+            throttle.timer = lambda: 60 * 101 + 45
+            for _ in range(3):
+                self.assertTrue(throttle.allow_request(request, None))
+            self.assertFalse(throttle.allow_request(request, None))
+
+
+class BatchPostsTestCase(APITestCase, GeneralMethodsForTest):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.test_user_2, cls.test_user_3 = User.objects.bulk_create([
+            User(username='test_user_1'),
+            User(username='test_user_2'),
+            User(username='test_user_3', is_staff=True),
+        ])
+
+        cls.post_1, cls.post_2, cls.post_3 = Post.objects.bulk_create([
+            Post(title='Some post 1', body='Some body 1', author=cls.test_user_1, status='PB'),
+            Post(title='Some post 2', body='Some body 2', author=cls.test_user_2, status='PB'),
+            Post(title='Some post 3', body='Some body 3', author=cls.test_user_1, status='DF'),
+        ])
+
+    def get_ids(self, api_client, *posts):
+        url = reverse('post-list')
+        ids = ','.join(str(post.id) for post in posts)
+        response = api_client.get(url, data={'ids': ids})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return [post['id'] for post in response.data]
+
+    def test_get_by_ids(self):
+        url = reverse('post-list')
+        with self.assertNumQueries(1):
+            response = self.client.get(url, data={'ids': f'{self.post_2.id},{self.post_1.id}'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+        posts = Post.objects.filter(id__in=[self.post_1.id, self.post_2.id]).annotate(
+            likes_count=Count(Case(When(userpostrelation__like=True, then=1))),
+            bookmarks_count=Count(Case(When(userpostrelation__in_bookmarks=True, then=1)))
+        ).order_by('id')
+        serialized_data = PostSerializer(posts, many=True,
+                                         fields=(
+                                             'id', 'author', 'title',
+                                             'body', 'likes_count', 'bookmarks_count',
+                                             'views_count', 'comments_count', 'created', 'updated'
+                                         )).data
+        self.assertEqual(serialized_data, response.data)
+
+    def test_get_by_ids_drafts(self):
+        posts = (self.post_1, self.post_2, self.post_3)
+        self.assertEqual([self.post_1.id, self.post_2.id], self.get_ids(self.client, *posts))
+        self.assertEqual([self.post_1.id, self.post_2.id],
+                         self.get_ids(self.get_client(self.test_user_2), *posts))
+        self.assertEqual([self.post_1.id, self.post_2.id, self.post_3.id],
+                         self.get_ids(self.get_client(self.test_user_1), *posts))
+        self.assertEqual([self.post_1.id, self.post_2.id, self.post_3.id],
+                         self.get_ids(self.get_client(self.test_user_3), *posts))
+
+    def test_get_by_ids_wrong(self):
+        url = reverse('post-list')
+        response = self.client.get(url, data={'ids': '1,a'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+        response = self.client.get(url, data={'ids': ','.join(str(i) for i in range(1, 102))})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_bulk_create(self):
+        url = reverse('post-bulk')
+        api_client = self.get_client(self.test_user_2)
+        data = [
+            {'title': 'Bulk post 1', 'body': 'Bulk body 1'},
+            {'title': 'Bulk post 2', 'body': 'Bulk body 2', 'status': 'PB'},
+        ]
+        AuthorStats.objects.create(author=self.test_user_2, posts_count=1)
+        # Insert, update the author stats
+        with self.assertNumQueries(2):
+            response = api_client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual(3, AuthorStats.objects.get(author=self.test_user_2).posts_count)
+
+        posts = Post.objects.filter(author=self.test_user_2, title__startswith='Bulk').order_by('id')
+        self.assertEqual(['Bulk post 1', 'Bulk post 2'], [post.title for post in posts])
+        self.assertEqual(['DF', 'PB'], [post.status for post in posts])
+        self.assertEqual([post.id for post in posts], [post['id'] for post in response.data])
+
+    def test_bulk_create_wrong(self):
+        url = reverse('post-bulk')
+        data = [
+            {'title': 'Bulk post 1', 'body': 'Bulk body 1'},
+            {'title': 'Bulk post 2'},
+        ]
+        response = self.get_client(self.test_user_2).post(url, data=json.dumps(data),
+                                                          content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual(0, Post.objects.filter(title__startswith='Bulk').count())
+
+        response = self.client.post(url, data=json.dumps(data[:1]), content_type='application/json')
+        self.assertEqual(status.HTTP_401_UNAUTHORIZED, response.status_code)
+
+
+class PermissionQueriesTestCase(APITestCase, GeneralMethodsForTest):
+    """
+    Permission checks compare `author_id`, so the author is loaded only when it is serialized
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.test_user_2 = User.objects.bulk_create([
+            User(username='test_user_1'),
+            User(username='test_user_2', is_staff=True),
+        ])
+
+        cls.post = Post.objects.create(title='Some post', body='Some body',
+                                       author=cls.test_user_1, status='PB')
+        cls.comment = Comment.objects.create(author=cls.test_user_1, post=cls.post,
+                                             body='Test comment')
+        # Stats are updated in place, not rebuilt
+        AuthorStats.objects.create(author=cls.test_user_1, posts_count=1, comments_count=1)
+
+    def setUp(self):
+        # Listing counts cached by other tests
+        cache.clear()
+
+    def test_update_post_queries(self):
+        url = reverse('post-detail', args=(self.post.id, ))
+        data = {'title': 'New title', 'status': 'DF'}
+        for user in (self.test_user_1, self.test_user_2):
+            api_client = self.get_client(user)
+            # Select with author, update
+            with self.assertNumQueries(2):
+                response = api_client.patch(url, data=json.dumps(data), content_type='application/json')
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+    def test_delete_post_queries(self):
+        url = reverse('post-detail', args=(self.post.id, ))
+        api_client = self.get_client(self.test_user_1)
+        # Select, mark the post deleted, update the author stats, record the tombstone.
+        # Relations are counted by a job, rows are purged later.
+        with self.assertNumQueries(4):
+            response = api_client.delete(url)
+        self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+
+    def test_not_owner_delete_post_queries(self):
+        url = reverse('post-detail', args=(self.post.id, ))
+        api_client = self.get_client(User.objects.create(username='test_user_3'))
+        with self.assertNumQueries(1):
+            response = api_client.delete(url)
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+    def test_update_comment_queries(self):
+        url = reverse('comment-detail', args=(self.comment.id, ))
+        for user in (self.test_user_1, self.test_user_2):
+            api_client = self.get_client(user)
+            with self.assertNumQueries(2):
+                response = api_client.patch(url, data=json.dumps({'body': 'Update comment'}),
+                                            content_type='application/json')
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+    def test_delete_comment_queries(self):
+        url = reverse('comment-detail', args=(self.comment.id, ))
+        api_client = self.get_client(self.test_user_1)
+        # Select, collect the subtree and mark it deleted, collect archived
+        # replies, record tombstones, update the author stats and the post
+        with self.assertNumQueries(7):
+            response = api_client.delete(url)
+        self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+
+    def test_my_posts_queries(self):
+        url = reverse('post-my-posts')
+        api_client = self.get_client(self.test_user_1)
+        # Count and page
+        with self.assertNumQueries(2):
+            response = api_client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+
+class PostViewsTestCase(APITestCase, GeneralMethodsForTest):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.test_user_2 = User.objects.bulk_create([
+            User(username='test_user_1'),
+            User(username='test_user_2'),
+        ])
+        cls.post_1, cls.post_2 = Post.objects.bulk_create([
+            Post(title='Some post 1', body='Some body 1', author=cls.test_user_1, status='PB'),
+            Post(title='Some post 2', body='Some body 2', author=cls.test_user_1, status='PB'),
+        ])
+
+    def setUp(self):
+        # Views recorded by other tests
+        post_views.drain()
+
+    def test_views_counted_without_writes(self):
+        url = reverse('post-detail', args=(self.post_1.id, ))
+        for api_client in (self.client, self.get_client(self.test_user_1)):
+            with CaptureQueriesContext(connection) as context:
+                response = api_client.get(url)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertFalse([query for query in context if query['sql'].startswith('UPDATE')])
+        self.client.get(reverse('post-detail', args=(self.post_2.id, )))
+
+        self.post_1.refresh_from_db()
+        self.assertEqual(0, self.post_1.views_count)
+
+        # One update for every post
+        with self.assertNumQueries(1):
+            self.assertEqual(2, flush_views())
+        self.assertEqual({self.post_1.id: 2, self.post_2.id: 1},
+                         dict(Post.objects.values_list('id', 'views_count')))
+
+        response = self.client.get(reverse('post-detail', args=(self.post_1.id, )))
+        self.assertEqual(2, response.data['views_count'])
+        with self.assertNumQueries(1):
+            flush_views()
+        with self.assertNumQueries(0):
+            flush_views()
+        self.assertEqual(3, Post.objects.get(id=self.post_1.id).views_count)
+
+    def test_views_kept_when_flush_fails(self):
+        record_view(self.post_1.id)
+        with mock.patch('blog.counters.update_views', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                flush_views()
+        self.assertEqual(1, flush_views())
+        self.assertEqual(1, Post.objects.get(id=self.post_1.id).views_count)
+
+    def test_views_flushed_after_requests(self):
+        url = reverse('post-detail', args=(self.post_1.id, ))
+        with self.settings(BLOG_VIEWS_FLUSH_INTERVAL=0):
+            self.client.get(url)
+        self.assertEqual(1, Post.objects.get(id=self.post_1.id).views_count)
+
+    @override_settings(BLOG_VIEWS_FLUSH_INTERVAL=0)
+    def test_flush_after_request_errors_logged(self):
+        record_view(self.post_1.id)
+        with mock.patch('blog.counters.update_views', side_effect=DatabaseError), \
+                self.assertLogs('blog.counters', 'ERROR'):
+            flush_views_if_due()
+        self.assertEqual(1, flush_views())
+
+    @override_settings(BLOG_VIEWS_FLUSH_INTERVAL=0)
+    def test_flush_after_request_closes_its_connection(self):
+        # Closed by Django after the request, opened by the flush
+        with mock.patch.object(connection, 'connection', None), \
+                mock.patch('blog.counters.flush_views') as flush, \
+                mock.patch.object(connection, 'close') as close:
+            flush_views_if_due()
+        flush.assert_called_once()
+        close.assert_called_once()
+        # Connections kept open by Django are left open
+        with mock.patch('blog.counters.flush_views'), mock.patch.object(connection, 'close') as close:
+            flush_views_if_due()
+        close.assert_not_called()
+
+
+class AuthorStatsTestCase(APITestCase, GeneralMethodsForTest):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.test_user_2 = User.objects.bulk_create([
+            User(username='test_user_1'),
+            User(username='test_user_2'),
+        ])
+
+    def get_stats(self, user):
+        api_client = self.get_client(user)
+        # Primary key lookup, whatever the number of posts
+        with self.assertNumQueries(1):
+            response = api_client.get(reverse('post-my-stats'))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return response.data
+
+    def assert_rebuilt_stats_equal(self, user):
+        stats = self.get_stats(user)
+        for _ in rebuild_all_author_stats():
+            pass
+        self.assertEqual(stats, self.get_stats(user))
+
+    def test_stats_maintained_on_writes(self):
+        self.assertEqual({'posts_count': 0, 'likes_count': 0, 'bookmarks_count': 0, 'comments_count': 0},
+                         self.get_stats(self.test_user_1))
+
+        author_client = self.get_client(self.test_user_1)
+        response = author_client.post(reverse('post-list'), data={'title': 'Post', 'body': 'Body',
+                                                                  'status': 'PB'})
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        post_id = response.data['id']
+        author_client.post(reverse('post-bulk'), data=json.dumps([{'title': 'Bulk', 'body': 'Body'}]),
+                           content_type='application/json')
+
+        reader_client = self.get_client(self.test_user_2)
+        url = reverse('userpostrelation-detail', args=(post_id, ))
+        reader_client.patch(url, data=json.dumps({'like': True, 'in_bookmarks': True}),
+                            content_type='application/json')
+        reader_client.patch(url, data=json.dumps({'in_bookmarks': False}), content_type='application/json')
+        url = reverse('post-add-comment', args=(post_id, ))
+        reader_client.post(url, data=json.dumps({'body': 'Comment'}), content_type='application/json')
+        comment = Comment.objects.get(post_id=post_id)
+        reader_client.post(url, data=json.dumps({'body': 'Reply', 'parent': comment.id}),
+                           content_type='application/json')
+
+        self.assertEqual({'posts_count': 2, 'likes_count': 1, 'bookmarks_count': 0, 'comments_count': 2},
+                         self.get_stats(self.test_user_1))
+        self.assertEqual(0, self.get_stats(self.test_user_2)['comments_count'])
+        self.assert_rebuilt_stats_equal(self.test_user_1)
+
+        # The reply is deleted with the comment
+        reader_client.delete(reverse('comment-detail', args=(comment.id, )))
+        self.assertEqual(0, self.get_stats(self.test_user_1)['comments_count'])
+
+        reader_client.post(url, data=json.dumps({'body': 'Comment'}), content_type='application/json')
+        with self.captureOnCommitCallbacks(execute=True):
+            author_client.delete(reverse('post-detail', args=(post_id, )))
+        call_command('run_jobs', once=True, stdout=StringIO())
+        self.assertEqual({'posts_count': 1, 'likes_count': 0, 'bookmarks_count': 0, 'comments_count': 0},
+                         self.get_stats(self.test_user_1))
+        self.assert_rebuilt_stats_equal(self.test_user_1)
+
+    def test_stats_created_for_post_author(self):
+        # Created without the API, the author has no stats row yet
+        post = Post.objects.create(title='Post', body='Body', author=self.test_user_1, status='PB')
+        url = reverse('userpostrelation-detail', args=(post.id, ))
+        with CaptureQueriesContext(connection) as context:
+            response = self.get_client(self.test_user_2).patch(url, data={'like': True}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(1, AuthorStats.objects.get(author_id=self.test_user_1.id).likes_count)
+        # Inserted with the id of the author, not a subquery
+        insert, = [query['sql'] for query in context if query['sql'].startswith('INSERT INTO "blog_authorstats"')]
+        self.assertNotIn('SELECT', insert)
+
+        # Comments on a deleted post change no stats
+        Post.objects.filter(id=post.id).update(deleted_at=timezone.now())
+        change_post_author_stats(post.id, comments_count=1)
+        self.assertEqual(0, AuthorStats.objects.get(author_id=self.test_user_1.id).comments_count)
+
+    def test_stats_counted_from_existing_rows(self):
+        # Posts from before the stats existed
+        Post.objects.bulk_create([Post(title=f'Post {i}', body='Body', author=self.test_user_1, status='PB')
+                                  for i in range(2)])
+        response = self.get_client(self.test_user_1).post(reverse('post-list'),
+                                                          data={'title': 'Post', 'body': 'Body', 'status': 'PB'})
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual(3, self.get_stats(self.test_user_1)['posts_count'])
+
+        # Decrements of a missing row are not lost either
+        AuthorStats.objects.all().delete()
+        self.get_client(self.test_user_1).delete(reverse('post-detail', args=(response.data['id'], )))
+        self.assertEqual(2, self.get_stats(self.test_user_1)['posts_count'])
+
+    def test_stats_anonymous(self):
+        response = self.client.get(reverse('post-my-stats'))
+        self.assertEqual(status.HTTP_401_UNAUTHORIZED, response.status_code)
+
+
+class CommentsCountTestCase(APITestCase, GeneralMethodsForTest):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1 = User.objects.create(username='test_user_1')
+        cls.post = Post.objects.create(title='Some post', body='Some body', author=cls.test_user_1, status='PB')
+
+    def get_comments_count(self):
+        response = self.client.get(reverse('post-list'))
+        return response.data['results'][0]['comments_count']
+
+    def test_comments_count_maintained(self):
+        api_client = self.get_client(self.test_user_1)
+        url = reverse('post-add-comment', args=(self.post.id, ))
+        api_client.post(url, data=json.dumps({'body': 'Comment'}), content_type='application/json')
+        comment = Comment.objects.get()
+        api_client.post(url, data=json.dumps({'body': 'Reply', 'parent': comment.id}),
+                        content_type='application/json')
+        self.assertEqual(2, self.get_comments_count())
+
+        # The reply goes and comes back with the comment
+        api_client.delete(reverse('comment-detail', args=(comment.id, )))
+        self.assertEqual(0, self.get_comments_count())
+        api_client.post(reverse('comment-restore', args=(comment.id, )))
+        self.assertEqual(2, self.get_comments_count())
+        self.assertEqual([(1, [])], [(checked, wrong) for checked, wrong in check_comments_counts()])
+
+    def test_comment_rolled_back_with_count(self):
+        api_client = self.get_client(self.test_user_1)
+        url = reverse('post-add-comment', args=(self.post.id, ))
+        with mock.patch('blog.views.change_comments_count', side_effect=DatabaseError), \
+                self.captureOnCommitCallbacks() as callbacks:
+            with self.assertRaises(DatabaseError):
+                api_client.post(url, data=json.dumps({'body': 'Comment'}), content_type='application/json')
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(AuthorStats.objects.filter(comments_count__gt=0).exists())
+        self.assertEqual([], callbacks)
+
+
+class CachedCountTestCase(APITestCase, GeneralMethodsForTest):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1 = User.objects.create(username='test_user_1')
+        Post.objects.bulk_create([
+            Post(title=f'Some post {i}', body='Some body', author=cls.test_user_1, status='PB')
+            for i in range(3)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_count_cached(self):
+        url = reverse('post-list')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(3, response.data['count'])
+        count_sql = context[0]['sql']
+        self.assertIn('COUNT(*)', count_sql)
+        # The likes and bookmarks annotations are left out
+        self.assertNotIn('JOIN', count_sql)
+
+        # Page and authors
+        with self.assertNumQueries(2):
+            response = self.client.get(url, data={'page': 2})
+        self.assertEqual(3, response.data['count'])
+
+        # Cached per search parameters, shared by users and other parameters
+        response = self.client.get(url, data={'search': 'post 1'})
+        self.assertEqual(1, response.data['count'])
+        with self.assertNumQueries(2):
+            response = self.get_client(self.test_user_1).get(url, data={'page_size': 1, '_': 123})
+        self.assertEqual(3, response.data['count'])
+
+        # Own posts are counted per user
+        response = self.get_client(self.test_user_1).get(reverse('post-my-posts'))
+        self.assertEqual(3, response.data['count'])
+        other_user = User.objects.create(username='test_user_2')
+        response = self.get_client(other_user).get(reverse('post-my-posts'))
+        self.assertEqual(0, response.data['count'])
+
+    def test_count_invalidated(self):
+        url = reverse('post-list')
+        self.client.get(url)
+
+        api_client = self.get_client(self.test_user_1)
+        api_client.post(url, data={'title': 'New post', 'body': 'Some body', 'status': 'PB'})
+        self.assertEqual(4, self.client.get(url).data['count'])
+
+        api_client.post(reverse('post-bulk'), data=json.dumps([{'title': 'Bulk', 'body': 'Body', 'status': 'PB'}]),
+                        content_type='application/json')
+        self.assertEqual(5, self.client.get(url).data['count'])
+
+        Post.objects.filter(title='Bulk').update(status='DF')
+        post_published.send(sender=Post, post_ids=[])
+        self.assertEqual(4, self.client.get(url).data['count'])
+
+    def test_count_estimated_without_filters(self):
+        url = reverse('post-list')
+        with mock.patch('blog.pagination.estimate_query_count', return_value=200000) as estimate:
+            response = self.client.get(url, data={'ordering': '-created'})
+            self.assertEqual(200000, response.data['count'])
+            response = self.client.get(url, data={'search': 'post'})
+            self.assertEqual(3, response.data['count'])
+        self.assertEqual(1, estimate.call_count)
+
+        # Small estimates are counted exactly
+        cache.clear()
+        with mock.patch('blog.pagination.estimate_query_count', return_value=2):
+            self.assertEqual(3, self.client.get(url).data['count'])
+
+
+class PaginationBenchmarkTestCase(APITestCase):
+    """
+    Round trips needed to read a feed of 1000 posts
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1 = User.objects.create(username='test_user_1')
+        Post.objects.bulk_create([
+            Post(title=f'Some post {i}', body='Some body', author=cls.test_user_1, status='PB')
+            for i in range(1000)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def read_feed(self, url):
+        ids = []
+        requests = 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            ids.extend(post['id'] for post in response.data['results'])
+            url = response.data['next']
+            requests += 1
+        self.assertEqual(1000, len(set(ids)))
+        return requests
+
+    def test_read_feed(self):
+        url = reverse('post-list')
+        with override_settings(BLOG_LEGACY_PAGE_SIZE_AS_PAGE=True):
+            legacy_requests = self.read_feed(url)
+        requests = self.read_feed(f'{url}?page=1&page_size={ListPagination.max_page_size}')
+        self.assertEqual(500, legacy_requests)
+        self.assertEqual(50, requests)
+
+
+class ModerationTestCase(APITestCase, GeneralMethodsForTest):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.staff = User.objects.bulk_create([
+            User(username='test_user_1'),
+            User(username='staff', is_staff=True),
+        ])
+        cls.draft, cls.published, cls.edited, cls.future_draft = Post.objects.bulk_create([
+            Post(title='Draft', body='Body', author=cls.test_user_1, status='DF'),
+            Post(title='Published', body='Body', author=cls.test_user_1, status='PB'),
+            Post(title='Edited', body='Body', author=cls.test_user_1, status='PB', needs_review=True),
+            Post(title='Future draft', body='Body', author=cls.test_user_1, status='DF',
+                 publish=timezone.now() + timedelta(days=1)),
+        ])
+
+    def moderate(self, ids, new_status):
+        return self.get_client(self.staff).patch(reverse('post-moderation'),
+                                                 data=json.dumps({'ids': ids, 'status': new_status}),
+                                                 content_type='application/json')
+
+    def test_moderation_queue(self):
+        url = reverse('post-moderation')
+        self.assertEqual(status.HTTP_403_FORBIDDEN, self.get_client(self.test_user_1).get(url).status_code)
+
+        api_client = self.get_client(self.staff)
+        # Page, no count
+        with self.assertNumQueries(1):
+            response = api_client.get(url, data={'page_size': 2})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(['Draft', 'Edited'], [post['title'] for post in response.data['results']])
+        self.assertNotIn('count', response.data)
+        response = api_client.get(response.data['next'])
+        self.assertEqual(['Future draft'], [post['title'] for post in response.data['results']])
+        self.assertIsNone(response.data['next'])
+
+    def test_author_edit_awaits_moderation(self):
+        api_client = self.get_client(self.test_user_1)
+        url = reverse('post-detail', args=(self.published.id, ))
+        api_client.patch(url, data={'status': 'DF'})
+        api_client.patch(url, data={'title': 'Published again', 'status': 'PB'})
+        self.published.refresh_from_db()
+        self.assertEqual((Post.Status.PUBLISHED, True), (self.published.status, self.published.needs_review))
+
+    def test_moderate(self):
+        self.assertEqual(status.HTTP_403_FORBIDDEN, self.get_client(self.test_user_1).patch(
+            reverse('post-moderation'), data={'ids': [self.draft.id], 'status': 'PB'}).status_code)
+
+        # Drafts are published or scheduled, published posts are marked reviewed,
+        # missing posts are skipped
+        with mock.patch('blog.publishing.post_published.send') as send, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.moderate([self.draft.id, self.published.id, self.edited.id,
+                                      self.future_draft.id, 0], 'PB')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({'status': 'Posts moderated',
+                          'updated': sorted([self.draft.id, self.published.id, self.edited.id,
+                                             self.future_draft.id]),
+                          'skipped': [0]}, response.data)
+        send.assert_called_once_with(sender=Post, post_ids=[self.draft.id])
+        self.assertEqual({'Draft': ('PB', False), 'Published': ('PB', False), 'Edited': ('PB', False),
+                          'Future draft': ('SC', False)},
+                         {title: (post_status, needs_review) for title, post_status, needs_review in
+                          Post.objects.values_list('title', 'status', 'needs_review')})
+        self.assertEqual({'Draft', 'Published', 'Edited'},
+                         set(Post.objects.filter(was_published=True).values_list('title', flat=True)))
+        self.assertEqual([], self.get_client(self.staff).get(reverse('post-moderation')).data['results'])
+
+        # As for single updates, only drafts change to another status than draft
+        response = self.moderate([self.published.id, self.future_draft.id], 'SC')
+        self.assertEqual({'updated': [self.future_draft.id], 'skipped': [self.published.id]},
+                         {key: response.data[key] for key in ('updated', 'skipped')})
+
+        # Any post can go back to draft, in one update
+        with self.assertNumQueries(4):
+            response = self.moderate([self.draft.id, self.published.id], 'DF')
+        self.assertEqual([], response.data['skipped'])
+        self.assertEqual(2, Post.objects.filter(status=Post.Status.DRAFT).count())
+
+    def test_moderate_invalid(self):
+        response = self.moderate([], 'XX')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'ids', 'status'}, set(response.data))
+
+
+class SoftDeleteTestCase(APITestCase, GeneralMethodsForTest):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.test_user_2 = User.objects.bulk_create([
+            User(username='test_user_1'),
+            User(username='test_user_2'),
+        ])
+        cls.post = Post.objects.create(title='Some post', body='Some body', author=cls.test_user_1, status='PB')
+        cls.comment = Comment.objects.create(author=cls.test_user_2, post=cls.post, body='Comment')
+        cls.reply = Comment.objects.create(author=cls.test_user_1, post=cls.post, parent=cls.comment, body='Reply')
+        UserPostRelation.objects.create(user=cls.test_user_2, post=cls.post, like=True)
+        for _ in rebuild_all_author_stats():
+            pass
+        for _ in check_comments_counts(fix=True):
+            pass
+
+    def get_stats(self):
+        return AuthorStats.objects.values('posts_count', 'likes_count', 'comments_count').get(
+            author_id=self.test_user_1.id)
+
+    def delete_post(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.get_client(self.test_user_1).delete(reverse('post-detail', args=(self.post.id, )))
+        self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+        # The stats job, the purge is not due
+        call_command('run_jobs', once=True, stdout=StringIO())
+
+    def test_delete_and_restore_post(self):
+        api_client = self.get_client(self.test_user_1)
+        url = reverse('post-detail', args=(self.post.id, ))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = api_client.delete(url)
+        self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+        # Relations are taken out of the stats by a job
+        self.assertEqual({'posts_count': 0, 'likes_count': 1, 'comments_count': 0}, self.get_stats())
+        call_command('run_jobs', once=True, stdout=StringIO())
+
+        self.assertEqual(status.HTTP_404_NOT_FOUND, api_client.get(url).status_code)
+        self.assertEqual(0, self.client.get(reverse('post-list')).data['count'])
+        self.assertEqual({'posts_count': 0, 'likes_count': 0, 'comments_count': 0}, self.get_stats())
+        # Kept until the purge
+        self.assertEqual(2, Comment.objects.filter(post_id=self.post.id).count())
+        self.assertTrue(Post.all_objects.filter(id=self.post.id, deleted_at__isnull=False).exists())
+
+        # Only the author or staff
+        restore_url = reverse('post-restore', args=(self.post.id, ))
+        response = self.get_client(self.test_user_2).post(restore_url)
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = api_client.post(restore_url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({'status': 'Post restored'}, response.data)
+        call_command('run_jobs', once=True, stdout=StringIO())
+
+        comments = api_client.get(url).data['comments']
+        self.assertEqual([self.comment.id], [comment['id'] for comment in comments])
+        self.assertEqual([self.reply.id], [reply['id'] for reply in comments[0]['replies']])
+        self.assertEqual({'posts_count': 1, 'likes_count': 1, 'comments_count': 2}, self.get_stats())
+        # Not deleted
+        self.assertEqual(status.HTTP_404_NOT_FOUND, api_client.post(restore_url).status_code)
+
+    def test_delete_and_restore_comment(self):
+        api_client = self.get_client(self.test_user_2)
+        response = api_client.delete(reverse('comment-detail', args=(self.comment.id, )))
+        self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+        self.assertFalse(Comment.objects.filter(post_id=self.post.id).exists())
+        self.assertEqual(0, self.get_stats()['comments_count'])
+
+        # The reply comes back with the comment it was deleted with
+        owner_client = self.get_client(self.test_user_1)
+        response = owner_client.post(reverse('comment-restore', args=(self.reply.id, )))
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        response = api_client.post(reverse('comment-restore', args=(self.comment.id, )))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({'status': 'Comment restored'}, response.data)
+        self.assertEqual(2, Comment.objects.filter(post_id=self.post.id).count())
+        self.assertEqual(2, self.get_stats()['comments_count'])
+
+        # A reply deleted on its own stays deleted when its parent is restored
+        owner_client.delete(reverse('comment-detail', args=(self.reply.id, )))
+        api_client.delete(reverse('comment-detail', args=(self.comment.id, )))
+        api_client.post(reverse('comment-restore', args=(self.comment.id, )))
+        self.assertEqual([self.comment.id], list(Comment.objects.values_list('id', flat=True)))
+        self.assertEqual(1, self.get_stats()['comments_count'])
+
+    def test_restore_comment_of_deleted_post(self):
+        api_client = self.get_client(self.test_user_2)
+        api_client.delete(reverse('comment-detail', args=(self.comment.id, )))
+        self.get_client(self.test_user_1).delete(reverse('post-detail', args=(self.post.id, )))
+        response = api_client.post(reverse('comment-restore', args=(self.comment.id, )))
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_comments_of_deleted_post(self):
+        self.delete_post()
+        url = reverse('comment-detail', args=(self.comment.id, ))
+        api_client = self.get_client(self.test_user_2)
+        self.assertEqual(status.HTTP_404_NOT_FOUND, api_client.get(url).status_code)
+        self.assertEqual(status.HTTP_404_NOT_FOUND, api_client.patch(url, data={'body': 'Edited'}).status_code)
+        self.assertEqual(status.HTTP_404_NOT_FOUND, api_client.delete(url).status_code)
+        self.assertEqual(2, Comment.objects.filter(post_id=self.post.id, body__in=['Comment', 'Reply']).count())
+
+    def test_relation_of_deleted_post(self):
+        self.delete_post()
+        url = reverse('userpostrelation-detail', args=(self.post.id, ))
+        # Existing and new relations
+        for user in (self.test_user_2, self.test_user_1):
+            response = self.get_client(user).patch(url, data={'in_bookmarks': True}, format='json')
+            self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        self.assertEqual(1, UserPostRelation.objects.count())
+        self.assertFalse(UserPostRelation.objects.filter(in_bookmarks=True).exists())
+        self.assertEqual({'posts_count': 0, 'likes_count': 0, 'comments_count': 0}, self.get_stats())
+
+    def test_deleted_post_left_out_of_stats_rebuild(self):
+        self.delete_post()
+        for _ in rebuild_all_author_stats():
+            pass
+        self.assertEqual({'posts_count': 0, 'likes_count': 0, 'comments_count': 0}, self.get_stats())
+
+
+@override_settings(BLOG_SYNC_SETTLE_SECONDS=0)
+class SyncChangesTestCase(APITestCase, GeneralMethodsForTest):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.test_user_2 = User.objects.bulk_create([
+            User(username='test_user_1'),
+            User(username='test_user_2'),
+        ])
+        # bulk_create doesn't mark published posts
+        cls.post_1, cls.post_2, cls.post_3 = Post.objects.bulk_create([
+            Post(title='Some post 1', body='Some body 1', author=cls.test_user_1, status='PB', was_published=True),
+            Post(title='Some post 2', body='Some body 2', author=cls.test_user_2, status='PB', was_published=True),
+            Post(title='Some post 3', body='Some body 3', author=cls.test_user_2, status='DF'),
+        ])
+        cls.comment = Comment.objects.create(author=cls.test_user_1, post=cls.post_2, body='Comment')
+        Comment.objects.create(author=cls.test_user_2, post=cls.post_2, body='Other comment')
+        UserPostRelation.objects.create(user=cls.test_user_1, post=cls.post_2, like=True)
+
+    def sync(self, api_client, token=None):
+        response = api_client.get(reverse('post-changes'), data={'token': token} if token else {})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return response.data
+
+    def test_initial_sync(self):
+        api_client = self.get_client(self.test_user_1)
+        changes = self.sync(api_client)
+        # Drafts of other users are not synced
+        self.assertEqual([self.post_1.id, self.post_2.id], sorted(post['id'] for post in changes['posts']))
+        self.assertEqual(['id', 'author', 'title', 'body', 'status', 'publish', 'created', 'updated'],
+                         list(changes['posts'][0]))
+        self.assertEqual([self.comment.id], [comment['id'] for comment in changes['comments']])
+        self.assertEqual([{'post': self.post_2.id, 'like': True, 'in_bookmarks': False}],
+                         [{key: relation[key] for key in ('post', 'like', 'in_bookmarks')}
+                          for relation in changes['relations']])
+        self.assertEqual({'posts': [], 'comments': []}, changes['deleted'])
+        self.assertFalse(changes['more'])
+
+        # Nothing changed, one query
+        with self.assertNumQueries(1):
+            unchanged = self.sync(api_client, changes['token'])
+        self.assertEqual(([], [], []), (unchanged['posts'], unchanged['comments'], unchanged['relations']))
+        self.assertEqual(changes['token'], unchanged['token'])
+
+    def test_sync_changes(self):
+        api_client = self.get_client(self.test_user_1)
+        token = self.sync(api_client)['token']
+        other_client = self.get_client(self.test_user_2)
+
+        api_client.patch(reverse('post-detail', args=(self.post_1.id, )), data={'title': 'New title', 'status': 'DF'})
+        other_client.patch(reverse('post-detail', args=(self.post_2.id, )), data={'status': 'DF'})
+        api_client.patch(reverse('comment-detail', args=(self.comment.id, )), data={'body': 'Edited'})
+        api_client.patch(reverse('userpostrelation-detail', args=(self.post_1.id, )), data={'in_bookmarks': True})
+
+        changes = self.sync(api_client, token)
+        self.assertEqual(['New title'], [post['title'] for post in changes['posts']])
+        self.assertEqual(['Edited'], [comment['body'] for comment in changes['comments']])
+        self.assertEqual([self.post_1.id], [relation['post'] for relation in changes['relations']])
+        # Unpublished posts are deleted for other users
+        self.assertEqual({'posts': [self.post_2.id], 'comments': []}, changes['deleted'])
+
+        other_client.delete(reverse('post-detail', args=(self.post_2.id, )))
+        changes = self.sync(api_client, changes['token'])
+        self.assertEqual({'posts': [self.post_2.id], 'comments': []}, changes['deleted'])
+
+        # Comments of the post are recorded when it is purged,
+        # the other comment is not synced by this user
+        list(purge_post(self.post_2.id))
+        changes = self.sync(api_client, changes['token'])
+        self.assertEqual({'posts': [], 'comments': [self.comment.id]}, changes['deleted'])
+
+    def test_drafts_of_other_users_not_synced(self):
+        api_client = self.get_client(self.test_user_1)
+        token = self.sync(api_client)['token']
+        other_client = self.get_client(self.test_user_2)
+        other_client.patch(reverse('post-detail', args=(self.post_3.id, )), data={'title': 'Draft title'})
+        other_client.post(reverse('post-list'), data={'title': 'New draft', 'body': 'Some body'})
+
+        changes = self.sync(api_client, token)
+        self.assertEqual({'posts': [], 'comments': []}, changes['deleted'])
+        self.assertEqual(changes['token'], self.sync(api_client, changes['token'])['token'])
+        # Nothing past the cursor, so the stream is skipped by the first query
+        with self.assertNumQueries(1):
+            self.sync(api_client, changes['token'])
+
+        # Published once, then unpublished
+        other_client.patch(reverse('post-detail', args=(self.post_3.id, )), data={'status': 'PB'})
+        other_client.patch(reverse('post-detail', args=(self.post_3.id, )), data={'status': 'DF'})
+        changes = self.sync(api_client, changes['token'])
+        self.assertEqual({'posts': [self.post_3.id], 'comments': []}, changes['deleted'])
+
+    def test_sync_deleted_comments(self):
+        api_client = self.get_client(self.test_user_1)
+        token = self.sync(api_client)['token']
+        api_client.delete(reverse('comment-detail', args=(self.comment.id, )))
+
+        changes = self.sync(api_client, token)
+        self.assertEqual({'posts': [], 'comments': [self.comment.id]}, changes['deleted'])
+        self.assertEqual({'posts': [], 'comments': []}, self.sync(api_client, changes['token'])['deleted'])
+
+    def test_sync_in_batches(self):
+        api_client = self.get_client(self.test_user_1)
+        post_ids = []
+        token = None
+        with mock.patch.object(PostViewSet, 'max_batch_size', 1):
+            for _ in range(3):
+                changes = self.sync(api_client, token)
+                post_ids.extend(post['id'] for post in changes['posts'])
+                token = changes['token']
+                if not changes['more']:
+                    break
+        self.assertFalse(changes['more'])
+        self.assertEqual([self.post_1.id, self.post_2.id], post_ids)
+
+    def test_sync_wrong_token(self):
+        api_client = self.get_client(self.test_user_1)
+        for token in ('abc', 'eyJwb3N0cyI6IDF9'):
+            response = api_client.get(reverse('post-changes'), data={'token': token})
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+        response = self.client.get(reverse('post-changes'))
+        self.assertEqual(status.HTTP_401_UNAUTHORIZED, response.status_code)
+
+
+@override_settings(BLOG_EVENTS_STREAM_SECONDS=5)
+class CommentStreamTestCase(APITestCase, GeneralMethodsForTest):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create(username='test_user')
+        cls.post = Post.objects.create(title='Post', body='Body', author=cls.test_user, status='PB')
+        cls.draft = Post.objects.create(title='Draft', body='Body', author=cls.test_user)
+
+    def setUp(self):
+        cache.clear()
+
+    def add_comment(self, post, body):
+        api_client = self.get_client(self.test_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = api_client.post(reverse('post-add-comment', args=(post.id, )),
+                                       data={'body': body}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+    async def open_stream(self, post, headers=None):
+        response = await self.async_client.get(reverse('post-comments-stream', args=(post.id, )), headers=headers)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('text/event-stream', response['Content-Type'])
+        events = aiter(response.streaming_content)
+        self.assertEqual(b'retry: 1000\n\n', await anext(events))
+        return events
+
+    def parse_event(self, event):
+        fields = dict(line.split(': ', 1) for line in event.decode().strip().split('\n'))
+        return fields['event'], int(fields['id']), json.loads(fields['data'])
+
+    async def test_stream_new_comments(self):
+        events = await self.open_stream(self.post)
+        await sync_to_async(self.add_comment)(self.post, 'Live comment')
+        # Comments on drafts are not published
+        await sync_to_async(self.add_comment)(self.draft, 'Draft comment')
+        await sync_to_async(self.add_comment)(self.post, 'Another comment')
+
+        name, event_id, data = self.parse_event(await anext(events))
+        self.assertEqual('comment', name)
+        self.assertEqual(event_id, data['id'])
+        self.assertEqual('Live comment', data['body'])
+        self.assertEqual(self.test_user.id, data['author']['id'])
+        self.assertEqual('Another comment', self.parse_event(await anext(events))[2]['body'])
+        await events.aclose()
+
+    async def test_stream_replays_missed_comments(self):
+        await sync_to_async(self.add_comment)(self.post, 'Seen')
+        await sync_to_async(self.add_comment)(self.post, 'Missed')
+        seen = await Comment.objects.aget(body='Seen')
+
+        events = await self.open_stream(self.post, headers={'Last-Event-ID': str(seen.id)})
+        self.assertEqual('Missed', self.parse_event(await anext(events))[2]['body'])
+        await sync_to_async(self.add_comment)(self.post, 'Live')
+        self.assertEqual('Live', self.parse_event(await anext(events))[2]['body'])
+        await events.aclose()
+
+    async def test_stream_replays_archived_comments(self):
+        await sync_to_async(self.add_comment)(self.post, 'Seen')
+        await sync_to_async(self.add_comment)(self.post, 'Archived')
+        seen = await Comment.objects.aget(body='Seen')
+        await sync_to_async(list)(archive_comments(timezone.now() + timedelta(minutes=1)))
+
+        events = await self.open_stream(self.post, headers={'Last-Event-ID': str(seen.id)})
+        name, event_id, data = self.parse_event(await anext(events))
+        self.assertEqual('Archived', data['body'])
+        self.assertEqual(self.test_user.id, data['author']['id'])
+        await events.aclose()
+
+    @override_settings(BLOG_EVENTS_REPLAY_LIMIT=1)
+    async def test_stream_refetch_after_long_gap(self):
+        await sync_to_async(self.add_comment)(self.post, 'Seen')
+        await sync_to_async(self.add_comment)(self.post, 'Missed 1')
+        await sync_to_async(self.add_comment)(self.post, 'Missed 2')
+        seen = await Comment.objects.aget(body='Seen')
+
+        events = await self.open_stream(self.post, headers={'Last-Event-ID': str(seen.id)})
+        self.assertEqual(b'event: refetch\ndata: {}\n\n', await anext(events))
+        # Live comments follow
+        await sync_to_async(self.add_comment)(self.post, 'Live')
+        self.assertEqual('Live', self.parse_event(await anext(events))[2]['body'])
+        await events.aclose()
+
+    async def test_stream_throttled(self):
+        url = reverse('post-comments-stream', args=(self.post.id, ))
+        with mock.patch.object(SlidingWindowThrottle, 'THROTTLE_RATES', {'read_ip': '1/min'}):
+            events = await self.open_stream(self.post)
+            response = await self.async_client.get(url)
+            self.assertEqual(status.HTTP_429_TOO_MANY_REQUESTS, response.status_code)
+            self.assertIn('Retry-After', response)
+        await events.aclose()
+
+    @override_settings(BLOG_EVENTS_MAX_STREAMS=1)
+    async def test_stream_connection_limit(self):
+        url = reverse('post-comments-stream', args=(self.post.id, ))
+        events = await self.open_stream(self.post)
+        response = await self.async_client.get(url)
+        self.assertEqual(status.HTTP_429_TOO_MANY_REQUESTS, response.status_code)
+        self.assertEqual('Too many open streams.', json.loads(response.content)['detail'])
+
+        # Released when the client disconnects, which cancels the stream
+        task = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        events = await self.open_stream(self.post)
+        await events.aclose()
+
+    @override_settings(BLOG_EVENTS_HEARTBEAT=0.01)
+    async def test_stream_heartbeat(self):
+        events = await self.open_stream(self.post)
+        self.assertEqual(b': ping\n\n', await anext(events))
+        await events.aclose()
+
+    async def test_stream_only_published_posts(self):
+        response = await self.async_client.get(reverse('post-comments-stream', args=(self.draft.id, )))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        response = await self.async_client.post(reverse('post-comments-stream', args=(self.post.id, )))
+        self.assertEqual(status.HTTP_405_METHOD_NOT_ALLOWED, response.status_code)
+
+    async def test_broker_drops_slow_subscribers(self):
+        broker = InMemoryBroker(queue_size=2)
+        subscription = broker.subscribe('channel')
+        other = broker.subscribe('other')
+        for message in (b'1', b'2', b'3'):
+            await sync_to_async(broker.publish, thread_sensitive=False)('channel', message)
+        await asyncio.sleep(0)
+
+        # Ended instead of holding messages for a stream that can't keep up
+        self.assertIsNone(await subscription.get(timeout=1))
+        with self.assertRaises(asyncio.TimeoutError):
+            await other.get(timeout=0.01)
+        broker.unsubscribe(subscription)
+        broker.unsubscribe(other)
+        self.assertEqual({}, broker.channels)
+
+
+class AutocompleteTestCase(APITestCase, GeneralMethodsForTest):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create(username='test_user')
+        cls.tips, cls.orm, cls.djinn, _, _ = Post.objects.bulk_create([
+            Post(title='Django tips', body='Body', author=cls.test_user, status='PB'),
+            Post(title='django ORM', body='Body', author=cls.test_user, status='PB'),
+            Post(title='Djinn', body='Body', author=cls.test_user, status='PB'),
+            Post(title='Django draft', body='Body', author=cls.test_user),
+            Post(title='Flask', body='Body', author=cls.test_user, status='PB'),
+        ])
+
+    def setUp(self):
+        cache.clear()
+        suggestions_cache.clear()
+
+    def autocomplete(self, prefix, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(reverse('post-autocomplete'), data={'q': prefix})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return [post['title'] for post in response.data]
+
+    def test_autocomplete(self):
+        self.assertEqual(['django ORM', 'Django tips', 'Djinn'], self.autocomplete('dj', 1))
+        self.assertEqual(['django ORM', 'Django tips', 'Djinn'], self.autocomplete('DJ', 0))
+        # Filtered from the complete results of "DJ"
+        self.assertEqual(['django ORM', 'Django tips'], self.autocomplete('djan', 0))
+        self.assertEqual([], self.autocomplete('django x', 0))
+        # Too short, or only % and _ that would match anything in LIKE
+        self.assertEqual([], self.autocomplete('d', 0))
+        self.assertEqual([], self.autocomplete('%_', 1))
+
+        response = self.client.get(reverse('post-autocomplete'), data={'q': 'djinn'})
+        self.assertEqual([{'id': self.djinn.id, 'title': 'Djinn'}], response.data)
+
+    @override_settings(BLOG_AUTOCOMPLETE_LIMIT=2)
+    def test_autocomplete_limit(self):
+        self.assertEqual(['django ORM', 'Django tips'], self.autocomplete('dj', 1))
+        # There may be more matches than the cached ones
+        self.assertEqual(['Djinn'], self.autocomplete('dji', 1))
+
+    def test_autocomplete_cleared_on_change(self):
+        self.autocomplete('dj', 1)
+        self.djinn.title = 'Flask tips'
+        self.djinn.save()
+        self.assertEqual(['django ORM', 'Django tips'], self.autocomplete('dj', 1))
+
+    def test_autocomplete_timeout(self):
+        with mock.patch('blog.autocomplete.query_suggestions', return_value=None):
+            self.assertEqual([], self.autocomplete('dj', 0))
+        # Not cached
+        self.assertEqual(['django ORM', 'Django tips', 'Djinn'], self.autocomplete('dj', 1))
+
+
+class ProfilingTestCase(APITestCase, GeneralMethodsForTest):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.staff = User.objects.bulk_create([
+            User(username='test_user_1'),
+            User(username='staff', is_staff=True),
+        ])
+        cls.post = Post.objects.create(title='Some post', body='Some body', author=cls.test_user_1, status='PB')
+
+    def setUp(self):
+        cache.clear()
+
+    def get_profile_token(self):
+        response = self.get_client(self.staff).post(reverse('profile-token'))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('X-Profile', response.data['header'])
+        return response.data['token']
+
+    def test_profile_staff_request(self):
+        token = self.get_profile_token()
+        api_client = self.get_client(self.staff)
+        url = reverse('post-detail', args=(self.post.id, ))
+        response = api_client.get(url, HTTP_X_PROFILE=token)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        api_client.get(reverse('comment-my-comments'), HTTP_X_PROFILE=token)
+
+        response = api_client.get(reverse('profile-list'))
+        self.assertEqual([(2, '/api/comments/my_comments/'), (1, url)],
+                         [(profile['id'], profile['path']) for profile in response.data])
+        self.assertEqual((self.staff.id, 200), (response.data[1]['user_id'], response.data[1]['status']))
+
+        response = api_client.get(reverse('profile-detail', args=(1, )))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('attachment; filename="profile-1.prof"', response['Content-Disposition'])
+        # Loadable by pstats, with the view and the rendering
+        functions = {function for _, _, function in marshal.loads(response.content)}
+        self.assertIn('retrieve', functions)
+        self.assertIn('render', functions)
+
+    def test_header_without_staff_token_not_profiled(self):
+        token = self.get_profile_token()
+        with mock.patch('blog.profiling.cProfile.Profile') as profile:
+            # Not requested, or with a forged or expired token, staff included
+            self.get_client(self.staff).get(reverse('post-list'))
+            self.client.get(reverse('post-list'), HTTP_X_PROFILE='1')
+            self.get_client(self.staff).get(reverse('post-list'), HTTP_X_PROFILE=token[:-1])
+            with override_settings(BLOG_PROFILE_TOKEN_MAX_AGE=-1):
+                self.client.get(reverse('post-list'), HTTP_X_PROFILE=token)
+        profile.assert_not_called()
+        self.assertEqual([], get_profiles())
+
+    def test_profile_token_staff_only(self):
+        response = self.get_client(self.test_user_1).post(reverse('profile-token'))
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+    @override_settings(BLOG_PROFILE_SAMPLE_RATE=1, BLOG_PROFILE_KEEP=2)
+    def test_profile_sampled_requests(self):
+        for _ in range(3):
+            self.client.get(reverse('post-list'))
+        # The oldest slot is reused
+        self.assertEqual([3, 2], [profile['id'] for profile in get_profiles()])
+        self.assertEqual(None, get_profiles()[0]['user_id'])
+        api_client = self.get_client(self.staff)
+        response = api_client.get(reverse('profile-detail', args=(1, )))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_profiles_staff_only(self):
+        api_client = self.get_client(self.test_user_1)
+        self.assertEqual(status.HTTP_403_FORBIDDEN, api_client.get(reverse('profile-list')).status_code)
+        self.assertEqual(status.HTTP_403_FORBIDDEN,
+                         api_client.get(reverse('profile-detail', args=(1, ))).status_code)
@@ -0,0 +1,631 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+
+from blog.deletion import delete_post, delete_comment, purge_deleted_post
+from blog.importing import BlogImporter
+from blog.jobs import job, enqueue, enqueue_on_commit, claim_jobs, run_job
+from blog.models import (Post, Comment, ArchivedComment, UserPostRelation, AuthorStats, Job, RelatedPost,
+                         Tombstone)
+from blog.signals import post_published
+
+
+@job
+def add_post(title):
+    Post.objects.create(title=title, body='Body', author=User.objects.get(username='test_user'))
+
+
+@job(max_attempts=2)
+def failing_job():
+    add_post('Rolled back')
+    raise ValueError('Failed')
+
+
+def not_a_job():
+    pass
+
+
+class ArchiveCommentsTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.test_user_2 = User.objects.bulk_create([
+            User(username='test_user_1'),
+            User(username='test_user_2', is_staff=True),
+        ])
+
+        cls.post = Post.objects.create(title='Some post', body='Some body',
+                                       author=cls.test_user_1, status='PB')
+        cls.old_comment_1 = Comment.objects.create(author=cls.test_user_1, post=cls.post,
+                                                   body='Old comment 1')
+        cls.old_comment_2 = Comment.objects.create(author=cls.test_user_1, post=cls.post,
+                                                   body='Old comment 2')
+        cls.new_comment = Comment.objects.create(author=cls.test_user_1, post=cls.post,
+                                                 body='New comment')
+        Comment.objects.filter(id__in=[cls.old_comment_1.id, cls.old_comment_2.id]).update(
+            created=timezone.now() - timedelta(days=400)
+        )
+
+    def archive(self):
+        out = StringIO()
+        call_command('archive_comments', days=365, batch_size=1, stdout=out)
+        return out.getvalue()
+
+    def test_archive_moves_old_comments(self):
+        output = self.archive()
+        self.assertIn('2 comments archived', output)
+        self.assertEqual([self.new_comment.id], list(Comment.objects.values_list('id', flat=True)))
+
+        archived = ArchivedComment.objects.order_by('id')
+        self.assertEqual([self.old_comment_1.id, self.old_comment_2.id],
+                         [comment.id for comment in archived])
+        self.assertEqual('Old comment 1', archived[0].body)
+
+    def test_archive_transparent_for_post_detail(self):
+        self.archive()
+        url = reverse('post-detail', args=(self.post.id, ))
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([self.old_comment_1.id, self.old_comment_2.id],
+                         [comment['id'] for comment in response.data['comments']])
+
+    def test_archive_transparent_for_comments(self):
+        self.archive()
+        api_client = APIClient()
+        api_client.force_authenticate(user=self.test_user_1)
+
+        response = api_client.get(reverse('comment-my-comments'))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(3, response.data['count'])
+
+        url = reverse('comment-detail', args=(self.old_comment_1.id, ))
+        response = api_client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('Old comment 1', response.data['body'])
+
+        response = api_client.patch(url, data={'body': 'Edited'}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('Edited', ArchivedComment.objects.get(id=self.old_comment_1.id).body)
+
+    def test_edit_archived_reply(self):
+        reply = Comment.objects.create(author=self.test_user_1, post=self.post, parent=self.old_comment_1,
+                                       body='Old reply')
+        Comment.objects.filter(id=reply.id).update(created=timezone.now() - timedelta(days=400))
+        self.archive()
+        api_client = APIClient()
+        api_client.force_authenticate(user=self.test_user_1)
+
+        url = reverse('comment-detail', args=(reply.id, ))
+        response = api_client.patch(url, data={'body': 'Edited', 'parent': self.old_comment_1.id}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        archived = ArchivedComment.objects.get(id=reply.id)
+        self.assertEqual(('Edited', self.old_comment_1.id), (archived.body, archived.parent))
+
+        response = api_client.patch(url, data={'parent': self.new_comment.id}, format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_archived_comment_permissions(self):
+        self.archive()
+        another_user = User.objects.create(username='another_user')
+        api_client = APIClient()
+        api_client.force_authenticate(user=another_user)
+
+        url = reverse('comment-detail', args=(self.old_comment_1.id, ))
+        response = api_client.delete(url)
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+        self.assertTrue(ArchivedComment.objects.filter(id=self.old_comment_1.id).exists())
+
+    def test_reply_to_archived_comment(self):
+        self.archive()
+        api_client = APIClient()
+        api_client.force_authenticate(user=self.test_user_2)
+
+        url = reverse('post-add-comment', args=(self.post.id, ))
+        response = api_client.post(url, data={'body': 'Reply', 'parent': self.old_comment_1.id}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+        reply = Comment.objects.get(body='Reply')
+        self.assertEqual(self.old_comment_1.id, reply.parent_id)
+        self.assertEqual(1, reply.depth)
+        self.assertEqual(self.old_comment_1.path + f'{reply.id:012d}/', reply.path)
+
+        response = self.client.get(reverse('post-detail', args=(self.post.id, )))
+        thread = response.data['comments'][0]
+        self.assertEqual(self.old_comment_1.id, thread['id'])
+        self.assertEqual([reply.id], [comment['id'] for comment in thread['replies']])
+
+
+class PublishScheduledTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create(username='test_user')
+        now = timezone.now()
+        cls.due_post_1 = Post.objects.create(title='Due 1', body='Body', author=cls.test_user,
+                                             status='SC', publish=now - timedelta(minutes=2))
+        cls.due_post_2 = Post.objects.create(title='Due 2', body='Body', author=cls.test_user,
+                                             status='SC', publish=now - timedelta(minutes=1))
+        cls.future_post = Post.objects.create(title='Future', body='Body', author=cls.test_user,
+                                              status='SC', publish=now + timedelta(days=1))
+
+    def test_publish_scheduled(self):
+        published_ids = []
+
+        def receiver(sender, post_ids, **kwargs):
+            published_ids.extend(post_ids)
+
+        post_published.connect(receiver)
+        self.addCleanup(post_published.disconnect, receiver)
+
+        updated_before = self.due_post_1.updated
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('publish_scheduled', batch_size=1, stdout=out)
+        self.assertIn('2 posts published', out.getvalue())
+
+        self.assertEqual([self.due_post_1.id, self.due_post_2.id], published_ids)
+        self.assertEqual({self.due_post_1.id, self.due_post_2.id},
+                         set(Post.objects.filter(status='PB', was_published=True).values_list('id', flat=True)))
+        self.due_post_1.refresh_from_db()
+        self.assertGreater(self.due_post_1.updated, updated_before)
+        self.future_post.refresh_from_db()
+        self.assertEqual('SC', self.future_post.status)
+
+
+class RebuildAuthorStatsTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.test_user_2, cls.test_user_3 = User.objects.bulk_create([
+            User(username='test_user_1'),
+            User(username='test_user_2'),
+            User(username='test_user_3'),
+        ])
+        post_1, post_2, _ = Post.objects.bulk_create([
+            Post(title='Post 1', body='Body', author=cls.test_user_1),
+            Post(title='Post 2', body='Body', author=cls.test_user_1, status='PB'),
+            Post(title='Post 3', body='Body', author=cls.test_user_2),
+        ])
+        UserPostRelation.objects.bulk_create([
+            UserPostRelation(user=cls.test_user_2, post=post_1, like=True, in_bookmarks=True),
+            UserPostRelation(user=cls.test_user_3, post=post_1, like=True),
+            UserPostRelation(user=cls.test_user_3, post=post_2, in_bookmarks=True),
+        ])
+        Comment.objects.create(author=cls.test_user_2, post=post_2, body='Comment')
+        ArchivedComment.objects.create(author=cls.test_user_2, post=post_2, body='Old comment')
+        # Stale rows
+        AuthorStats.objects.bulk_create([
+            AuthorStats(author=cls.test_user_1, posts_count=10),
+            AuthorStats(author=cls.test_user_3, likes_count=5),
+        ])
+
+    def test_rebuild_author_stats(self):
+        out = StringIO()
+        call_command('rebuild_author_stats', batch_size=2, stdout=out)
+        self.assertIn('stats of 3 users rebuilt', out.getvalue())
+
+        stats = {row.pop('author_id'): row for row in AuthorStats.objects.values(
+            'author_id', 'posts_count', 'likes_count', 'bookmarks_count', 'comments_count'
+        )}
+        self.assertEqual({
+            self.test_user_1.id: {'posts_count': 2, 'likes_count': 2, 'bookmarks_count': 2, 'comments_count': 2},
+            self.test_user_2.id: {'posts_count': 1, 'likes_count': 0, 'bookmarks_count': 0, 'comments_count': 0},
+            self.test_user_3.id: {'posts_count': 0, 'likes_count': 0, 'bookmarks_count': 0, 'comments_count': 0},
+        }, stats)
+
+
+class CheckCommentsCountsTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create(username='test_user')
+        cls.post_1, cls.post_2, cls.post_3 = Post.objects.bulk_create([
+            Post(title='Post 1', body='Body', author=cls.test_user, status='PB', comments_count=2),
+            Post(title='Post 2', body='Body', author=cls.test_user, status='PB', comments_count=5),
+            Post(title='Post 3', body='Body', author=cls.test_user, status='PB'),
+        ])
+        Comment.objects.create(author=cls.test_user, post=cls.post_1, body='Comment')
+        ArchivedComment.objects.create(author=cls.test_user, post=cls.post_1, body='Old comment')
+        Comment.objects.create(author=cls.test_user, post=cls.post_2, body='Comment')
+        Comment.objects.create(author=cls.test_user, post=cls.post_3, body='Deleted', deleted_at=timezone.now())
+
+    def check_counts(self, fix=False):
+        out = StringIO()
+        call_command('check_comments_counts', fix=fix, batch_size=2, stdout=out)
+        return out.getvalue()
+
+    def test_check_comments_counts(self):
+        output = self.check_counts()
+        self.assertIn(f'Post {self.post_2.id} counts 5 comments, has 1', output)
+        self.assertIn('Done, 3 posts checked, 1 wrong', output)
+        self.assertEqual(5, Post.objects.get(id=self.post_2.id).comments_count)
+
+        self.assertIn('Done, 3 posts checked, 1 wrong, fixed', self.check_counts(fix=True))
+        self.assertEqual([2, 1, 0], list(Post.objects.order_by('id').values_list('comments_count', flat=True)))
+        self.assertIn('Done, 3 posts checked, 0 wrong', self.check_counts())
+
+
+@override_settings(BLOG_JOBS_RETRY_DELAY=60, BLOG_JOBS_TIMEOUT=600)
+class RunJobsTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create(username='test_user')
+
+    def run_jobs(self, fails=False):
+        out = StringIO()
+        if fails:
+            with self.assertLogs('blog.jobs', 'ERROR'):
+                call_command('run_jobs', once=True, batch_size=2, stdout=out)
+            return out.getvalue()
+        call_command('run_jobs', once=True, batch_size=2, stdout=out)
+        return out.getvalue()
+
+    def test_enqueue_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            enqueue_on_commit(add_post, title='Deferred')
+        self.assertFalse(Job.objects.exists())
+        callbacks[0]()
+
+        job = Job.objects.get()
+        self.assertEqual('blog.tests.test_commands.add_post', job.name)
+        self.assertEqual({'title': 'Deferred'}, job.kwargs)
+        enqueue(add_post, run_at=timezone.now() + timedelta(hours=1), title='Later')
+
+        self.assertIn('Done, 1 jobs run, 0 failed', self.run_jobs())
+        self.assertEqual(['Deferred'], list(Post.objects.values_list('title', flat=True)))
+        self.assertEqual(['Later'], [job.kwargs['title'] for job in Job.objects.all()])
+
+    def test_failed_job_retried_with_backoff(self):
+        job = enqueue(failing_job)
+        self.assertIn('Done, 0 jobs run, 1 failed', self.run_jobs(fails=True))
+        job.refresh_from_db()
+        self.assertEqual((Job.Status.QUEUED, 1), (job.status, job.attempts))
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=50))
+        self.assertIn('ValueError: Failed', job.last_error)
+        # Writes of the failed attempt are rolled back
+        self.assertFalse(Post.objects.exists())
+
+        # Not due yet
+        self.assertIn('Done, 0 jobs run, 0 failed', self.run_jobs())
+        Job.objects.update(run_at=timezone.now())
+        self.run_jobs(fails=True)
+        job.refresh_from_db()
+        self.assertEqual((Job.Status.FAILED, 2), (job.status, job.attempts))
+
+    def test_stale_running_job_claimed_again(self):
+        now = timezone.now()
+        Job.objects.bulk_create([
+            Job(name=add_post.job_name, kwargs={'title': 'Stale'}, status=Job.Status.RUNNING,
+                locked_at=now - timedelta(hours=1)),
+            Job(name=add_post.job_name, kwargs={'title': 'Running'}, status=Job.Status.RUNNING,
+                locked_at=now),
+        ])
+        self.run_jobs()
+        self.assertEqual(['Stale'], list(Post.objects.values_list('title', flat=True)))
+        self.assertEqual(['Running'], [job.kwargs['title'] for job in Job.objects.all()])
+
+    def test_stale_job_failed_after_last_attempt(self):
+        Job.objects.create(name=add_post.job_name, kwargs={'title': 'Stale'}, status=Job.Status.RUNNING,
+                           locked_at=timezone.now() - timedelta(hours=1), attempts=5, max_attempts=5)
+        with self.assertLogs('blog.jobs', 'ERROR'):
+            self.assertIn('Done, 0 jobs run, 0 failed', self.run_jobs())
+        self.assertFalse(Post.objects.exists())
+        job = Job.objects.get()
+        self.assertEqual((Job.Status.FAILED, None), (job.status, job.locked_at))
+        self.assertIn('Not finished after 600 seconds', job.last_error)
+
+    def test_job_started_late_in_batch_not_taken_over(self):
+        enqueue(add_post, title='First')
+        enqueue(add_post, title='Second')
+        first, second = claim_jobs(batch_size=2)
+        # The second job waits longer than the timeout for the first one
+        later = timezone.now() + timedelta(seconds=601)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertTrue(run_job(first))
+            job_name = add_post.job_name
+            with mock.patch('blog.tests.test_commands.add_post') as function:
+                function.job_name = job_name
+                function.side_effect = lambda **kwargs: self.assertEqual([], claim_jobs())
+                self.assertTrue(run_job(second))
+        self.assertEqual(['First'], list(Post.objects.values_list('title', flat=True)))
+
+    def test_job_taken_over_not_run(self):
+        enqueue(add_post, title='Taken over')
+        job, = claim_jobs()
+        # Claimed again by another worker
+        Job.objects.update(locked_at=timezone.now() + timedelta(seconds=1), attempts=2)
+        self.assertIsNone(run_job(job))
+        self.assertFalse(Post.objects.exists())
+        self.assertEqual(Job.Status.RUNNING, Job.objects.get().status)
+
+    def test_only_marked_functions_run(self):
+        Job.objects.create(name='blog.tests.test_commands.not_a_job', max_attempts=1)
+        with mock.patch('blog.tests.test_commands.not_a_job') as function:
+            self.assertIn('1 failed', self.run_jobs(fails=True))
+        function.assert_not_called()
+        self.assertEqual(Job.Status.FAILED, Job.objects.get().status)
+
+
+class BuildRelatedPostsTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([User(username=f'test_user_{index}') for index in range(5)])
+        cls.post, cls.close, cls.far, cls.draft, cls.single = Post.objects.bulk_create([
+            Post(title='Post', body='Body', author=cls.users[0], status='PB'),
+            Post(title='Close', body='Body', author=cls.users[0], status='PB'),
+            Post(title='Far', body='Body', author=cls.users[0], status='PB'),
+            Post(title='Draft', body='Body', author=cls.users[0]),
+            Post(title='Single', body='Body', author=cls.users[0], status='PB'),
+        ])
+        engaged = {
+            cls.post: cls.users[:3],
+            # Same readers as `post`
+            cls.close: cls.users[:3],
+            # One reader more
+            cls.far: cls.users[:4],
+            cls.draft: cls.users[:3],
+            # Only one reader in common
+            cls.single: cls.users[:1],
+        }
+        UserPostRelation.objects.bulk_create([
+            UserPostRelation(user=user, post=post, like=index % 2 == 0, in_bookmarks=index % 2 == 1)
+            for post, users in engaged.items() for index, user in enumerate(users)
+        ])
+        # Not engaged
+        UserPostRelation.objects.create(user=cls.users[4], post=cls.post)
+        UserPostRelation.objects.create(user=cls.users[4], post=cls.close)
+
+    def build(self, **options):
+        out = StringIO()
+        call_command('build_related_posts', chunk_size=2, stdout=out, **options)
+        return out.getvalue()
+
+    def get_related(self, post):
+        response = self.client.get(reverse('post-related', args=(post.id, )))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return [related['title'] for related in response.data]
+
+    def test_build_related_posts(self):
+        self.assertIn('related posts of 5 posts built', self.build())
+        self.assertEqual(['Close', 'Far'], self.get_related(self.post))
+        self.assertEqual(['Post', 'Far'], self.get_related(self.close))
+        # Drafts are not related, their own related posts are built
+        self.assertEqual(['Post', 'Close', 'Far'], self.get_related(self.draft))
+        self.assertEqual([], self.get_related(self.single))
+
+        scores = dict(RelatedPost.objects.filter(post=self.post).values_list('related_id', 'score'))
+        self.assertAlmostEqual(1, scores[self.close.id])
+        self.assertAlmostEqual(3 / (3 * 4) ** 0.5, scores[self.far.id])
+
+    def test_build_related_posts_options(self):
+        self.build(top=1)
+        self.assertEqual(['Close'], self.get_related(self.post))
+        self.build(min_common=1)
+        self.assertEqual(['Close', 'Far', 'Single'], self.get_related(self.post))
+        # Only test_user_3 engaged with 2 posts or fewer
+        self.build(max_user_posts=2)
+        self.assertFalse(RelatedPost.objects.exists())
+
+    def test_rebuild_drops_deleted_posts(self):
+        self.build()
+        self.close.delete()
+        self.assertEqual(['Far'], self.get_related(self.post))
+        self.single.delete()
+        self.build(min_common=1)
+        self.assertEqual({self.post.id, self.far.id, self.draft.id},
+                         set(RelatedPost.objects.values_list('post_id', flat=True)))
+
+    def test_related_queries(self):
+        self.build()
+        url = reverse('post-related', args=(self.post.id, ))
+        # Throttling aside, one query
+        with self.assertNumQueries(1):
+            self.client.get(url)
+        response = self.client.get(reverse('post-related', args=('abc', )))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+
+class ImportBlogTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob = User.objects.bulk_create([User(username='alice'), User(username='bob')])
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, lines):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as file:
+            file.write('\n'.join(line if isinstance(line, str) else json.dumps(line) for line in lines))
+        return path
+
+    def import_blog(self, path, **options):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_blog', path, chunk_size=3, stdout=out, **options)
+        return out.getvalue()
+
+    def read_rejects(self, path):
+        with open(path) as file:
+            return [json.loads(line) for line in file]
+
+    def test_import_jsonl(self):
+        published_ids = []
+
+        def receiver(sender, post_ids, **kwargs):
+            published_ids.extend(post_ids)
+
+        post_published.connect(receiver)
+        self.addCleanup(post_published.disconnect, receiver)
+
+        path = self.write('blog.jsonl', [
+            {'type': 'post', 'ref': 1, 'author': 'alice', 'title': 'Post', 'body': 'Body', 'status': 'PB'},
+            {'type': 'post', 'ref': 2, 'author': 'bob', 'title': 'Draft', 'body': 'Body'},
+            {'type': 'comment', 'ref': 'c1', 'post': 1, 'author': 'bob', 'body': 'Comment'},
+            # The parent is in the same chunk
+            {'type': 'comment', 'ref': 'c2', 'post': 1, 'parent': 'c1', 'author': 'alice', 'body': 'Reply'},
+            {'type': 'comment', 'ref': 'c3', 'post': 1, 'parent': 'c2', 'author': 'bob', 'body': 'Reply 2'},
+            {'type': 'comment', 'post': 2, 'author': 'alice', 'body': 'Draft comment'},
+        ])
+        output = self.import_blog(path)
+        self.assertIn('Read 3 rows: 2 posts, 1 comments, 0 rejected', output)
+        self.assertIn('Done, 2 posts and 4 comments imported', output)
+        self.assertFalse(os.path.exists(f'{path}.rejects.jsonl'))
+
+        post = Post.objects.get(title='Post')
+        self.assertEqual((self.alice.id, 'PB'), (post.author_id, post.status))
+        self.assertEqual([post.id], published_ids)
+        thread = list(Comment.objects.filter(post=post).order_by('path'))
+        self.assertEqual(['Comment', 'Reply', 'Reply 2'], [comment.body for comment in thread])
+        self.assertEqual([0, 1, 2], [comment.depth for comment in thread])
+        self.assertEqual([comment.build_path() for comment in thread], [comment.path for comment in thread])
+        self.assertEqual(thread[1].id, thread[2].parent_id)
+
+        stats = {row.pop('author_id'): row for row in AuthorStats.objects.values(
+            'author_id', 'posts_count', 'comments_count'
+        )}
+        self.assertEqual({
+            self.alice.id: {'posts_count': 1, 'comments_count': 3},
+            self.bob.id: {'posts_count': 1, 'comments_count': 1},
+        }, stats)
+
+    @override_settings(BLOG_COMMENT_MAX_DEPTH=2)
+    def test_import_rejects(self):
+        path = self.write('blog.jsonl', [
+            {'type': 'post', 'ref': 1, 'author': 'alice', 'title': 'Post', 'body': 'Body'},
+            'not json',
+            {'type': 'page', 'title': 'Page'},
+            {'type': 'post', 'author': 'carol', 'body': 'Body'},
+            {'type': 'comment', 'ref': 'c1', 'post': 1, 'author': 'bob', 'body': 'Comment'},
+            {'type': 'comment', 'ref': 'c2', 'post': 1, 'parent': 'c1', 'author': 'bob', 'body': 'Reply'},
+            {'type': 'comment', 'post': 1, 'parent': 'c2', 'author': 'bob', 'body': 'Too deep'},
+            {'type': 'comment', 'post': 2, 'parent': 'c9', 'author': 'bob', 'body': ''},
+            {'type': 'post', 'author': ['alice'], 'title': 'Post', 'body': 'Body'},
+            {'type': 'comment', 'post': 1, 'author': {'name': 'bob'}, 'body': 'Comment'},
+        ])
+        rejects_path = os.path.join(self.directory, 'rejects.jsonl')
+        output = self.import_blog(path, rejects=rejects_path)
+        self.assertIn('Done, 1 posts and 2 comments imported', output)
+        self.assertIn(f'7 rows rejected, see {rejects_path}', output)
+
+        rejects = {reject['line']: reject for reject in self.read_rejects(rejects_path)}
+        self.assertEqual([2, 3, 4, 7, 8, 9, 10], sorted(rejects))
+        self.assertEqual('not json', rejects[2]['row'])
+        self.assertIn('type', rejects[3]['errors'])
+        self.assertEqual({'author', 'title'}, set(rejects[4]['errors']))
+        self.assertEqual(['Replies can be nested at most 2 levels deep.'], rejects[7]['errors']['parent'])
+        self.assertEqual({'parent'}, set(rejects[8]['errors']))
+        self.assertEqual({'author': ['Expected a username.']}, rejects[9]['errors'])
+        self.assertEqual({'author': ['Expected a username.']}, rejects[10]['errors'])
+
+    def test_import_csv(self):
+        path = self.write('blog.csv', [
+            'type,ref,post,parent,author,title,body,status',
+            'post,1,,,alice,Post,Body,PB',
+            'comment,c1,1,,bob,,"Comment, with a comma",',
+            'comment,,1,c1,alice,,Reply,',
+        ])
+        self.assertIn('Done, 1 posts and 2 comments imported', self.import_blog(path))
+        self.assertEqual(['Comment, with a comma', 'Reply'],
+                         list(Comment.objects.order_by('path').values_list('body', flat=True)))
+
+    def test_import_isolates_failed_inserts(self):
+        path = self.write('blog.jsonl', [
+            {'type': 'post', 'ref': 1, 'author': 'alice', 'title': 'Post', 'body': 'Body'},
+            {'type': 'comment', 'post': 1, 'author': 'bob', 'body': 'Comment'},
+            {'type': 'comment', 'post': 1, 'author': 'bob', 'body': 'Fails'},
+        ])
+        fill_paths = BlogImporter.fill_paths
+
+        def failing_fill_paths(comments):
+            fill_paths(comments)
+            if any(comment.body == 'Fails' for comment in comments):
+                raise DatabaseError('Insert failed')
+
+        with mock.patch.object(BlogImporter, 'fill_paths', staticmethod(failing_fill_paths)):
+            output = self.import_blog(path)
+        self.assertIn('1 posts and 1 comments imported', output)
+        self.assertEqual(['Comment'], list(Comment.objects.values_list('body', flat=True)))
+        rejects = self.read_rejects(f'{path}.rejects.jsonl')
+        self.assertEqual([(3, {'non_field_errors': ['Insert failed']})],
+                         [(reject['line'], reject['errors']) for reject in rejects])
+
+
+class PurgeDeletedTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.test_user_2 = User.objects.bulk_create([
+            User(username='test_user_1'),
+            User(username='test_user_2'),
+        ])
+        cls.post_1, cls.post_2 = Post.objects.bulk_create([
+            Post(title='Some post 1', body='Some body', author=cls.test_user_1, status='PB'),
+            Post(title='Some post 2', body='Some body', author=cls.test_user_1, status='PB'),
+        ])
+        cls.comment = Comment.objects.create(author=cls.test_user_2, post=cls.post_1, body='Comment')
+        Comment.objects.create(author=cls.test_user_1, post=cls.post_1, parent=cls.comment, body='Reply')
+        ArchivedComment.objects.create(author=cls.test_user_2, post=cls.post_1, body='Archived comment')
+        cls.other_comment = Comment.objects.create(author=cls.test_user_2, post=cls.post_2, body='Other')
+        UserPostRelation.objects.bulk_create([
+            UserPostRelation(user=cls.test_user_2, post=cls.post_1, like=True),
+            UserPostRelation(user=cls.test_user_2, post=cls.post_2, like=True),
+        ])
+
+    def purge(self, days):
+        out = StringIO()
+        call_command('purge_deleted', days=days, batch_size=1, stdout=out)
+        return out.getvalue()
+
+    def test_purge_deleted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            delete_post(self.post_1)
+        delete_comment(self.other_comment)
+        # The purge waits for the retention
+        job = Job.objects.get(name=purge_deleted_post.job_name)
+        self.assertGreater(job.run_at, timezone.now() + timedelta(days=29))
+        self.assertIn('Done, 0 rows purged', self.purge(days=30))
+
+        # Relation, the comment with its reply, the archived comment and the post,
+        # then the comment deleted on its own
+        self.assertIn('Done, 6 rows purged', self.purge(days=0))
+        self.assertFalse(Post.all_objects.filter(id=self.post_1.id).exists())
+        self.assertEqual([self.post_2.id], list(UserPostRelation.objects.values_list('post_id', flat=True)))
+        self.assertFalse(Comment.all_objects.exists())
+        self.assertFalse(ArchivedComment.all_objects.exists())
+        # Comments of the post are recorded by the purge, the other comment when it was deleted
+        self.assertEqual(4, Tombstone.objects.filter(kind=Tombstone.Kind.COMMENT).count())
+        self.assertEqual(1, Tombstone.objects.filter(kind=Tombstone.Kind.COMMENT,
+                                                     object_id=self.other_comment.id).count())
+
+    def test_purge_job(self):
+        delete_post(self.post_1)
+        purge_deleted_post(post_id=self.post_1.id)
+        # Still restorable
+        self.assertTrue(Post.all_objects.filter(id=self.post_1.id).exists())
+
+        Post.all_objects.filter(id=self.post_1.id).update(deleted_at=timezone.now() - timedelta(days=31))
+        purge_deleted_post(post_id=self.post_1.id)
+        self.assertFalse(Post.all_objects.filter(id=self.post_1.id).exists())
+        self.assertEqual([self.other_comment.id], list(Comment.all_objects.values_list('id', flat=True)))
+        self.assertFalse(ArchivedComment.all_objects.exists())
+
+
+class BenchStartupTestCase(SimpleTestCase):
+    def test_bench_startup(self):
+        out = StringIO()
+        call_command('bench_startup', profiles=['myblog.settings_api'], path='/api/missing/',
+                     runs=1, stdout=out)
+        lines = out.getvalue().splitlines()[1:]
+        self.assertEqual(['myblog.wsgi', 'myblog.asgi'], [line.split()[1] for line in lines])
+        # The lean profile serves requests without the admin and session apps
+        self.assertEqual(['404', '404'], [line.split()[-1] for line in lines])
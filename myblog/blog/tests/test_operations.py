@@ -0,0 +1,120 @@
+from importlib import import_module
+
+from django.contrib.auth.models import User
+from django.db import connection, models
+from django.db.migrations.state import ProjectState
+from django.db.models import Count, Q
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from blog.models import Post, Comment, AuthorStats
+from blog.operations import AddIndexConcurrently, AddFieldWithoutRewrite, RunBackfill, backfill
+
+
+def fill_threads(batch):
+    # Parents have smaller ids, so they are filled before their replies.
+    # Only plain model API here, migrations run it on historical models.
+    manager = batch.model._base_manager
+    for comment in batch.order_by('pk'):
+        parent = manager.get(pk=comment.parent_id) if comment.parent_id else None
+        comment.depth = parent.depth + 1 if parent else 0
+        comment.path = (parent.path if parent else '') + f'{comment.pk:012d}/'
+        comment.save(update_fields=['depth', 'path'])
+
+
+class SeedThreadsMixin:
+    def setUp(self):
+        self.test_user = User.objects.create(username='test_user')
+        posts = [Post.objects.create(title=f'Post {i}', body='Body', author=self.test_user)
+                 for i in range(3)]
+        for post in posts:
+            parent = None
+            for i in range(4):
+                parent = Comment.objects.create(author=self.test_user, post=post,
+                                                parent=parent if i % 2 else None, body='Comment')
+        # The live values, then the state before the backfill
+        self.expected = dict(Comment.objects.values_list('id', 'path'))
+        self.expected_depth = dict(Comment.objects.values_list('id', 'depth'))
+        Comment.objects.update(path='', depth=0)
+
+
+class BackfillTestCase(SeedThreadsMixin, TestCase):
+    def test_backfill(self):
+        reports = []
+        done = backfill(Comment.objects.filter(path=''), fill_threads, batch_size=5,
+                        progress=lambda done, last_pk: reports.append((done, last_pk)))
+
+        self.assertEqual(12, done)
+        self.assertEqual([5, 10, 12], [report[0] for report in reports])
+        self.assertEqual(self.expected, dict(Comment.objects.values_list('id', 'path')))
+        self.assertEqual(self.expected_depth, dict(Comment.objects.values_list('id', 'depth')))
+
+    def test_backfill_resume(self):
+        ids = sorted(self.expected)
+        backfill(Comment.objects.all(), fill_threads, batch_size=5, start_after=ids[4])
+        self.assertEqual(7, Comment.objects.exclude(path='').count())
+
+        # Remaining rows are picked up by the pending filter
+        done = backfill(Comment.objects.filter(path=''), fill_threads, batch_size=5)
+        self.assertEqual(5, done)
+
+    def test_backfill_live_aggregates(self):
+        count_comments = import_module('blog.migrations.0016_post_comments_count').count_comments
+        Comment.objects.filter(pk=min(self.expected)).update(deleted_at=timezone.now())
+        expected = dict(Post.objects.annotate(
+            live=Count('comments', filter=Q(comments__deleted_at__isnull=True))
+        ).values_list('id', 'live'))
+
+        done = backfill(Post.objects.all(), count_comments, batch_size=2)
+        self.assertEqual(3, done)
+        self.assertEqual(expected, dict(Post.objects.values_list('id', 'comments_count')))
+        self.assertEqual([3, 4, 4], sorted(expected.values()))
+
+    def test_backfill_author_stats(self):
+        rebuild_author_stats = import_module('blog.migrations.0018_rebuild_author_stats').rebuild_author_stats
+        other_user = User.objects.create(username='other_user')
+        AuthorStats.objects.create(author=self.test_user, posts_count=1)
+        Comment.objects.filter(pk=min(self.expected)).update(deleted_at=timezone.now())
+
+        done = backfill(User.objects.all(), rebuild_author_stats, batch_size=1)
+        self.assertEqual(2, done)
+        self.assertEqual({self.test_user.id: (3, 11), other_user.id: (0, 0)},
+                         {stats.author_id: (stats.posts_count, stats.comments_count)
+                          for stats in AuthorStats.objects.all()})
+
+    def test_add_field_without_rewrite(self):
+        AddFieldWithoutRewrite('post', 'counter', models.IntegerField(default=0))
+        AddFieldWithoutRewrite('post', 'note', models.TextField(null=True))
+        with self.assertRaises(ValueError):
+            AddFieldWithoutRewrite('post', 'counter', models.IntegerField())
+        with self.assertRaises(ValueError):
+            AddFieldWithoutRewrite('post', 'counter', models.IntegerField(default=0, db_index=True))
+
+
+class OperationsTestCase(SeedThreadsMixin, TransactionTestCase):
+    def test_run_backfill_operation(self):
+        operation = RunBackfill('blog.Comment', fill_threads, pending={'path': ''},
+                                batch_size=5, pause=0)
+        state = ProjectState.from_apps(Comment._meta.apps)
+        with connection.schema_editor(atomic=False) as editor:
+            operation.database_forwards('blog', editor, state, state)
+        self.assertEqual(self.expected, dict(Comment.objects.values_list('id', 'path')))
+
+    def test_add_and_remove_index(self):
+        index = models.Index(fields=['title'], name='post_title_test_idx')
+        operation = AddIndexConcurrently('post', index)
+        from_state = ProjectState.from_apps(Post._meta.apps)
+        to_state = from_state.clone()
+        operation.state_forwards('blog', to_state)
+
+        with connection.schema_editor(atomic=False) as editor:
+            operation.database_forwards('blog', editor, from_state, to_state)
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Post._meta.db_table)
+        self.assertIn('post_title_test_idx', constraints)
+
+        with connection.schema_editor(atomic=False) as editor:
+            operation.database_backwards('blog', editor, to_state, from_state)
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Post._meta.db_table)
+        self.assertNotIn('post_title_test_idx', constraints)
@@ -1,18 +1,23 @@
+import tracemalloc
+from unittest import mock
+
 from django.contrib.auth.models import User
-from django.db.models import Count, Case, When
+from django.db.models import Count, Case, When, prefetch_related_objects
 from django.test import TestCase
 from django.utils import dateparse
 
-from blog.models import Post, Comment, UserPostRelation
+from blog.archive import comments_with_archive
+from blog.models import Post, Comment, ArchivedComment, UserPostRelation
 from blog.serializers import (AuthorInfoSerializer, PostSerializer,
                               PostDetailSerializer, CommentSerializer,
                               UserPostRelationSerializer)
 
 
 class AuthorInfoSerializerTestCase(TestCase):
-    def setUp(self):
-        self.test_user_1 = User.objects.create(username='user_1', first_name='Name',
-                                               last_name='LastName')
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1 = User.objects.create(username='user_1', first_name='Name',
+                                              last_name='LastName')
 
     def test_author_info_serializer(self):
         serialized_data = AuthorInfoSerializer(self.test_user_1).data
@@ -25,18 +30,18 @@ class AuthorInfoSerializerTestCase(TestCase):
 
 
 class PostSerializerTestCase(TestCase):
-    def setUp(self):
-        self.test_user_1 = User.objects.create(username='user_1', first_name='Name_1',
-                                               last_name='LastName_1')
-        self.test_user_2 = User.objects.create(username='user_2', first_name='Name_2',
-                                               last_name='LastName_2')
-
-        self.post_1 = Post.objects.create(title='Some post 1', body='Some body 1',
-                                          author=self.test_user_1, status='PB')
-        self.post_2 = Post.objects.create(title='Some post 2', body='Some body 2',
-                                          author=self.test_user_2, status='PB')
-        self.post_3 = Post.objects.create(title='Some post 3', body='Some body 3',
-                                          author=self.test_user_2, status='PB')
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.test_user_2 = User.objects.bulk_create([
+            User(username='user_1', first_name='Name_1', last_name='LastName_1'),
+            User(username='user_2', first_name='Name_2', last_name='LastName_2'),
+        ])
+
+        cls.post_1, cls.post_2, cls.post_3 = Post.objects.bulk_create([
+            Post(title='Some post 1', body='Some body 1', author=cls.test_user_1, status='PB'),
+            Post(title='Some post 2', body='Some body 2', author=cls.test_user_2, status='PB'),
+            Post(title='Some post 3', body='Some body 3', author=cls.test_user_2, status='PB'),
+        ])
 
     def test_post_serializer_with_fields(self):
         posts = Post.objects.all().annotate(
@@ -82,7 +87,10 @@ class PostSerializerTestCase(TestCase):
                 'body': 'Some body 1',
                 'likes_count': 0,
                 'bookmarks_count': 0,
+                'views_count': 0,
+                'comments_count': 0,
                 'status': 'PB',
+                'publish': self.post_1.publish,
                 'created': self.post_1.created,
                 'updated': self.post_1.updated
             },
@@ -97,7 +105,10 @@ class PostSerializerTestCase(TestCase):
                 'body': 'Some body 2',
                 'likes_count': 0,
                 'bookmarks_count': 0,
+                'views_count': 0,
+                'comments_count': 0,
                 'status': 'PB',
+                'publish': self.post_2.publish,
                 'created': self.post_2.created,
                 'updated': self.post_2.updated
             },
@@ -112,29 +123,36 @@ class PostSerializerTestCase(TestCase):
                 'body': 'Some body 3',
                 'likes_count': 0,
                 'bookmarks_count': 0,
+                'views_count': 0,
+                'comments_count': 0,
                 'status': 'PB',
+                'publish': self.post_3.publish,
                 'created': self.post_3.created,
                 'updated': self.post_3.updated
             },
         ]
         for data in serialized_data:
+            data['publish'] = dateparse.parse_datetime(data['publish'])
             data['created'] = dateparse.parse_datetime(data['created'])
             data['updated'] = dateparse.parse_datetime(data['updated'])
         self.assertEqual(expected_data, serialized_data)
 
 
 class PostDetailSerializerTestCase(TestCase):
-    def setUp(self):
-        self.test_user_1 = User.objects.create(username='user_1')
-        self.test_user_2 = User.objects.create(username='user_2')
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.test_user_2 = User.objects.bulk_create([
+            User(username='user_1'),
+            User(username='user_2'),
+        ])
 
-        self.post_1 = Post.objects.create(title='Some post', body='Some body',
-                                          author=self.test_user_1, status='PB')
+        cls.post_1 = Post.objects.create(title='Some post', body='Some body',
+                                         author=cls.test_user_1, status='PB')
 
-        self.comment_1 = Comment.objects.create(author=self.test_user_2, post=self.post_1,
-                                                body='Comment 1')
-        self.comment_2 = Comment.objects.create(author=self.test_user_2, post=self.post_1,
-                                                body='Comment 2')
+        cls.comment_1 = Comment.objects.create(author=cls.test_user_2, post=cls.post_1,
+                                               body='Comment 1')
+        cls.comment_2 = Comment.objects.create(author=cls.test_user_2, post=cls.post_1,
+                                               body='Comment 2')
 
     def test_post_detail_serializer_with_fields(self):
         post = Post.objects.all().annotate(
@@ -145,6 +163,8 @@ class PostDetailSerializerTestCase(TestCase):
             'id', 'title',
             'body', 'comments',
         )).data
+        # Threads are yielded lazily without a request
+        serialized_data['comments'] = list(serialized_data['comments'])
         expected_data = {
             'id': self.post_1.id,
             'title': 'Some post',
@@ -157,9 +177,11 @@ class PostDetailSerializerTestCase(TestCase):
                         'first_name': self.test_user_2.first_name,
                         'last_name': self.test_user_2.last_name
                     },
+                    'parent': None,
                     'body': self.comment_1.body,
                     'created': self.comment_1.created,
-                    'updated': self.comment_1.updated
+                    'updated': self.comment_1.updated,
+                    'replies': []
                 },
                 {
                     'id': self.comment_2.id,
@@ -168,9 +190,11 @@ class PostDetailSerializerTestCase(TestCase):
                         'first_name': self.test_user_2.first_name,
                         'last_name': self.test_user_2.last_name
                     },
+                    'parent': None,
                     'body': self.comment_2.body,
                     'created': self.comment_2.created,
-                    'updated': self.comment_2.updated
+                    'updated': self.comment_2.updated,
+                    'replies': []
                 },
             ]
         }
@@ -185,6 +209,7 @@ class PostDetailSerializerTestCase(TestCase):
             bookmarks_count=Count(Case(When(userpostrelation__in_bookmarks=True, then=1)))
         ).get(id=self.post_1.id)
         serialized_data = PostDetailSerializer(post).data
+        serialized_data['comments'] = list(serialized_data['comments'])
         expected_data = {
             'id': self.post_1.id,
             'author': {
@@ -199,6 +224,7 @@ class PostDetailSerializerTestCase(TestCase):
             'updated': self.post_1.updated,
             'likes_count': 0,
             'bookmarks_count': 0,
+            'views_count': 0,
             'comments': [
                 {
                     'id': self.comment_1.id,
@@ -207,9 +233,11 @@ class PostDetailSerializerTestCase(TestCase):
                         'first_name': self.test_user_2.first_name,
                         'last_name': self.test_user_2.last_name
                     },
+                    'parent': None,
                     'body': self.comment_1.body,
                     'created': self.comment_1.created,
-                    'updated': self.comment_1.updated
+                    'updated': self.comment_1.updated,
+                    'replies': []
                 },
                 {
                     'id': self.comment_2.id,
@@ -218,9 +246,11 @@ class PostDetailSerializerTestCase(TestCase):
                         'first_name': self.test_user_2.first_name,
                         'last_name': self.test_user_2.last_name
                     },
+                    'parent': None,
                     'body': self.comment_2.body,
                     'created': self.comment_2.created,
-                    'updated': self.comment_2.updated
+                    'updated': self.comment_2.updated,
+                    'replies': []
                 },
             ]
         }
@@ -232,15 +262,104 @@ class PostDetailSerializerTestCase(TestCase):
             comment['updated'] = dateparse.parse_datetime(comment['updated'])
         self.assertEqual(expected_data, serialized_data)
 
+    def test_post_detail_serializer_threads(self):
+        reply_1 = Comment.objects.create(author=self.test_user_1, post=self.post_1,
+                                         parent=self.comment_1, body='Reply 1')
+        reply_2 = Comment.objects.create(author=self.test_user_2, post=self.post_1,
+                                         parent=reply_1, body='Reply 2')
+        reply_3 = Comment.objects.create(author=self.test_user_2, post=self.post_1,
+                                         parent=self.comment_1, body='Reply 3')
+        self.assertEqual(2, reply_2.depth)
+        self.assertEqual(f'{self.comment_1.id:012d}/{reply_1.id:012d}/{reply_2.id:012d}/', reply_2.path)
+
+        serialized_data = PostDetailSerializer(self.post_1, fields=('comments', )).data
+
+        def tree(comments):
+            return [(comment['id'], tree(comment['replies'])) for comment in comments]
+
+        expected_data = [
+            (self.comment_1.id, [(reply_1.id, [(reply_2.id, [])]), (reply_3.id, [])]),
+            (self.comment_2.id, []),
+        ]
+        self.assertEqual(expected_data, tree(serialized_data['comments']))
+
+
+class CommentStreamingTestCase(TestCase):
+    """
+    Peak memory of serializing a thread of 5000 comments
+    """
+    comments_count = 5000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1 = User.objects.create(username='user_1', first_name='Name')
+        cls.post = Post.objects.create(title='Some post', body='Some body', author=cls.test_user_1, status='PB')
+        comments = Comment.objects.bulk_create([
+            Comment(author=cls.test_user_1, post=cls.post, body=f'Comment {i} ' + 'text ' * 40)
+            for i in range(cls.comments_count)
+        ])
+        for comment in comments:
+            comment.path = comment.build_path()
+        Comment.objects.bulk_update(comments, ['path'], batch_size=1000)
+        ArchivedComment.objects.create(author=cls.test_user_1, post=cls.post, body='Archived',
+                                       path=f'{comments[-1].id + 1:012d}/')
+
+    def measure_peak(self, serialize):
+        tracemalloc.start()
+        try:
+            serialize()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def serialize_instances(self):
+        # Serialization of the whole thread from model instances
+        comments = list(comments_with_archive(ordering=('path', ), post=self.post))
+        prefetch_related_objects(comments, 'author')
+        return CommentSerializer(comments, many=True).data
+
+    def test_iter_comments(self):
+        chunks = list(PostDetailSerializer.iter_comments(self.post, chunk_size=2000))
+        self.assertEqual([2000, 2000, 1001], [len(chunk) for chunk in chunks])
+        self.assertEqual(self.serialize_instances(), [comment for chunk in chunks for comment in chunk])
+        self.assertEqual('Archived', chunks[-1][-1]['body'])
+
+    def test_get_comments_peak_memory(self):
+        def stream():
+            threads = PostDetailSerializer(self.post, fields=('comments', )).data['comments']
+            for _ in threads:
+                pass
+
+        materialized = self.measure_peak(self.serialize_instances)
+        with mock.patch.object(PostDetailSerializer, 'comments_chunk_size', 250):
+            streamed = self.measure_peak(stream)
+        # Bounded by a chunk of rows and one thread instead of the post
+        self.assertLess(streamed, materialized / 10)
+
+    def test_get_comments_threads(self):
+        comments = list(Comment.objects.order_by('path')[:2])
+        reply = Comment.objects.create(author=self.test_user_1, post=self.post, parent=comments[0], body='Reply')
+        Comment.objects.create(author=self.test_user_1, post=self.post, parent=reply, body='Reply to reply')
+
+        threads = PostDetailSerializer(self.post, fields=('comments', )).data['comments']
+        first, second = next(threads), next(threads)
+        self.assertEqual([comments[0].id, comments[1].id], [first['id'], second['id']])
+        self.assertEqual([reply.id], [comment['id'] for comment in first['replies']])
+        self.assertEqual(['Reply to reply'], [comment['body'] for comment in first['replies'][0]['replies']])
+        self.assertEqual(self.comments_count - 1, sum(1 for _ in threads))
+
 
 class CommentSerializerTestCase(TestCase):
-    def setUp(self):
-        self.test_user_1 = User.objects.create(username='user_1')
-        self.test_user_2 = User.objects.create(username='user_2')
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.test_user_2 = User.objects.bulk_create([
+            User(username='user_1'),
+            User(username='user_2'),
+        ])
 
-        self.post = Post.objects.create(title='Some post', body='Some body', author=self.test_user_1,
-                                        status='PB')
-        self.comment = Comment.objects.create(body='Some comment', author=self.test_user_2, post=self.post)
+        cls.post = Post.objects.create(title='Some post', body='Some body', author=cls.test_user_1,
+                                       status='PB')
+        cls.comment = Comment.objects.create(body='Some comment', author=cls.test_user_2, post=cls.post)
 
     def test_comment_serializer(self):
         serialized_data = CommentSerializer(self.comment).data
@@ -251,6 +370,7 @@ class CommentSerializerTestCase(TestCase):
                 'first_name': self.test_user_2.first_name,
                 'last_name': self.test_user_2.last_name
             },
+            'parent': None,
             'body': 'Some comment',
             'created': self.comment.created,
             'updated': self.comment.updated
@@ -261,14 +381,17 @@ class CommentSerializerTestCase(TestCase):
 
 
 class UserPostRelationSerializerTestCase(TestCase):
-    def setUp(self):
-        self.test_user_1 = User.objects.create(username='user_1')
-        self.test_user_2 = User.objects.create(username='user_2')
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user_1, cls.test_user_2 = User.objects.bulk_create([
+            User(username='user_1'),
+            User(username='user_2'),
+        ])
 
-        self.post = Post.objects.create(title='Some post', body='Some body', author=self.test_user_1,
-                                        status='PB')
+        cls.post = Post.objects.create(title='Some post', body='Some body', author=cls.test_user_1,
+                                       status='PB')
 
-        self.relation = UserPostRelation(user=self.test_user_2, post=self.post)
+        cls.relation = UserPostRelation(user=cls.test_user_2, post=cls.post)
 
     def test_relation(self):
         serialized_data = UserPostRelationSerializer(self.relation).data
@@ -0,0 +1,153 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.exceptions import Throttled
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """
+    Sliding window counter throttle.
+
+    Requests are counted in fixed windows, and the count of the previous window
+    is weighted by how much of it still overlaps the sliding window. A check costs
+    one `get_many` and one `incr` on the cache whatever the rate, unlike the
+    timestamp history kept by `SimpleRateThrottle`.
+
+    The scope (`read`, `search` or `write`) is picked per request and the rate is
+    looked up as `<scope>_<ident_scope>` in `DEFAULT_THROTTLE_RATES`.
+    """
+    ident_scope = None
+
+    def __init__(self):
+        # The rate depends on the request, it is resolved in `allow_request`
+        self.wait_time = None
+
+    def get_ident_key(self, request):
+        """
+        Should return a key identifying the client without touching the database,
+        or `None` if the request should not be throttled.
+        """
+        raise NotImplementedError('.get_ident_key() must be overridden')
+
+    def get_scope(self, request, view):
+        if request.method not in SAFE_METHODS:
+            return 'write'
+        if request.query_params.get(api_settings.SEARCH_PARAM):
+            return 'search'
+        return 'read'
+
+    def allow_request(self, request, view):
+        ident = self.get_ident_key(request)
+        if ident is None:
+            return True
+
+        self.scope = f'{self.get_scope(request, view)}_{self.ident_scope}'
+        self.rate = self.THROTTLE_RATES.get(self.scope)
+        if self.rate is None:
+            return True
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        self.key = self.cache_format % {'scope': self.scope, 'ident': ident}
+
+        window, offset = divmod(self.timer(), self.duration)
+        current_key = f'{self.key}_{int(window)}'
+        previous_key = f'{self.key}_{int(window) - 1}'
+        counts = self.cache.get_many([previous_key, current_key])
+        overlap = 1 - offset / self.duration
+        if counts.get(previous_key, 0) * overlap + counts.get(current_key, 0) >= self.num_requests:
+            # Upper bound, the previous window usually stops weighing earlier
+            self.wait_time = self.duration - offset
+            return False
+
+        try:
+            self.cache.incr(current_key)
+        except ValueError:
+            # First request of the window, keep it long enough to weigh the next window
+            if not self.cache.add(current_key, 1, self.duration * 2):
+                self.cache.incr(current_key)
+        return True
+
+    def wait(self):
+        return self.wait_time
+
+
+def token_digest(key):
+    return hashlib.sha256(key).hexdigest()
+
+
+def known_token_key(digest):
+    return f'blog.known_token.{digest}'
+
+
+class KnownTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication remembering the tokens it accepts, so the per-user
+    throttle can tell them apart without a query
+    """
+    def authenticate_credentials(self, key):
+        credentials = super().authenticate_credentials(key)
+        default_cache.set(known_token_key(token_digest(key.encode())), True, settings.BLOG_KNOWN_TOKEN_TIMEOUT)
+        return credentials
+
+
+class UserSlidingWindowThrottle(SlidingWindowThrottle):
+    """
+    Per-user limits, keyed by the auth token so the user is never loaded.
+    Tokens that have not authenticated yet share one key per IP address,
+    so sending random tokens doesn't get a fresh limit every time.
+    """
+    ident_scope = 'user'
+
+    def get_ident_key(self, request):
+        auth = get_authorization_header(request).split()
+        if len(auth) != 2 or auth[0].lower() != b'token':
+            return None
+        digest = token_digest(auth[1])
+        if self.cache.get(known_token_key(digest)) is None:
+            return f'ip-{self.get_ident(request)}'
+        return digest
+
+
+class IPSlidingWindowThrottle(SlidingWindowThrottle):
+    """
+    Per-IP limits for every request
+    """
+    ident_scope = 'ip'
+
+    def get_ident_key(self, request):
+        return self.get_ident(request)
+
+
+class ThrottleBeforeAuthMixin:
+    """
+    Check throttles before authentication and permissions, so a rejected request
+    costs no database queries. Throttles must not depend on `request.user`.
+    """
+    def initial(self, request, *args, **kwargs):
+        super().check_throttles(request)
+        super().initial(request, *args, **kwargs)
+
+    def check_throttles(self, request):
+        # Already checked in `initial`
+        pass
+
+
+def throttle_request(request):
+    """
+    Check the default throttles for a plain Django view, return a `Throttled`
+    error if any of them rejects the request
+    """
+    request = Request(request)
+    waits = []
+    for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES:
+        throttle = throttle_class()
+        if not throttle.allow_request(request, None):
+            waits.append(throttle.wait())
+    if not waits:
+        return None
+    return Throttled(max((wait for wait in waits if wait is not None), default=None))
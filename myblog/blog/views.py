@@ -1,68 +1,136 @@
+from asgiref.sync import sync_to_async
+
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.db.models import Count, Case, When, Prefetch
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import SearchFilter, OrderingFilter
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework import mixins
 
-from blog.models import Post, Comment, UserPostRelation
-from blog.pagination import ListPagination
-from blog.serializers import PostSerializer, CommentSerializer, PostDetailSerializer, UserPostRelationSerializer
+from blog.archive import comments_with_archive
+from blog.autocomplete import get_suggestions, clear_suggestions
+from blog.counters import record_view
+from blog.deletion import delete_post, restore_post, delete_comment, restore_comment, has_live_parent
+from blog.events import comment_events, open_stream, publish_comment
+from blog.models import Post, Comment, ArchivedComment, UserPostRelation, AuthorStats
+from blog.pagination import ListPagination, CachedCountPagination, ModerationPagination, invalidate_counts
+from blog.serializers import (PostSerializer, CommentSerializer, PostDetailSerializer, UserPostRelationSerializer,
+                              AuthorStatsSerializer, RelationChangeSerializer, ModerationPostSerializer,
+                              ModerationSerializer)
 from blog.permissions import IsOwnerOrStaffOrReadOnly, PermissionForUpdate, ItsOwnerOrStaff
+from blog.profiling import (ProfilingMixin, PROFILE_HEADER, get_profiles, get_profile, get_profile_data,
+                            make_profile_token)
+from blog.publishing import announce_published, moderate_posts
+from blog.stats import change_stats, change_post_author_stats, change_comments_count
+from blog.sync import get_changes, InvalidToken
+from blog.throttling import ThrottleBeforeAuthMixin, IPSlidingWindowThrottle, throttle_request
 
 
-class PostViewSet(ModelViewSet):
-    queryset = Post.objects.all().annotate(
-        likes_count=Count(Case(When(userpostrelation__like=True, then=1))),
-        bookmarks_count=Count(Case(When(userpostrelation__in_bookmarks=True, then=1)))
-    )
+class PostViewSet(ProfilingMixin, ThrottleBeforeAuthMixin, ModelViewSet):
+    queryset = Post.objects.all()
     serializer_class = PostSerializer
-    pagination_class = ListPagination
+    pagination_class = CachedCountPagination
     filter_backends = [SearchFilter, OrderingFilter]
     search_fields = ['title', 'body']
     ordering_fields = ['created']
+    # Max number of posts for batch retrieval and bulk creation
+    max_batch_size = 100
+    # Listings of the posts of the user set it, their counts are cached per user
+    count_per_user = False
 
     def get_permissions(self):
         if self.action in ['update', 'partial_update']:
             permission_classes = [IsOwnerOrStaffOrReadOnly, PermissionForUpdate]
-        elif self.action == 'add_comment':
+        elif self.action in ['add_comment', 'bulk', 'my_stats', 'changes']:
             permission_classes = [IsAuthenticated]
+        elif self.action in ['moderation', 'moderate']:
+            permission_classes = [IsAdminUser]
         else:
             permission_classes = [IsOwnerOrStaffOrReadOnly]
         return [permission() for permission in permission_classes]
 
-    def get_queryset(self):
-        if self.action == 'list':
-            # Return queryset with status "PB"
-            queryset = self.queryset.filter(status='PB').prefetch_related(
+    def get_requested_ids(self):
+        """
+        Parse the `ids` query parameter of batch retrieval, None if it is absent
+        """
+        ids = self.request.query_params.get('ids')
+        if ids is None:
+            return None
+        try:
+            ids = {int(value) for value in ids.split(',') if value}
+        except ValueError:
+            raise ValidationError({'ids': 'Expected a comma-separated list of post ids.'})
+        if len(ids) > self.max_batch_size:
+            raise ValidationError({'ids': f'Ensure this list has no more than {self.max_batch_size} ids.'})
+        return ids
+
+    def get_queryset(self, with_counts=True):
+        queryset = self.queryset
+        if with_counts:
+            queryset = queryset.annotate(
+                likes_count=Count(Case(When(userpostrelation__like=True, then=1))),
+                bookmarks_count=Count(Case(When(userpostrelation__in_bookmarks=True, then=1)))
+            )
+
+        if self.action == 'list' and 'ids' in self.request.query_params:
+            # Return requested posts, drafts only for the owner or staff
+            queryset = queryset.filter(id__in=self.get_requested_ids()).select_related('author')
+            return queryset.visible_to(self.request.user).order_by('id')
+        elif self.action == 'list':
+            # Return queryset with status "PB" and publish time in the past
+            queryset = queryset.published().prefetch_related(
                 Prefetch('author', queryset=User.objects.all().only('first_name', 'last_name'))
             )
             return queryset
         elif self.action == 'my_posts':
-            # Return queryset with posts for owner
-            user = self.request.user
-            queryset = self.queryset.filter(author=user)
-            return queryset
-        elif self.action == 'retrieve':
-            return self.queryset.select_related('author')
+            # Return queryset with posts for owner, the author is not serialized
+            return queryset.filter(author_id=self.request.user.id)
+        elif self.action in ['retrieve', 'update', 'partial_update']:
+            return queryset.select_related('author')
+        elif self.action == 'destroy':
+            # Only permission checks need the post
+            return Post.objects.only('id', 'status', 'author_id', 'comments_count')
+        elif self.action == 'restore':
+            return (Post.all_objects.filter(deleted_at__isnull=False)
+                    .only('id', 'status', 'author_id', 'comments_count'))
+        elif self.action == 'moderation':
+            # Read through `post_moderation_idx`, ordered by the paginator
+            return Post.objects.awaiting_moderation().select_related('author')
+        elif self.action == 'moderate':
+            return Post.objects.only('id', 'status', 'publish', 'author_id')
         else:
-            return self.queryset
+            return queryset
+
+    def get_count_queryset(self):
+        """
+        The filtered listing for counting, without the likes and bookmarks joins
+        """
+        return self.filter_queryset(self.get_queryset(with_counts=False))
 
     def list(self, request, *args, **kwargs):
         """
-        List method for get all posts
+        List method for get all posts, or the posts requested with `ids`
         """
         queryset = self.filter_queryset(self.get_queryset())
+        fields = ('id', 'author', 'title',
+                  'body', 'likes_count', 'bookmarks_count', 'views_count', 'comments_count',
+                  'created', 'updated')
+
+        if 'ids' in request.query_params:
+            # Batch retrieval is not paginated
+            serializer = self.get_serializer(queryset, many=True, fields=fields)
+            return Response(serializer.data)
 
         # Pagination
         page = self.paginate_queryset(queryset)
-        serializer = self.get_serializer(page, many=True,
-                                         fields=('id', 'author', 'title',
-                                                 'body', 'likes_count', 'bookmarks_count',
-                                                 'created', 'updated'))
+        serializer = self.get_serializer(page, many=True, fields=fields)
         return self.get_paginated_response(serializer.data)
 
     def retrieve(self, request, *args, **kwargs):
@@ -71,20 +139,22 @@ class PostViewSet(ModelViewSet):
         else return data with fields for all users.
         """
         instance = self.get_object()
-        if instance.author == self.request.user:
+        # Counted in memory, written in bulk later
+        record_view(instance.id)
+        if instance.author_id == self.request.user.id:
             serializer = PostDetailSerializer(instance, fields=('id', 'title', 'body',
                                                                 'status', 'likes_count', 'bookmarks_count',
-                                                                'comments'),
+                                                                'views_count', 'comments'),
                                               context={'request': self.request})
             return Response(serializer.data)
         else:
             serializer = PostDetailSerializer(instance, fields=('id', 'author', 'title',
                                                                 'body', 'likes_count', 'bookmarks_count',
-                                                                'comments'),
+                                                                'views_count', 'comments'),
                                               context={'request': self.request})
             return Response(serializer.data)
 
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], count_per_user=True)
     def my_posts(self, request):
         """
         Action to get own posts
@@ -95,30 +165,167 @@ class PostViewSet(ModelViewSet):
         page = self.paginate_queryset(queryset)
         serializer = PostSerializer(page, many=True,
                                     fields=('id', 'title', 'body',
-                                            'likes_count', 'bookmarks_count', 'status'))
+                                            'likes_count', 'bookmarks_count', 'views_count',
+                                            'comments_count', 'status'))
         return self.get_paginated_response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def my_stats(self, request):
+        """
+        Action to get totals over own posts, read from the rollup table
+        """
+        stats = AuthorStats.objects.filter(author_id=request.user.id).first()
+        serializer = AuthorStatsSerializer(stats or AuthorStats(author_id=request.user.id))
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """
+        Action to get ids and titles of published posts starting with the `q` prefix
+        """
+        suggestions = get_suggestions(request.query_params.get('q', ''))
+        return Response([{'id': pk, 'title': title} for pk, title in suggestions])
+
+    @action(detail=False, methods=['get'], pagination_class=ModerationPagination, filter_backends=[])
+    def moderation(self, request):
+        """
+        Action for staff to list drafts and posts edited since they were moderated, oldest first
+        """
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = ModerationPostSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @moderation.mapping.patch
+    def moderate(self, request):
+        """
+        Action for staff to change the status of several posts with one update. Posts
+        already in the status are marked reviewed, posts whose status could not be
+        changed by a single update are skipped.
+        """
+        serializer = ModerationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids, new_status = serializer.validated_data['ids'], serializer.validated_data['status']
+        # Per-row checks of single updates
+        permissions = [IsOwnerOrStaffOrReadOnly(), PermissionForUpdate()]
+        with transaction.atomic():
+            posts = self.get_queryset().select_for_update().filter(id__in=ids)
+            allowed = [post for post in posts if post.status == new_status or all(
+                permission.has_object_permission(request, self, post) for permission in permissions
+            )]
+            updated = moderate_posts(allowed, new_status)
+        if updated:
+            # `update` sends no post_save
+            invalidate_counts(Post)
+            clear_suggestions()
+        return Response({'status': 'Posts moderated', 'updated': sorted(updated),
+                         'skipped': sorted(set(ids) - set(updated))})
+
+    @action(detail=True, methods=['get'])
+    def related(self, request, pk=None):
+        """
+        Action to get published posts liked or bookmarked by the readers of the post,
+        read from the table built by `manage.py build_related_posts`
+        """
+        try:
+            pk = int(pk)
+        except ValueError:
+            raise Http404
+        posts = (Post.objects.published().filter(related_to__post_id=pk)
+                 .select_related('author').order_by('related_to__rank'))
+        serializer = PostSerializer(posts, many=True, fields=('id', 'author', 'title', 'publish'))
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Action to get posts, own comments and own relations changed since the sync
+        `token` of the previous response. Call it again while `more` is true.
+        """
+        try:
+            changes = get_changes(request.user, request.query_params.get('token'), limit=self.max_batch_size)
+        except InvalidToken as e:
+            raise ValidationError({'token': str(e)})
+        return Response({
+            'posts': PostSerializer(changes['posts'], many=True,
+                                    fields=('id', 'author', 'title', 'body', 'status',
+                                            'publish', 'created', 'updated')).data,
+            'comments': CommentSerializer(changes['comments'], many=True,
+                                          fields=('id', 'body', 'created', 'updated')).data,
+            'relations': RelationChangeSerializer(changes['relations'], many=True).data,
+            'deleted': changes['deleted'],
+            'token': changes['token'],
+            'more': changes['more'],
+        })
+
     @action(detail=True, methods=['post'])
     def add_comment(self, request, pk=None):
         """
         Action for add comment to the post
         """
         post = self.get_object()
-        serializer = CommentSerializer(data=request.data)
+        serializer = CommentSerializer(data=request.data, context={'post': post})
         if serializer.is_valid():
             serializer.validated_data['author'] = self.request.user
             serializer.validated_data['post'] = post
-            serializer.save()
+            # The counts change with the comment, it is published once they are committed
+            with transaction.atomic():
+                comment = serializer.save()
+                change_stats(post.author_id, comments_count=1)
+                change_comments_count(post.id, 1)
+                publish_comment(post, comment)
             return Response({'status': 'Comment added'})
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=True, methods=['post'])
+    def restore(self, request, pk=None):
+        """
+        Action for restore a deleted post with its comments and relations, until it is purged
+        """
+        restore_post(self.get_object())
+        return Response({'status': 'Post restored'})
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Action for create several posts with one insert
+        """
+        serializer = PostSerializer(data=request.data, many=True, max_length=self.max_batch_size)
+        serializer.is_valid(raise_exception=True)
+        # bulk_create doesn't call `Post.save`
+        posts = Post.objects.bulk_create(
+            [Post(author=request.user, was_published=data.get('status') == Post.Status.PUBLISHED, **data)
+             for data in serializer.validated_data]
+        )
+        change_stats(request.user.id, posts_count=len(posts))
+        # bulk_create sends no post_save
+        invalidate_counts(Post)
+        announce_published(post.id for post in posts if post.status == Post.Status.PUBLISHED)
+        serializer = PostSerializer(posts, many=True,
+                                    fields=('id', 'title', 'body', 'status', 'created', 'updated'))
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     def perform_create(self, serializer):
         serializer.validated_data['author'] = self.request.user
-        serializer.save()
+        post = serializer.save()
+        change_stats(post.author_id, posts_count=1)
+        if post.status == Post.Status.PUBLISHED:
+            announce_published([post.id])
+
+    def perform_update(self, serializer):
+        was_published = serializer.instance.status == Post.Status.PUBLISHED
+        # Edits by authors wait for moderation
+        post = serializer.save(needs_review=not self.request.user.is_staff)
+        if post.status == Post.Status.PUBLISHED and not was_published:
+            announce_published([post.id])
 
+    def perform_destroy(self, instance):
+        delete_post(instance)
 
-class CommentViewSet(mixins.RetrieveModelMixin,
+
+class CommentViewSet(ProfilingMixin,
+                     ThrottleBeforeAuthMixin,
+                     mixins.RetrieveModelMixin,
                      mixins.UpdateModelMixin,
                      mixins.DestroyModelMixin,
                      GenericViewSet):
@@ -129,11 +336,31 @@ class CommentViewSet(mixins.RetrieveModelMixin,
 
     def get_queryset(self):
         if self.action == 'my_comments':
-            user = self.request.user
-            queryset = self.queryset.filter(author=user)
-            return queryset
+            # Hot and archived comments of the user
+            return comments_with_archive(author_id=self.request.user.id, post__deleted_at__isnull=True)
+        elif self.action == 'destroy':
+            # Only permission checks and the subtree lookup need the comment
+            return Comment.objects.only('id', 'author_id', 'post_id', 'path').filter(post__deleted_at__isnull=True)
+        elif self.action == 'restore':
+            return Comment.all_objects.filter(deleted_at__isnull=False)
         else:
-            return self.queryset
+            # Comments of deleted posts are gone with the post until it is restored
+            return self.queryset.filter(post__deleted_at__isnull=True)
+
+    def get_object(self):
+        """
+        Look up the comment in the hot table first, then in the archive
+        """
+        try:
+            return super().get_object()
+        except Http404:
+            if self.action == 'restore':
+                queryset = ArchivedComment.all_objects.filter(deleted_at__isnull=False)
+            else:
+                queryset = ArchivedComment.objects.select_related('author').filter(post__deleted_at__isnull=True)
+            obj = get_object_or_404(queryset, pk=self.kwargs[self.lookup_field])
+            self.check_object_permissions(self.request, obj)
+            return obj
 
     def retrieve(self, request, pk=None, *args, **kwargs):
         instance = self.get_object()
@@ -145,6 +372,22 @@ class CommentViewSet(mixins.RetrieveModelMixin,
             serializer = self.get_serializer(instance, fields=('id', 'body', 'created', 'updated'))
         return Response(serializer.data)
 
+    def perform_destroy(self, instance):
+        delete_comment(instance)
+
+    @action(detail=True, methods=['post'])
+    def restore(self, request, pk=None):
+        """
+        Action for restore a deleted comment with its replies, until it is purged
+        """
+        comment = self.get_object()
+        if not Post.objects.filter(id=comment.post_id).exists():
+            raise ValidationError({'post': 'The post of the comment is deleted.'})
+        if not has_live_parent(comment):
+            raise ValidationError({'parent': 'Restore the parent comment first.'})
+        restore_comment(comment)
+        return Response({'status': 'Comment restored'})
+
     @action(detail=False, methods=['get'])
     def my_comments(self, request):
         """
@@ -161,7 +404,8 @@ class CommentViewSet(mixins.RetrieveModelMixin,
         return self.get_paginated_response(serializer.data)
 
 
-class UserPostRelationViewSet(mixins.UpdateModelMixin,
+class UserPostRelationViewSet(ThrottleBeforeAuthMixin,
+                              mixins.UpdateModelMixin,
                               GenericViewSet):
     """
     ViewSet for create or update relation (like or bookmarks)
@@ -172,6 +416,75 @@ class UserPostRelationViewSet(mixins.UpdateModelMixin,
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        obj, created = UserPostRelation.objects.get_or_create(user=self.request.user,
-                                                              post_id=self.kwargs['post_id'])
-        return obj
+        """
+        The relation of the user to a live post, created on first change
+        """
+        post_id = self.kwargs['post_id']
+        try:
+            return UserPostRelation.objects.get(user=self.request.user, post_id=post_id,
+                                                post__deleted_at__isnull=True)
+        except UserPostRelation.DoesNotExist:
+            # Deleted posts take no new likes or bookmarks
+            post = get_object_or_404(Post.objects.only('id'), id=post_id)
+            obj, created = UserPostRelation.objects.get_or_create(user=self.request.user, post=post)
+            return obj
+
+    def perform_update(self, serializer):
+        like, in_bookmarks = serializer.instance.like, serializer.instance.in_bookmarks
+        relation = serializer.save()
+        change_post_author_stats(relation.post_id, likes_count=relation.like - like,
+                                 bookmarks_count=relation.in_bookmarks - in_bookmarks)
+
+
+class ProfileViewSet(GenericViewSet):
+    """
+    ViewSet for staff to list and download request profiles, see `blog.profiling`
+    """
+    permission_classes = [IsAdminUser]
+    lookup_value_regex = r'\d+'
+
+    def list(self, request):
+        return Response([{key: value for key, value in profile.items() if key != 'stats'}
+                         for profile in get_profiles()])
+
+    @action(detail=False, methods=['post'])
+    def token(self, request):
+        """
+        Action to get a token profiling the requests that send it in the `X-Profile` header
+        """
+        return Response({'header': PROFILE_HEADER, 'token': make_profile_token(request.user)})
+
+    def retrieve(self, request, pk=None):
+        """
+        Download a profile in the format of `pstats.Stats.dump_stats`
+        """
+        profile = get_profile(int(pk))
+        if profile is None:
+            raise Http404
+        response = HttpResponse(get_profile_data(profile), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="profile-{profile["id"]}.prof"'
+        return response
+
+
+async def post_comments_stream(request, pk):
+    """
+    Server-sent events with the comments added to a published post.
+    Served under ASGI, a WSGI worker would be held for the whole stream.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    throttled = await sync_to_async(throttle_request)(request)
+    if throttled is not None:
+        headers = {'Retry-After': '%d' % throttled.wait} if throttled.wait else None
+        return JsonResponse({'detail': throttled.detail}, status=throttled.status_code, headers=headers)
+    if not await Post.objects.filter(id=pk).published().aexists():
+        raise Http404
+    try:
+        last_id = int(request.headers['Last-Event-ID'])
+    except (KeyError, ValueError):
+        last_id = None
+    client = IPSlidingWindowThrottle().get_ident(request)
+    if not await open_stream(client):
+        return JsonResponse({'detail': 'Too many open streams.'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    return StreamingHttpResponse(comment_events(pk, last_id, client), content_type='text/event-stream',
+                                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
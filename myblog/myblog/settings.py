@@ -90,6 +90,17 @@ DATABASES = {
 }
 
 
+# Cache
+# Throttle counters live here. The local-memory cache keeps them per process,
+# point it to Redis or Memcached to share them between workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -140,14 +151,82 @@ LOGGING = {
         'django.db.backends': {
             'handlers': ['console'],
             'level': 'DEBUG'
+        },
+        'blog': {
+            'handlers': ['console'],
+            'level': 'INFO'
         }
     }
 }
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'blog.throttling.KnownTokenAuthentication',
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 10,
+    'DEFAULT_THROTTLE_CLASSES': (
+        'blog.throttling.UserSlidingWindowThrottle',
+        'blog.throttling.IPSlidingWindowThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'read_user': '600/min',
+        'read_ip': '1200/min',
+        'search_user': '30/min',
+        'search_ip': '60/min',
+        'write_user': '60/min',
+        'write_ip': '120/min',
+    },
 }
+
+# Blog
+# Seconds a token is throttled on its own after it authenticated, until then
+# it shares the per-user limit of its IP address with other unverified tokens
+BLOG_KNOWN_TOKEN_TIMEOUT = 24 * 60 * 60
+# Comments older than this are moved to the archive table by `manage.py archive_comments`
+BLOG_COMMENTS_HOT_DAYS = 365
+# Max nesting of comment replies, top-level comments included
+BLOG_COMMENT_MAX_DEPTH = 5
+# Post views are counted in memory and written at most this often, in seconds
+BLOG_VIEWS_FLUSH_INTERVAL = 10
+# Seconds the total counts of post listings are cached
+BLOG_COUNT_CACHE_TIMEOUT = 60
+# Read `page_size` without `page` as the page number, as clients older than
+# the `page` parameter send it, with a warning logged for each request. Other
+# clients then can't send only `page_size`. Turn off once the warnings stop.
+BLOG_LEGACY_PAGE_SIZE_AS_PAGE = True
+# Changes newer than this, in seconds, are left for the next sync so rows
+# committed late by concurrent transactions are not skipped
+BLOG_SYNC_SETTLE_SECONDS = 2
+# Pub/sub backend of live comment streams, replace with a shared one when
+# running more than one ASGI worker
+BLOG_EVENTS_BROKER = 'blog.events.InMemoryBroker'
+# Seconds between keep-alive comments of idle streams
+BLOG_EVENTS_HEARTBEAT = 15
+# Streams end after this many seconds and clients reconnect
+BLOG_EVENTS_STREAM_SECONDS = 300
+# Comments replayed to a reconnecting stream, clients further behind are told to refetch
+BLOG_EVENTS_REPLAY_LIMIT = 100
+# Streams one IP address can hold open at once, counted in the cache
+BLOG_EVENTS_MAX_STREAMS = 5
+# Failed background jobs are retried after this many seconds, doubled on every attempt
+BLOG_JOBS_RETRY_DELAY = 10
+# Running jobs not finished after this many seconds are taken over by another worker
+BLOG_JOBS_TIMEOUT = 600
+# Title suggestions per autocomplete request, and how long and how many
+# prefixes are cached by every process
+BLOG_AUTOCOMPLETE_LIMIT = 10
+BLOG_AUTOCOMPLETE_CACHE_TIMEOUT = 30
+BLOG_AUTOCOMPLETE_CACHE_SIZE = 1000
+# Autocomplete queries taking longer than this, in milliseconds, return no suggestions
+BLOG_AUTOCOMPLETE_TIMEOUT_MS = 50
+# Deleted posts and comments can be restored for this many days, then they are purged
+BLOG_DELETED_RETENTION_DAYS = 30
+# Fraction of post and comment API requests profiled, 0 profiles only requests
+# sending a staff profiling token in the X-Profile header (see `blog.profiling`)
+BLOG_PROFILE_SAMPLE_RATE = 0
+# Seconds a profiling token from /api/profiles/token/ is accepted
+BLOG_PROFILE_TOKEN_MAX_AGE = 60 * 60
+# Profiles kept in the cache, and for how many seconds
+BLOG_PROFILE_KEEP = 50
+BLOG_PROFILE_TIMEOUT = 24 * 60 * 60
@@ -0,0 +1,37 @@
+"""
+Lean settings for API workers.
+
+The API authenticates with tokens only, so the admin, sessions, messages,
+CSRF and template stacks are not loaded. Select it for the workers with
+DJANGO_SETTINGS_MODULE=myblog.settings_api, and compare boot times with
+`python manage.py bench_startup`.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import REST_FRAMEWORK
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+
+    'rest_framework',
+    'rest_framework.authtoken',
+    'djoser',
+
+    'blog.apps.BlogConfig'
+]
+
+# Token authentication is done by DRF, views are CSRF exempt
+MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+TEMPLATES = []
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    # The browsable API needs templates and sessions
+    'DEFAULT_RENDERER_CLASSES': (
+        'rest_framework.renderers.JSONRenderer',
+    ),
+}
@@ -0,0 +1,36 @@
+"""
+Settings for running the test suite without PostgreSQL.
+
+    python manage.py test --settings=myblog.settings_test --parallel
+
+Every worker process gets its own copy of the in-memory database and cache.
+PostgreSQL-only code paths are skipped on SQLite, run the suite with
+myblog.settings before merging changes to them.
+"""
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+# Hashing is the slowest part of creating users
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.MD5PasswordHasher',
+]
+
+# Don't print every query
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'loggers': {
+        'blog': {
+            'level': 'WARNING',
+        }
+    }
+}
+
+# Tests flush post views explicitly
+BLOG_VIEWS_FLUSH_INTERVAL = None
@@ -14,21 +14,28 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.apps import apps
 from django.urls import path, include, re_path
 
 from rest_framework.routers import SimpleRouter
 
-from blog.views import PostViewSet, CommentViewSet, UserPostRelationViewSet
+from blog.views import PostViewSet, CommentViewSet, UserPostRelationViewSet, ProfileViewSet, post_comments_stream
 
 router = SimpleRouter()
 router.register('posts', PostViewSet)
 router.register('comments', CommentViewSet)
 router.register('post_relation', UserPostRelationViewSet)
+router.register('profiles', ProfileViewSet, basename='profile')
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     re_path(r'api/auth/', include('djoser.urls')),
     re_path(r'^auth/', include('djoser.urls.authtoken')),
+    path('api/posts/<int:pk>/comments/stream/', post_comments_stream, name='post-comments-stream'),
     path('api/', include(router.urls))
 ]
+
+# The admin is imported only by settings that install it (not settings_api)
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path('admin/', admin.site.urls))